@@ -0,0 +1,51 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import hashlib
+
+from flask import request
+from flask import Response
+
+from controllers.responses import encodings
+
+def make_etag(*parts) -> str:
+    """
+    Strong entity tag of everything a response depends on.
+
+    Arguments:
+        parts: any JSON serialisable values
+
+    Returns:
+        str
+    """
+    data = json.dumps(parts, default=str, sort_keys=True, separators=(",", ":"))
+
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+def conditional(etag: str, build, cache_control: str = "private, no-cache") -> Response:
+    """
+    Answer a GET with 304 when the client already holds the entity tag,
+    compressed or not, without calling build. Otherwise build the
+    response and tag it.
+
+    Arguments:
+        etag: str (None to skip revalidation),
+        build: callable returning a Response,
+        cache_control: str (optional)
+
+    Returns:
+        Response
+    """
+    if etag is not None and any(request.if_none_match.contains(tag) for tag in [etag] + ["%s-%s" % (etag, encoding) for encoding in encodings]):
+        logger.debug("- Not modified: %s" % etag)
+        res = Response(status=304)
+    else:
+        res = build()
+
+    if etag is not None:
+        res.set_etag(etag)
+
+    res.headers["Cache-Control"] = cache_control
+
+    return res
@@ -0,0 +1,80 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+export = config["EXPORT"]
+sendfile = export.get("SENDFILE", fallback="")
+accel_prefix = export.get("ACCEL_PREFIX", fallback="/datasets")
+
+import os
+import mimetypes
+
+from urllib.parse import quote
+
+from flask import request
+from flask import Response
+
+from werkzeug.utils import send_file
+from werkzeug.exceptions import NotFound
+
+from models.artifacts import Artifact_Model
+from models.artifacts import datasets
+
+mimetypes.add_type("application/vnd.apache.parquet", ".parquet")
+
+def send_artifact(name: str, as_attachment: bool = False) -> Response:
+    """
+    Send an export artifact from the datasets directory.
+
+    The manifest checksum is the entity tag. Without EXPORT.SENDFILE the
+    file is streamed by the API with Range support. With "x-sendfile"
+    (Apache mod_xsendfile) or "x-accel-redirect" (nginx) only headers are
+    sent and the web server reads the file and answers Range requests.
+
+    Arguments:
+        name: str,
+        as_attachment: bool
+
+    Returns:
+        Response
+    """
+    if os.path.basename(name) != name:
+        logger.error("invalid export artifact name '%s'" % name)
+        raise NotFound()
+
+    artifact = Artifact_Model().fetch(name=name)
+
+    path = os.path.abspath(os.path.join(datasets(), name))
+    etag = artifact["checksum"] or True
+
+    if sendfile == "x-accel-redirect":
+        res = Response(mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        res.headers["X-Accel-Redirect"] = "%s/%s" % (accel_prefix.rstrip("/"), quote(name))
+        res.cache_control.no_cache = True
+
+        if as_attachment:
+            res.headers["Content-Disposition"] = "attachment; filename=%s" % name
+
+        if artifact["checksum"]:
+            res.set_etag(artifact["checksum"])
+    else:
+        res = send_file(
+            path,
+            request.environ,
+            as_attachment=as_attachment,
+            download_name=name,
+            etag=etag,
+            conditional=not sendfile,
+            use_x_sendfile=sendfile == "x-sendfile"
+        )
+
+    if sendfile:
+        # revalidation only, the web server answers Range requests itself
+        res = res.make_conditional(request.environ)
+
+        if res.status_code == 304:
+            res.headers.pop("X-Sendfile", None)
+            res.headers.pop("X-Accel-Redirect", None)
+
+    return res
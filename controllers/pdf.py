@@ -0,0 +1,253 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import zlib
+
+from functools import lru_cache
+
+# A4 portrait, in points
+page_width = 595
+page_height = 842
+margin = 40
+
+font_size = 8
+heading_size = 9
+title_size = 10
+leading = 10
+
+# field labels on the left, values wrapped in the rest of the line
+label_width = 170
+value_width = page_width - 2 * margin - label_width
+
+# Helvetica advance widths of printable ASCII, per 1000 units of font size
+widths = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+]
+
+# per character, so a width is one lookup per character
+char_widths = {chr(32 + index): width for index, width in enumerate(widths)}
+
+# anything this short fits whatever its characters
+widest = max(widths)
+
+def text_width(text: str, size: float) -> float:
+    """
+    Width of a line of Helvetica text in points.
+
+    Arguments:
+        text: str,
+        size: float
+
+    Returns:
+        float
+    """
+    return sum([char_widths.get(char, 556) for char in text]) * size / 1000
+
+def wrap(text: str, width: float, size: float) -> list:
+    """
+    Break text into lines no wider than width, splitting long words.
+
+    Arguments:
+        text: str,
+        width: float,
+        size: float
+
+    Returns:
+        list
+    """
+    if len(text) * widest * size / 1000 <= width and not "\n" in text:
+        return [text]
+
+    space = text_width(" ", size)
+    lines = []
+
+    for paragraph in text.splitlines() or [""]:
+        line, line_width = "", 0
+
+        for word in paragraph.split(" "):
+            word_width = text_width(word, size)
+
+            if line and line_width + space + word_width <= width:
+                line, line_width = "%s %s" % (line, word), line_width + space + word_width
+                continue
+            elif not line and word_width <= width:
+                line, line_width = word, word_width
+                continue
+
+            if line:
+                lines.append(line)
+
+            while word_width > width:
+                cut, cut_width = 0, 0
+
+                while cut < len(word) - 1 and cut_width + char_widths.get(word[cut], 556) * size / 1000 <= width:
+                    cut_width += char_widths.get(word[cut], 556) * size / 1000
+                    cut += 1
+
+                cut = max(cut, 1)
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_width = text_width(word, size)
+
+            line, line_width = word, word_width
+
+        lines.append(line)
+
+    return lines
+
+@lru_cache(maxsize=1024)
+def escape(text: str) -> bytes:
+    """
+    Encode text as a PDF string literal in WinAnsiEncoding. Field labels
+    repeat on every record, so recent ones are kept.
+
+    Arguments:
+        text: str
+
+    Returns:
+        bytes
+    """
+    data = text.encode("cp1252", errors="replace")
+
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+class PDF_Writer:
+    """
+    Write a PDF of titled sections of label and value lines, page by page.
+
+    Each page is compressed and written to the file as soon as it is full,
+    so memory holds one page whatever the number of sections. Only the
+    standard Helvetica fonts are used, nothing is embedded.
+
+    Methods:
+        section(heading: str, fields: list) -> None,
+        close() -> None
+    """
+    def __init__(self, fh, title: str) -> None:
+        """
+        Arguments:
+            fh: binary file object,
+            title: str (printed at the top of every page)
+        """
+        self.fh = fh
+        self.title = title
+        self.position = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 5
+        self.sections = 0
+        self.content = None
+        self.y = 0
+
+        self.__write__(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.__object__(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self.__object__(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        self.__object__(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    def section(self, heading: str, fields: list) -> None:
+        """
+        Add a heading followed by one line per field, wrapping long values.
+
+        Arguments:
+            heading: str,
+            fields: list of (label: str, value: any)
+        """
+        # a heading is never left alone at the bottom of a page
+        if self.content is None or self.y - 3 * leading < margin + leading:
+            self.__page__()
+        elif self.sections:
+            self.y -= leading / 2
+
+        self.__text__(margin, self.y, heading, size=heading_size, font="F2")
+        self.content.append(b"%.2f %.2f m %.2f %.2f l S" % (margin, self.y - 3, page_width - margin, self.y - 3))
+        self.y -= leading + 2
+
+        for label, value in fields:
+            lines = wrap(str(value), value_width, font_size)
+
+            for index, line in enumerate(lines):
+                if self.y < margin + leading:
+                    self.__page__()
+
+                # label and value share one text object
+                self.content.append(b"BT /F2 %d Tf %d %.2f Td %s Tj /F1 %d Tf %d 0 Td %s Tj ET" % (
+                    font_size, margin, self.y, escape(label) if index == 0 else b"()", font_size, label_width, escape(line)
+                ))
+                self.y -= leading
+
+        self.sections += 1
+
+    def close(self) -> None:
+        """
+        Write the last page, the page tree and the cross-reference table.
+        The file itself is left open.
+        """
+        if self.content is None:
+            self.__page__()
+
+        if not self.sections:
+            self.__text__(margin, self.y, "No records", size=font_size, font="F1")
+
+        self.__flush__()
+
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.pages)
+        self.__object__(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)))
+
+        xref = self.position
+        size = self.next_id
+
+        self.__write__(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+
+        for object_id in range(1, size):
+            self.__write__(b"%010d 00000 n \n" % self.offsets[object_id])
+
+        self.__write__(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+
+    def __write__(self, data: bytes) -> None:
+        self.fh.write(data)
+        self.position += len(data)
+
+    def __object__(self, object_id: int, body: bytes) -> None:
+        self.offsets[object_id] = self.position
+        self.__write__(b"%d 0 obj\n%s\nendobj\n" % (object_id, body))
+
+    def __text__(self, x: float, y: float, text: str, size: float, font: str) -> None:
+        self.content.append(b"BT /%s %d Tf %.2f %.2f Td %s Tj ET" % (font.encode("ascii"), size, x, y, escape(text)))
+
+    def __page__(self) -> None:
+        """
+        Finish the current page, if any, and start the next one.
+        """
+        if self.content is not None:
+            self.__flush__()
+
+        self.content = []
+        self.y = page_height - margin
+
+        self.__text__(margin, self.y, self.title, size=title_size, font="F2")
+        self.y -= 2 * leading
+
+    def __flush__(self) -> None:
+        """
+        Compress the current page and write it out.
+        """
+        number = "Page %d" % (len(self.pages) + 1)
+        self.__text__(page_width - margin - text_width(number, font_size), margin / 2, number, size=font_size, font="F1")
+
+        stream = zlib.compress(b"\n".join(self.content), 6)
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+
+        self.__object__(content_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream))
+        self.__object__(page_id, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+        ) % (page_width, page_height, content_id))
+
+        self.pages.append(page_id)
+        self.content = None
@@ -0,0 +1,186 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+api = config["API"]
+json_encoder = api.get("JSON_ENCODER", fallback="orjson")
+compress_min_size = api.getint("COMPRESS_MIN_SIZE", fallback=1024)
+compress_level = api.getint("COMPRESS_LEVEL", fallback=6)
+brotli_quality = api.getint("BROTLI_QUALITY", fallback=4)
+
+import json
+import zlib
+import uuid
+
+from datetime import date
+
+from flask import request
+from flask import Response
+
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if json_encoder == "orjson" and not orjson:
+    logger.info("- orjson is not installed, encoding JSON with json")
+    json_encoder = "json"
+
+# lists longer than this are serialised item by item as they are sent
+stream_items = 500
+stream_buffer = 65536
+
+compressible = ["application/json", "text/csv", "text/plain", "text/html"]
+
+# best first
+encodings = ["br", "gzip"] if brotli else ["gzip"]
+
+def default(value):
+    """
+    Values JSON has no type for, written as flask.jsonify writes them.
+    """
+    if isinstance(value, date):
+        return http_date(value)
+    elif isinstance(value, uuid.UUID):
+        return str(value)
+
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+def dumps(data) -> bytes:
+    """
+    Serialise with the configured encoder, keys sorted like flask.jsonify.
+
+    Arguments:
+        data: any
+
+    Returns:
+        bytes
+    """
+    if json_encoder == "orjson":
+        return orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(data, default=default, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def stream(items: list):
+    """
+    Serialise a list one item at a time, in stream_buffer sized chunks.
+    """
+    buffer = bytearray(b"[")
+
+    for index, item in enumerate(items):
+        if index:
+            buffer += b","
+
+        buffer += dumps(item)
+
+        if len(buffer) >= stream_buffer:
+            yield bytes(buffer)
+            buffer.clear()
+
+    buffer += b"]\n"
+    yield bytes(buffer)
+
+def json_response(data, status: int = 200) -> Response:
+    """
+    A JSON response like flask.jsonify builds, serialised with the
+    configured encoder and streamed when it is a long list.
+
+    Arguments:
+        data: any,
+        status: int (optional)
+
+    Returns:
+        Response
+    """
+    if isinstance(data, list) and len(data) > stream_items:
+        return Response(stream(data), status=status, mimetype="application/json")
+
+    return Response(dumps(data) + b"\n", status=status, mimetype="application/json")
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Compress a whole body.
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)
+
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding: str):
+    """
+    Compress a streamed body, flushing each chunk so clients are not kept
+    waiting for the end.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotli_quality)
+
+        for chunk in chunks:
+            yield compressor.process(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")) + compressor.flush()
+
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)
+
+        for chunk in chunks:
+            yield compressor.compress(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        yield compressor.flush()
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress text and JSON responses for clients that accept it: br when
+    brotli is installed, otherwise gzip. Bodies under COMPRESS_MIN_SIZE
+    and files sent from disk are left alone. A strong ETag gets the
+    encoding appended, as the compressed bytes differ.
+
+    Arguments:
+        response: Response
+
+    Returns:
+        Response
+    """
+    if (
+        request.method == "HEAD"
+        or response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or not response.mimetype in compressible
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    encoding = request.accept_encodings.best_match(encodings)
+
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+
+        if len(data) < compress_min_size:
+            return response
+
+        response.set_data(compress(data, encoding))
+
+    response.headers["Content-Encoding"] = encoding
+
+    etag, weak = response.get_etag()
+
+    if etag and not weak:
+        response.set_etag("%s-%s" % (etag, encoding))
+
+    return response
@@ -28,6 +28,15 @@ from schemas.records.lab import Labs
 from schemas.records.follow_up import Follow_ups
 from schemas.records.outcome_recorded import Outcome_recorded
 from schemas.records.tb_treatment_outcome import Tb_treatment_outcomes
+from schemas.records.export_jobs import Export_jobs
+from schemas.records.export_artifacts import Export_artifacts
+from schemas.records.records_search import Records_search
+from schemas.records.records_ingest import Records_ingest
+from schemas.records.records_changes import Records_changes
+from schemas.records.sms_outbox import Sms_outbox
+from schemas.records.sms_operators import Sms_operators
+
+from schemas.migration import missing_indexes
 
 from models.sites import Site_Model
 from models.users import User_Model
@@ -76,6 +85,28 @@ def create_database() -> None:
     except Exception as error:
         raise InternalServerError(error)
 
+def check_indexes(database, models: list) -> list:
+    """
+    Report declared indexes missing from existing tables.
+
+    create_tables() skips the indexes of tables that already exist, so
+    indexes added to a schema reach existing installs through
+    schemas.migration.migrate_indexes().
+
+    Arguments:
+        database: peewee.Database,
+        models: list
+
+    Returns:
+        list
+    """
+    missing = missing_indexes(database, models)
+
+    for table, name, columns, _ in missing:
+        logger.warning("Missing index %s on %s (%s), run schemas.migration.migrate_indexes()" % (name, table, ", ".join(columns)))
+
+    return missing
+
 def create_tables() -> None:
     """
     Create all database tables.
@@ -89,14 +120,15 @@ def create_tables() -> None:
     try:
         # create users database tables
         logger.debug("Syncing database %s ..." % database['MYSQL_USERS_DATABASE'])
-        users_db.create_tables(
-            [
-                Users, 
-                Sessions,
-                Users_sites,
-                Users_otp
-            ]
-        )
+        users_models = [
+            Users, 
+            Sessions,
+            Users_sites,
+            Users_otp
+        ]
+
+        users_db.create_tables(users_models)
+        check_indexes(users_db, users_models)
 
         users_db.close()
 
@@ -104,13 +136,14 @@ def create_tables() -> None:
 
         # create sites database tables
         logger.debug("Syncing database %s ..." % database['MYSQL_SITES_DATABASE'])
-        sites_db.create_tables(
-            [
-                Sites, 
-                Regions,
-                Daughter_sites
-            ]
-        )
+        sites_models = [
+            Sites, 
+            Regions,
+            Daughter_sites
+        ]
+
+        sites_db.create_tables(sites_models)
+        check_indexes(sites_db, sites_models)
 
         sites_db.close()
 
@@ -118,16 +151,24 @@ def create_tables() -> None:
 
         # create records database tables
         logger.debug("Syncing database %s ..." % database['MYSQL_RECORDS_DATABASE'])
-        records_db.create_tables(
-            [
-                Records,
-                Specimen_collections,
-                Labs,
-                Follow_ups,
-                Outcome_recorded,
-                Tb_treatment_outcomes
-            ]
-        )
+        records_models = [
+            Records,
+            Specimen_collections,
+            Labs,
+            Follow_ups,
+            Outcome_recorded,
+            Tb_treatment_outcomes,
+            Export_jobs,
+            Export_artifacts,
+            Records_search,
+            Records_ingest,
+            Records_changes,
+            Sms_outbox,
+            Sms_operators
+        ]
+
+        records_db.create_tables(records_models)
+        check_indexes(records_db, records_models)
 
         records_db.close()
 
@@ -158,7 +199,7 @@ def create_super_admin() -> None:
                 account_status = "approved",
                 account_type = "super_admin",
                 account_approved_date = datetime.now(),
-                permitted_export_types = ["csv", "pdf"],
+                permitted_export_types = ["csv", "pdf", "parquet"],
                 permitted_export_range = 12,
                 permitted_decrypted_data = True,
                 permitted_approve_accounts = True,
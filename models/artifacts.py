@@ -0,0 +1,273 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+export = config["EXPORT"]
+retention_days = export.getint("RETENTION_DAYS", fallback=7)
+sweep_interval = export.getint("SWEEP_INTERVAL", fallback=3600)
+
+import os
+import time
+import hashlib
+import threading
+
+from peewee import DatabaseError
+
+from schemas.records.export_artifacts import Export_artifacts
+
+from datetime import datetime
+from datetime import timedelta
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import NotFound
+
+# rows removed per sweep query
+sweep_batch = 500
+
+threads = []
+threads_lock = threading.Lock()
+
+def datasets() -> str:
+    """
+    Directory export artifacts are written to.
+
+    Returns:
+        str
+    """
+    return "%s/datasets" % export["PATH"]
+
+class Artifact_Model:
+    """
+    Manifest of the export artifacts in the datasets directory.
+
+    Each artifact has a row with its owner, size, checksum and expiry.
+    Expired artifacts are removed by a sweeper thread in each process, so
+    no request walks the directory. Using an artifact again pushes its
+    expiry back.
+
+    Methods:
+        register(name: str, format: str, owner_id: int) -> dict,
+        touch(name: str) -> bool,
+        fetch(name: str) -> dict,
+        start() -> None,
+        sweep() -> int
+    """
+    def __init__(self) -> None:
+        self.Export_artifacts = Export_artifacts
+
+    def register(self, name: str, format: str, owner_id: int = None) -> dict:
+        """
+        Add a file just written to the datasets directory to the manifest.
+
+        Arguments:
+            name: str,
+            format: str,
+            owner_id: int
+
+        Returns:
+            dict
+        """
+        try:
+            checksum = hashlib.sha256()
+            size = 0
+
+            with open(os.path.join(datasets(), name), "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    checksum.update(chunk)
+                    size += len(chunk)
+
+            now = datetime.now()
+
+            artifact = {
+                "name": name,
+                "owner_id": owner_id,
+                "format": format,
+                "size": size,
+                "checksum": checksum.hexdigest(),
+                "createdAt": now,
+                "expiresAt": now + timedelta(days=retention_days)
+            }
+
+            self.Export_artifacts.insert(**artifact).on_conflict_replace().execute()
+
+            logger.info("- Registered export artifact %s (%d bytes)" % (name, size))
+
+            return artifact
+
+        except DatabaseError as err:
+            logger.error("failed to register export artifact %s check logs" % name)
+            raise InternalServerError(err) from None
+
+    def touch(self, name: str) -> bool:
+        """
+        Keep an artifact that is being reused for another retention period.
+
+        Arguments:
+            name: str
+
+        Returns:
+            bool (False when it is not in the manifest or already expired)
+        """
+        try:
+            now = datetime.now()
+
+            updated = self.Export_artifacts.update(expiresAt=now + timedelta(days=retention_days)).where(
+                self.Export_artifacts.name == name,
+                self.Export_artifacts.expiresAt > now
+            ).execute()
+
+            return updated > 0 and os.path.exists(os.path.join(datasets(), name))
+
+        except DatabaseError as err:
+            logger.error("failed to touch export artifact %s check logs" % name)
+            raise InternalServerError(err) from None
+
+    def fetch(self, name: str) -> dict:
+        """
+        Find an artifact that can be downloaded.
+
+        Arguments:
+            name: str
+
+        Returns:
+            dict
+        """
+        try:
+            artifact = (
+                self.Export_artifacts.select()
+                .where(self.Export_artifacts.name == name)
+                .dicts()
+                .get_or_none()
+            )
+
+            if not os.path.exists(os.path.join(datasets(), name)) or (artifact and artifact["expiresAt"] <= datetime.now()):
+                logger.error("No export artifact %s found" % name)
+                raise NotFound()
+
+            # written before the manifest, the sweeper removes it in time
+            if not artifact:
+                artifact = {"name": name, "owner_id": None, "format": None, "size": None, "checksum": None}
+
+            return artifact
+
+        except DatabaseError as err:
+            logger.error("failed to find export artifact %s check logs" % name)
+            raise InternalServerError(err) from None
+
+    def start(self) -> None:
+        """
+        Start this process's sweeper if it is not running.
+        """
+        with threads_lock:
+            if threads:
+                return
+
+            thread = threading.Thread(target=self.__work__, name="export-sweeper", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+            logger.info("- Started export sweeper")
+
+    def sweep(self) -> int:
+        """
+        Remove expired artifacts, and files the manifest does not know of
+        that are older than the retention period.
+
+        Returns:
+            int (files removed)
+        """
+        removed = 0
+
+        while True:
+            now = datetime.now()
+
+            names = [
+                row["name"] for row in
+                self.Export_artifacts.select(self.Export_artifacts.name)
+                .where(self.Export_artifacts.expiresAt <= now)
+                .limit(sweep_batch)
+                .dicts()
+            ]
+
+            for name in names:
+                # a request may have touched it since it was selected
+                deleted = self.Export_artifacts.delete().where(
+                    self.Export_artifacts.name == name,
+                    self.Export_artifacts.expiresAt <= now
+                ).execute()
+
+                if deleted and self.__remove__(name):
+                    removed += 1
+
+            if len(names) < sweep_batch:
+                break
+
+        removed += self.__sweep_unlisted__()
+
+        if removed:
+            logger.info("- Removed %d export artifact(s)" % removed)
+
+        return removed
+
+    def __sweep_unlisted__(self) -> int:
+        """
+        Remove old files without a manifest row: exports written before
+        the manifest existed and temporary files of failed exports.
+        """
+        if not os.path.isdir(datasets()):
+            return 0
+
+        date_limit = datetime.now() - timedelta(days=retention_days)
+        old = []
+
+        with os.scandir(datasets()) as entries:
+            for entry in entries:
+                if entry.is_file() and datetime.fromtimestamp(entry.stat().st_ctime) < date_limit:
+                    old.append(entry.name)
+
+        removed = 0
+
+        for start in range(0, len(old), sweep_batch):
+            batch = old[start:start + sweep_batch]
+
+            listed = {
+                row["name"] for row in
+                self.Export_artifacts.select(self.Export_artifacts.name)
+                .where(self.Export_artifacts.name.in_(batch))
+                .dicts()
+            }
+
+            for name in batch:
+                if not name in listed and self.__remove__(name):
+                    removed += 1
+
+        return removed
+
+    def __remove__(self, name: str) -> bool:
+        try:
+            os.remove(os.path.join(datasets(), name))
+            logger.debug("removed export artifact %s" % name)
+            return True
+
+        except FileNotFoundError:
+            return False
+
+    def __work__(self) -> None:
+        """
+        Sweeper loop.
+        """
+        database = self.Export_artifacts._meta.database
+
+        while True:
+            try:
+                self.sweep()
+
+            except Exception as error:
+                logger.exception(error)
+
+            finally:
+                if not database.is_closed():
+                    database.close()
+
+            time.sleep(sweep_interval)
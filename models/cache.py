@@ -0,0 +1,119 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import threading
+
+from collections import OrderedDict
+
+class TTL_Cache:
+    """
+    Thread-safe, size-bounded LRU cache whose entries expire after a fixed TTL.
+
+    Attributes:
+        maxsize: int,
+        ttl: float (seconds)
+
+    Methods:
+        get(key) -> any,
+        set(key, value) -> None,
+        pop(key) -> any,
+        pop_where(predicate) -> int,
+        clear() -> None,
+        stats() -> dict
+    """
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """
+        Arguments:
+            maxsize: int,
+            ttl: float
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Return the value for key, or default when missing or expired.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                self.__misses += 1
+                return default
+
+            stored, value = entry
+
+            if time.monotonic() - stored >= self.ttl:
+                del self.__entries[key]
+                self.__misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """
+        Store value under key, evicting the least recently used entry when full.
+        """
+        with self.__lock:
+            self.__entries[key] = (time.monotonic(), value)
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove key and return its value.
+        """
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def pop_where(self, predicate) -> int:
+        """
+        Remove every entry whose value satisfies predicate.
+
+        Returns:
+            int
+        """
+        with self.__lock:
+            keys = [key for key, (_, value) in self.__entries.items() if predicate(value)]
+
+            for key in keys:
+                del self.__entries[key]
+
+        return len(keys)
+
+    def clear(self) -> None:
+        """
+        Remove every entry.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Cache usage counters.
+
+        Returns:
+            dict
+        """
+        with self.__lock:
+            return {
+                "size": len(self.__entries),
+                "maxsize": self.maxsize,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions
+            }
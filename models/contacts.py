@@ -1,6 +1,12 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from Configs import baseConfig
+config = baseConfig()
+api = config["API"]
+
+import threading
+
 from security.data import Data
 
 from peewee import DatabaseError
@@ -9,9 +15,31 @@ from schemas.users.users import Users
 from schemas.users.users_sites import Users_sites
 from schemas.records.records import Records
 
+from models.cache import TTL_Cache
+
 from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import Unauthorized
 
+# site_id -> {sms_notifications_type: [phone_number]}, decrypted numbers stay in memory only
+roster = TTL_Cache(
+    maxsize=api.getint("CONTACT_CACHE_SIZE", fallback=1000),
+    ttl=api.getint("CONTACT_CACHE_TTL", fallback=300)
+)
+
+roster_lock = threading.Lock()
+roster_version = 0
+
+def invalidate_roster() -> None:
+    """
+    Drop every site's roster after a user's contact details, status or
+    sites change.
+    """
+    global roster_version
+
+    with roster_lock:
+        roster_version += 1
+        roster.clear()
+
 class Contact_Model:
     """
     """
@@ -25,68 +53,115 @@ class Contact_Model:
 
     def all(self, record_id: int, sms_notification_type: str) -> dict:
         """
+        Gather the numbers to notify about a record.
+
+        Arguments:
+            record_id: int,
+            sms_notification_type: str (comma separated)
+
+        Returns:
+            dict
         """
         try:
-            try:
-                record = self.Records.get(self.Records.record_id == record_id)
-            except self.Records.DoesNotExist:
+            record = (
+                self.Records.select(
+                    self.Records.site_id,
+                    self.Records.records_requester_telephone,
+                    self.Records.records_telephone,
+                    self.Records.records_sms_notifications,
+                    self.Records.iv
+                )
+                .where(self.Records.record_id == record_id)
+                .dicts()
+                .first()
+            )
+
+            if not record:
                 logger.error("Record: %d not found." % record_id)
                 raise Unauthorized()
-            else:
-                logger.debug("finding users that belong to site_id: %d with sms_notification_type: %s ..." % (record.site_id, sms_notification_type))
-                
-                result = {
-                    "lab": [],
-                    "requester": [],
-                    "client": []
-                }
-                
-                data = self.Data()
-
-                notification_type = sms_notification_type.split(",")
-
-                if len(notification_type) == 2:
-                    users = (
-                        self.Users.select(
-                            self.Users.phone_number,
-                            self.Users.iv
-                        )
-                        .where(self.Users.account_status == "approved", self.Users.sms_notifications == True, (self.Users.sms_notifications_type == notification_type[0] | self.Users.sms_notifications_type == notification_type[1]))
-                        .join(self.Users_sites)
-                        .where(self.Users_sites.site_id == record.site_id)
-                        .dicts()
-                    )
-                elif len(notification_type) == 1:
-                    users = (
-                        self.Users.select(
-                            self.Users.phone_number,
-                            self.Users.iv
-                        )
-                        .where(self.Users.account_status == "approved", self.Users.sms_notifications == True, self.Users.sms_notifications_type == notification_type[0])
-                        .join(self.Users_sites)
-                        .where(self.Users_sites.site_id == record.site_id)
-                        .dicts()
-                    )
-
-                for user in users:
-                    iv = user["iv"]
-
-                    result["lab"].append(data.decrypt(user["phone_number"], iv))
-
-                logger.info("- Succesfully gathered lab contacts")
-
-                if record.records_requester_telephone:
-                    result["requester"].append(data.decrypt(record.records_requester_telephone, record.iv))
-                    
-                    logger.info("- Succesfully gathered requester contact")
-                
-                if record.records_sms_notifications:
-                    result["client"].append(data.decrypt(record.records_telephone, record.iv))
-                    
-                    logger.info("- Succesfully gathered client contact")
-
-                return result
+
+            logger.debug("finding users that belong to site_id: %d with sms_notification_type: %s ..." % (record["site_id"], sms_notification_type))
+
+            result = {
+                "lab": [],
+                "requester": [],
+                "client": []
+            }
+
+            site_roster = self.roster(site_id=record["site_id"])
+
+            for notification_type in sms_notification_type.split(","):
+                for phone_number in site_roster.get(notification_type, []):
+                    if not phone_number in result["lab"]:
+                        result["lab"].append(phone_number)
+
+            logger.info("- Succesfully gathered lab contacts")
+
+            data = self.Data()
+            record = data.decrypt_rows(rows=[record], fields=["records_requester_telephone", "records_telephone"])[0]
+
+            if record["records_requester_telephone"]:
+                result["requester"].append(record["records_requester_telephone"])
+
+                logger.info("- Succesfully gathered requester contact")
+
+            if record["records_sms_notifications"] and record["records_telephone"]:
+                result["client"].append(record["records_telephone"])
+
+                logger.info("- Succesfully gathered client contact")
+
+            return result
 
         except DatabaseError as err:
-            logger.error("Failed to find users that belong to site_id: %d with sms_notification_type: %s. Check logs." % (record.site_id, sms_notification_type))
-            raise InternalServerError(err)
\ No newline at end of file
+            logger.error("Failed to find contacts for record: %d with sms_notification_type: %s. Check logs." % (record_id, sms_notification_type))
+            raise InternalServerError(err)
+
+    def roster(self, site_id: int) -> dict:
+        """
+        Phone numbers of a site's approved users who take SMS notifications,
+        by notification type. Built with one query per site and kept until
+        invalidate_roster() or the TTL.
+
+        Arguments:
+            site_id: int
+
+        Returns:
+            dict
+        """
+        site_roster = roster.get(site_id)
+
+        if site_roster is not None:
+            return site_roster
+
+        with roster_lock:
+            version = roster_version
+
+        users = (
+            self.Users.select(
+                self.Users.phone_number,
+                self.Users.sms_notifications_type,
+                self.Users.iv
+            )
+            .join(self.Users_sites)
+            .where(
+                self.Users.account_status == "approved",
+                self.Users.sms_notifications == True,
+                self.Users_sites.site_id == site_id
+            )
+            .dicts()
+        )
+
+        data = self.Data()
+
+        site_roster = {}
+
+        for user in data.decrypt_rows(rows=list(users), fields=["phone_number"]):
+            if user["phone_number"]:
+                site_roster.setdefault(user["sms_notifications_type"], []).append(user["phone_number"])
+
+        # a change made while this roster was read invalidates it
+        with roster_lock:
+            if version == roster_version:
+                roster.set(site_id, site_roster)
+
+        return site_roster
@@ -0,0 +1,243 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+export = config["EXPORT"]
+workers = export.getint("WORKERS", fallback=2)
+job_timeout = export.getint("JOB_TIMEOUT", fallback=3600)
+
+import json
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from peewee import DatabaseError
+from peewee import IntegrityError
+
+from schemas.records.export_jobs import Export_jobs
+from schemas.sites.sites import Sites
+
+from models.exports import Export_Model
+
+from datetime import datetime
+from datetime import timedelta
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import NotFound
+
+executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+
+class Export_Job_Model:
+    """
+    Run exports in a bounded background worker pool.
+
+    Jobs are stored in the records database so any worker process can
+    report on them. Identical exports that are pending or running share a
+    single job.
+
+    Methods:
+        submit(...) -> dict,
+        fetch(job_id: str) -> dict
+    """
+    def __init__(self) -> None:
+        """
+        """
+        self.Export_jobs = Export_jobs
+        self.Export = Export_Model
+
+    def submit(self, user_id: int, format: str, start_date: datetime, end_date: datetime, region_id: str, site_id: str, permitted_decrypted_data: bool) -> dict:
+        """
+        Queue an export, or join an identical one already in progress.
+
+        Arguments:
+            user_id: int,
+            format: str,
+            start_date: datetime,
+            end_date: datetime,
+            region_id: str,
+            site_id: str,
+            permitted_decrypted_data: bool
+
+        Returns:
+            dict
+        """
+        try:
+            key = hashlib.sha256(json.dumps([
+                format,
+                start_date.isoformat(),
+                end_date.isoformat(),
+                str(region_id),
+                str(site_id),
+                bool(permitted_decrypted_data)
+            ]).encode("utf-8")).hexdigest()
+
+            for _ in range(3):
+                try:
+                    job = self.Export_jobs.create(
+                        key=key,
+                        active_key=key,
+                        user_id=user_id,
+                        format=format,
+                        start_date=start_date,
+                        end_date=end_date,
+                        region_id=region_id,
+                        site_id=site_id,
+                        permitted_decrypted_data=permitted_decrypted_data
+                    )
+                except IntegrityError:
+                    active = self.Export_jobs.get_or_none(self.Export_jobs.active_key == key)
+
+                    # finished between our insert and lookup
+                    if not active:
+                        continue
+
+                    stale = active.updatedAt < datetime.now() - timedelta(seconds=job_timeout)
+
+                    # a worker that died mid-export stops updating its job
+                    if active.status == "running" and stale:
+                        logger.error("export job %s timed out" % active.id)
+                        self.__finish__(job_id=active.id, status="failed", error="timed out")
+                        continue
+
+                    # queued in a process that restarted, or behind a long queue:
+                    # run it here too, whichever worker claims it first runs it
+                    if active.status == "pending" and stale:
+                        self.__requeue__(job=active)
+
+                    logger.info("- Joined export job %s" % active.id)
+                    return self.fetch(job_id=active.id)
+                else:
+                    executor.submit(self.__run__, job.id)
+
+                    logger.info("- Queued export job %s" % job.id)
+                    return self.fetch(job_id=job.id)
+
+            raise InternalServerError("failed to queue export job")
+
+        except DatabaseError as err:
+            logger.error("failed to queue export job check logs")
+            raise InternalServerError(err) from None
+
+    def fetch(self, job_id: str) -> dict:
+        """
+        Find an export job.
+
+        Arguments:
+            job_id: str
+
+        Returns:
+            dict
+        """
+        try:
+            job = self.Export_jobs.get_or_none(self.Export_jobs.id == job_id)
+
+            if not job:
+                logger.error("No export job %s found" % job_id)
+                raise NotFound()
+
+            return {
+                "id": job.id,
+                "format": job.format,
+                "status": job.status,
+                "rows_done": job.rows_done,
+                "rows_total": job.rows_total,
+                "start_date": job.start_date,
+                "end_date": job.end_date,
+                "permitted_decrypted_data": job.permitted_decrypted_data,
+                "result": job.result,
+                "error": job.error,
+                "createdAt": job.createdAt,
+                "updatedAt": job.updatedAt
+            }
+
+        except DatabaseError as err:
+            logger.error("failed to find export job %s check logs" % job_id)
+            raise InternalServerError(err) from None
+
+    def __requeue__(self, job) -> bool:
+        """
+        Queue a stale pending job in this process. Only one process wins
+        the job's last update, so it is queued once per timeout.
+        """
+        requeued = self.Export_jobs.update(updatedAt=datetime.now()).where(
+            self.Export_jobs.id == job.id,
+            self.Export_jobs.status == "pending",
+            self.Export_jobs.updatedAt == job.updatedAt
+        ).execute()
+
+        if requeued:
+            executor.submit(self.__run__, job.id)
+
+            logger.info("- Requeued export job %s" % job.id)
+
+        return requeued > 0
+
+    def __update__(self, job_id: str, statuses: list = ["pending", "running"], **fields) -> int:
+        """
+        Update a job that is still in one of statuses, so a job failed by
+        a timeout is never written again.
+        """
+        fields["updatedAt"] = datetime.now()
+
+        return self.Export_jobs.update(**fields).where(
+            self.Export_jobs.id == job_id,
+            self.Export_jobs.status.in_(statuses)
+        ).execute()
+
+    def __finish__(self, job_id: str, status: str, result: str = None, error: str = None) -> int:
+        return self.__update__(job_id, status=status, result=result, error=error, active_key=None)
+
+    def __run__(self, job_id: str) -> None:
+        """
+        Worker entry point.
+        """
+        try:
+            job = self.Export_jobs.get(self.Export_jobs.id == job_id)
+            Export = self.Export()
+
+            params = {
+                "start_date": job.start_date,
+                "end_date": job.end_date,
+                "region_id": job.region_id,
+                "site_id": job.site_id
+            }
+
+            if not self.__update__(job_id, statuses=["pending"], status="running"):
+                logger.error("export job %s is no longer pending" % job_id)
+                return
+
+            rows_total = Export.count(**params)
+
+            self.__update__(job_id, rows_total=rows_total)
+
+            logger.debug("running export job %s (%d rows) ..." % (job_id, rows_total))
+
+            def progress(rows_done: int) -> None:
+                self.__update__(job_id, rows_done=rows_done)
+
+            if job.format == "csv":
+                result = Export.csv(permitted_decrypted_data=job.permitted_decrypted_data, progress=progress, owner_id=job.user_id, **params)
+            elif job.format == "pdf":
+                result = Export.pdf(permitted_decrypted_data=job.permitted_decrypted_data, progress=progress, owner_id=job.user_id, **params)
+            elif job.format == "parquet":
+                result = Export.parquet(permitted_decrypted_data=job.permitted_decrypted_data, progress=progress, owner_id=job.user_id, **params)
+
+            if not self.__finish__(job_id, status="done", result=result):
+                logger.error("export job %s finished after it timed out" % job_id)
+                return
+
+            logger.info("- Export job %s done" % job_id)
+
+        except Exception as error:
+            logger.exception(error)
+
+            try:
+                self.__finish__(job_id, status="failed", error="export failed")
+            except Exception as err:
+                logger.exception(err)
+
+        finally:
+            for database in (self.Export_jobs._meta.database, Sites._meta.database):
+                if not database.is_closed():
+                    database.close()
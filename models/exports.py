@@ -6,654 +6,955 @@ from Configs import baseConfig
 
 config = baseConfig()
 export = config["EXPORT"]
+chunk_size = export.getint("CHUNK_SIZE", fallback=1000)
+stream_buffer = export.getint("STREAM_BUFFER", fallback=65536)
+pdf_renderer = export.get("PDF_RENDERER", fallback="native")
+sync_settle = config["API"].getint("SYNC_SETTLE", fallback=5)
+processes = export.getint("PROCESSES", fallback=1)
+python = export.get("PYTHON", fallback="")
+parquet_row_group_size = export.getint("PARQUET_ROW_GROUP_SIZE", fallback=20000)
+parquet_compression = export.get("PARQUET_COMPRESSION", fallback="zstd")
 
 from security.data import Data
 
 from models.sites import Site_Model
+from models.sites import directory
+from models.artifacts import Artifact_Model
+
+from controllers.pdf import PDF_Writer
 
 from schemas.records.records import Records
+from schemas.records.records_changes import Records_changes
 from schemas.records.specimen_collection import Specimen_collections
 from schemas.records.lab import Labs
 from schemas.records.follow_up import Follow_ups
 from schemas.records.outcome_recorded import Outcome_recorded
 from schemas.records.tb_treatment_outcome import Tb_treatment_outcomes
 
+import io
 import os
+import sys
 import csv
+import json
+import uuid
+import zlib
+import shutil
+import hashlib
 import requests
+import threading
+import multiprocessing
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from flask import jsonify
 
 from datetime import datetime
 from datetime import timedelta
 
+from peewee import fn
+
 from werkzeug.exceptions import InternalServerError
 
+encrypted_fields = [
+    "records_name",
+    "records_address",
+    "records_telephone",
+    "records_telephone_2",
+    "records_art_unique_code",
+    "records_ward_bed_number",
+    "records_requester_name",
+    "records_requester_telephone"
+]
+
+# partitions per pool process, so one slow range does not hold up the rest
+partitions_per_process = 4
+
+pool = None
+pool_lock = threading.Lock()
+
+cache_counters = {"hits": 0, "misses": 0, "uncached": 0}
+cache_lock = threading.Lock()
+
+def cache_stats() -> dict:
+    """
+    Export cache counters for this process.
+
+    Returns:
+        dict
+    """
+    with cache_lock:
+        result = dict(cache_counters)
+
+    total = result["hits"] + result["misses"]
+    result["hit_rate"] = result["hits"] / total if total else None
+
+    return result
+
+def count_cache(counter: str) -> None:
+    with cache_lock:
+        cache_counters[counter] += 1
+
+def interpreter() -> str:
+    """
+    Python interpreter the export processes are spawned with. Under
+    mod_wsgi sys.executable is the web server's binary, so the
+    interpreter of the running prefix is used unless EXPORT.PYTHON
+    names one.
+
+    Returns:
+        str
+    """
+    if python:
+        return python
+
+    if os.path.basename(sys.executable or "").startswith("python"):
+        return sys.executable
+
+    return os.path.join(sys.exec_prefix, "bin", "python3")
+
+def process_pool() -> ProcessPoolExecutor:
+    """
+    Pool of EXPORT.PROCESSES processes shared by this process's exports,
+    started on first use. Workers are spawned, not forked, so they open
+    their own database connections and inherit no locks held by the
+    API's threads.
+
+    Returns:
+        ProcessPoolExecutor
+    """
+    global pool
+
+    with pool_lock:
+        if not pool:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(interpreter())
+
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+            logger.info("- Started %d export process(es)" % processes)
+
+        return pool
+
+def reset_pool() -> None:
+    """
+    Drop the pool, after a worker died or PROCESSES changed. The next
+    export starts a new one.
+    """
+    global pool
+
+    with pool_lock:
+        if pool:
+            pool.shutdown(wait=False)
+
+        pool = None
+
+def export_partition(part_filepath: str, start_date: datetime, end_date: datetime, permitted_decrypted_data: bool, region_id: str, site_id: str, first_record_id: int, last_record_id: int) -> int:
+    """
+    Write the CSV rows, without a header, of the records after
+    first_record_id up to last_record_id. Runs in a pool process.
+
+    Returns:
+        int (rows written)
+    """
+    Export = Export_Model()
+    rows = 0
+
+    try:
+        field_names, child_fields = Export.__csv_fields__()
+
+        with open(part_filepath, 'w') as fh:
+            writer = csv.DictWriter(fh, fieldnames=field_names)
+
+            for csv_row in Export.__csv_rows__(child_fields, start_date, end_date, permitted_decrypted_data, region_id, site_id, first_record_id=first_record_id, last_record_id=last_record_id):
+                writer.writerow(csv_row)
+                rows += 1
+
+        return rows
+
+    finally:
+        for database in (Export.Records._meta.database, Site_Model().Sites._meta.database):
+            if not database.is_closed():
+                database.close()
+
 class Export_Model:
     def __init__(self) -> None:
         """
         """
         self.Records = Records
+        self.Records_changes = Records_changes
         self.Specimen_collections = Specimen_collections
         self.Labs = Labs
         self.Follow_ups = Follow_ups
         self.Outcome_recorded = Outcome_recorded
         self.Tb_treatment_outcomes = Tb_treatment_outcomes
         self.Data = Data
+        self.Artifacts = Artifact_Model()
+
+        # child tables in export column order, with their link to Records
+        self.children = (
+            (Specimen_collections, Specimen_collections.specimen_collection_records_id),
+            (Labs, Labs.lab_records_id),
+            (Follow_ups, Follow_ups.follow_up_records_id),
+            (Outcome_recorded, Outcome_recorded.outcome_recorded_records_id),
+            (Tb_treatment_outcomes, Tb_treatment_outcomes.tb_treatment_outcome_records_id)
+        )
+
+    def __records__(self, start_date: str, end_date: str, region_id: str = None, site_id: str = None):
+        """
+        Select records tested within a date range, optionally scoped to a region and site.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            region_id: str,
+            site_id: str
+
+        Returns:
+            peewee.ModelSelect
+        """
+        records = self.Records.select().where(
+            self.Records.records_date_of_test_request.between(start_date, end_date)
+        )
+
+        if region_id != "all":
+            records = records.where(self.Records.region_id == region_id)
+
+        if site_id != "all":
+            records = records.where(self.Records.site_id == site_id)
+
+        return records
+
+    def __rows__(self, start_date: str, end_date: str, region_id: str = None, site_id: str = None, progress=None, decrypt: bool = False, first_record_id: int = 0, last_record_id: int = None):
+        """
+        Iterate over exported records in chunks of record ids.
+
+        Each chunk costs one records query and one IN (...) query per child
+        table. Only the first child row (lowest id) of each table is kept,
+        matching what the export has always shown. With decrypt, the
+        encrypted fields of a whole chunk are decrypted in one batch.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            region_id: str,
+            site_id: str,
+            progress: callable(rows_done: int) (optional),
+            decrypt: bool (optional),
+            first_record_id: int (exclusive, optional),
+            last_record_id: int (inclusive, optional)
+
+        Yields:
+            (dict, dict)
+        """
+        records = self.__records__(start_date, end_date, region_id, site_id)
+        data = self.Data()
+
+        if last_record_id is not None:
+            records = records.where(self.Records.record_id <= last_record_id)
+
+        after_record_id = first_record_id
+        rows_done = 0
+
+        while True:
+            rows = list(
+                records.where(self.Records.record_id > after_record_id)
+                .order_by(self.Records.record_id)
+                .limit(chunk_size)
+                .dicts()
+            )
+
+            if len(rows) < 1:
+                break
+
+            record_ids = [row["record_id"] for row in rows]
+
+            if decrypt:
+                rows = data.decrypt_rows(rows=rows, fields=encrypted_fields)
+
+            children = {}
+
+            for child, records_id in self.children:
+                children[child] = {}
+
+                child_rows = (
+                    child.select()
+                    .where(records_id.in_(record_ids))
+                    .order_by(records_id, child._meta.primary_key)
+                    .dicts()
+                )
+
+                for child_row in child_rows.iterator():
+                    children[child].setdefault(child_row[records_id.name], child_row)
+
+            for row in rows:
+                yield row, {child: children[child].get(row["record_id"]) for child, _ in self.children}
+
+            rows_done += len(rows)
+
+            if progress:
+                progress(rows_done)
+
+            if len(rows) < chunk_size:
+                break
+
+            after_record_id = record_ids[-1]
+
+    def version(self, region_id: str = None, site_id: str = None) -> int:
+        """
+        Latest change feed position of the records an export scope covers.
+
+        Every write through Record_Model feeds the site and region of the
+        record it touches, so a write elsewhere leaves this unchanged.
+
+        Arguments:
+            region_id: str,
+            site_id: str
+
+        Returns:
+            int (None while a recent write may still be committing)
+        """
+        changes = self.Records_changes.select(fn.MAX(self.Records_changes.seq))
+
+        if region_id != "all":
+            changes = changes.where(self.Records_changes.region_id == region_id)
+
+        if site_id != "all":
+            changes = changes.where(self.Records_changes.site_id == site_id)
+
+        version = changes.scalar() or 0
+
+        if version:
+            created = self.Records_changes.select(self.Records_changes.createdAt).where(self.Records_changes.seq == version).scalar()
+
+            if created > datetime.now() - timedelta(seconds=sync_settle):
+                return None
+
+        return version
+
+    def __cache_file__(self, format: str, start_date: datetime, end_date: datetime, permitted_decrypted_data: bool, region_id: str = None, site_id: str = None) -> str:
+        """
+        Name of the cached artifact of an export, addressed by everything
+        its contents depend on. None when the export cannot be cached yet.
+        """
+        version = self.version(region_id, site_id)
+
+        if version is None:
+            count_cache("uncached")
+            return None
+
+        key = hashlib.sha256(json.dumps([
+            format,
+            start_date.isoformat(),
+            end_date.isoformat(),
+            str(region_id),
+            str(site_id),
+            bool(permitted_decrypted_data),
+            version,
+            directory.etag(),
+            list(self.Records._meta.fields.keys()) + [name for child, _ in self.children for name in child._meta.fields.keys()]
+        ]).encode("utf-8")).hexdigest()
+
+        return "%s_%s_record_export_%s.%s" % (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), key[:16], format)
+
+    def __export_path__(self, format: str, start_date: datetime, end_date: datetime, permitted_decrypted_data: bool, region_id: str = None, site_id: str = None) -> tuple:
+        """
+        Path of an export artifact, and whether it is already there.
+
+        Returns:
+            (str, bool)
+        """
+        if not os.path.exists("%s/datasets" % export["PATH"]):
+            error_msg = "dataset directory not found at '%s'" % export["PATH"]
+            raise FileNotFoundError(error_msg)
+
+        export_file = self.__cache_file__(format, start_date, end_date, permitted_decrypted_data, region_id, site_id)
+
+        if not export_file:
+            export_file = "%s_record_export_%s.%s" % (datetime.now().strftime("%m-%d-%Y-%H_%M_%S"), uuid.uuid4().hex, format)
+
+            return os.path.join("%s/datasets" % export["PATH"], export_file), False
+
+        export_filepath = os.path.join("%s/datasets" % export["PATH"], export_file)
 
-    def csv(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None) -> str:
+        if self.Artifacts.touch(export_file):
+            count_cache("hits")
+
+            logger.info("- Export cache hit: %s" % export_file)
+
+            return export_filepath, True
+
+        count_cache("misses")
+
+        return export_filepath, False
+
+    def count(self, start_date: str, end_date: str, region_id: str = None, site_id: str = None) -> int:
         """
+        Count the records an export would contain.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            region_id: str,
+            site_id: str
+
+        Returns:
+            int
         """
         try:
-            Site = Site_Model()
+            return self.__records__(start_date, end_date, region_id, site_id).count()
+
+        except Exception as error:
+            raise InternalServerError(error)
+
+    def __names__(self) -> tuple:
+        """
+        Map site and region ids to their names.
+
+        Returns:
+            (dict, dict)
+        """
+        return directory.names()
+
+    def __csv_fields__(self) -> tuple:
+        """
+        CSV header and the child columns filled in for each row.
+
+        Returns:
+            (list, dict)
+        """
+        field_names = []
+
+        for record_names in self.Records._meta.fields.keys():
+            if record_names == "site_id":
+                field_names.append("site_name")
+            elif record_names == "region_id":
+                field_names.append("region_name")
+            elif record_names == "iv":
+                pass
+            else:
+                field_names.append(record_names)
+
+        # each child's id, record id and creation date are left blank
+        child_fields = {}
+
+        for child, records_id in self.children:
+            primary_key = child._meta.primary_key.name
+            created = primary_key[:-len("_id")] + "_date"
+
+            child_fields[child] = []
+
+            for child_names in child._meta.fields.keys():
+                field_names.append(child_names)
+
+                if not child_names in [primary_key, records_id.name, created]:
+                    child_fields[child].append(child_names)
+
+        return field_names, child_fields
+
+    def __csv_rows__(self, child_fields: dict, start_date: str, end_date: str, permitted_decrypted_data: bool, region_id: str = None, site_id: str = None, progress=None, first_record_id: int = 0, last_record_id: int = None):
+        """
+        Iterate over CSV rows.
+
+        Yields:
+            dict
+        """
+        site_names, region_names = self.__names__()
 
-            field_names = []
+        for row, children in self.__rows__(start_date, end_date, region_id, site_id, progress, decrypt=permitted_decrypted_data, first_record_id=first_record_id, last_record_id=last_record_id):
+            csv_row = {}
 
-            for record_names in self.Records._meta.fields.keys():
-                if record_names == "site_id":
-                    field_names.append("site_name")
-                elif record_names == "region_id":
-                    field_names.append("region_name")
-                elif record_names == "iv":
+            for record_field in self.Records._meta.fields.keys():
+                if record_field == "site_id":
+                    csv_row["site_name"] = site_names[row["site_id"]]
+                elif record_field == "region_id":
+                    csv_row["region_name"] = region_names[row["region_id"]]
+                elif record_field == "iv":
                     pass
                 else:
-                    field_names.append(record_names)
+                    csv_row[record_field] = row[record_field]
 
-            for specimen_collections_names in self.Specimen_collections._meta.fields.keys():
-                field_names.append(specimen_collections_names)
+            for child, child_row in children.items():
+                for child_field in child_fields[child]:
+                    csv_row[child_field] = None if not child_row else child_row[child_field]
 
-            for labs_names in self.Labs._meta.fields.keys():
-                field_names.append(labs_names)
+            yield csv_row
 
-            for follow_ups_names in self.Follow_ups._meta.fields.keys():
-                field_names.append(follow_ups_names)
+    def __partitions__(self, start_date: str, end_date: str, region_id: str = None, site_id: str = None, workers: int = 1) -> list:
+        """
+        Split an export into ranges of record ids for a process pool.
+        Exports of up to one chunk are not split.
+
+        Returns:
+            list (of (first_record_id exclusive, last_record_id inclusive))
+        """
+        first, last, count = (
+            self.__records__(start_date, end_date, region_id, site_id)
+            .select(fn.MIN(self.Records.record_id), fn.MAX(self.Records.record_id), fn.COUNT(self.Records.record_id))
+            .tuples()
+            .get()
+        )
+
+        if workers < 2 or not count or count <= chunk_size:
+            return []
 
-            for outcome_recorded_names in self.Outcome_recorded._meta.fields.keys():
-                field_names.append(outcome_recorded_names)
+        parts = min(workers * partitions_per_process, -(-count // chunk_size))
+        step = -(-(last - first + 1) // parts)
 
-            for tb_treatment_outcomes_names in self.Tb_treatment_outcomes._meta.fields.keys():
-                field_names.append(tb_treatment_outcomes_names)
+        return [(after, min(after + step, last)) for after in range(first - 1, last, step)]
 
-            now = datetime.now()
-            date_time = now.strftime("%m-%d-%Y-%H_%M_%S")
+    def __csv_file__(self, filepath: str, start_date: str, end_date: str, permitted_decrypted_data: bool, region_id: str = None, site_id: str = None, progress=None) -> None:
+        """
+        Write a whole CSV export to filepath.
+
+        With EXPORT.PROCESSES above one, the records are split into ranges of
+        record ids that pool processes write to part files, and the parts
+        are appended in order. The file is the same as a serial export's.
+
+        Arguments:
+            filepath: str,
+            start_date: str,
+            end_date: str,
+            permitted_decrypted_data: bool,
+            region_id: str,
+            site_id: str,
+            progress: callable(rows_done: int) (optional)
+        """
+        field_names, child_fields = self.__csv_fields__()
 
-            export_file = '%s_record_export.csv' % date_time
+        partitions = self.__partitions__(start_date, end_date, region_id, site_id, processes)
 
-            if not os.path.exists("%s/datasets" % export["PATH"]):
-                error_msg = "dataset directory not found at '%s'" % export["PATH"]
-                raise FileNotFoundError(error_msg)
+        with open(filepath, 'w') as fh:
+            writer = csv.DictWriter(fh, fieldnames=field_names)
+            writer.writeheader()
 
-            export_filepath = os.path.join("%s/datasets" % export["PATH"], export_file)
-            
-            logger.debug("Gathering data ...")
+            if not partitions:
+                for csv_row in self.__csv_rows__(child_fields, start_date, end_date, permitted_decrypted_data, region_id, site_id, progress):
+                    writer.writerow(csv_row)
 
-            if region_id == "all" and site_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date)
-                    ).dicts()        
-            elif region_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date), 
-                    self.Records.site_id == site_id
-                    ).dicts()       
-            elif site_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date), 
-                    self.Records.region_id == region_id
-                    ).dicts()        
-            else:
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date),
-                    self.Records.region_id == region_id,
-                    self.Records.site_id == site_id
-                    ).dicts()
+                return
+
+        logger.debug("exporting %d partition(s) across %d process(es) ..." % (len(partitions), processes))
+
+        part_filepaths = ["%s.%d" % (filepath, index) for index in range(len(partitions))]
+
+        futures = [
+            process_pool().submit(export_partition, part_filepath, start_date, end_date, permitted_decrypted_data, region_id, site_id, first_record_id, last_record_id)
+            for part_filepath, (first_record_id, last_record_id) in zip(part_filepaths, partitions)
+        ]
+
+        try:
+            rows_done = 0
+
+            with open(filepath, 'ab') as fh:
+                for future, part_filepath in zip(futures, part_filepaths):
+                    rows_done += future.result()
+
+                    with open(part_filepath, 'rb') as part:
+                        shutil.copyfileobj(part, fh, 1 << 20)
+
+                    os.remove(part_filepath)
+
+                    if progress:
+                        progress(rows_done)
+
+        except BrokenProcessPool:
+            reset_pool()
+            raise
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+            # a part a worker creates after this is left to the sweeper
+            for part_filepath in part_filepaths:
+                if os.path.exists(part_filepath):
+                    os.remove(part_filepath)
+
+    def csv_filename(self) -> str:
+        """
+        Name of a CSV export created now.
+
+        Returns:
+            str
+        """
+        date_time = datetime.now().strftime("%m-%d-%Y-%H_%M_%S")
+
+        return '%s_record_export.csv' % date_time
+
+    def csv(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None, progress=None, owner_id: int = None) -> str:
+        """
+        Write a CSV export into the datasets directory, or return the
+        artifact of the same export if no record in its scope has changed
+        since it was written.
+        """
+        try:
+            export_filepath, cached = self.__export_path__("csv", start_date, end_date, permitted_decrypted_data, region_id, site_id)
+            export_file = os.path.basename(export_filepath)
+
+            if cached:
+                return "%s/%s" % ("/downloads", export_file)
 
             logger.debug("exporting data please wait ...")
 
             logger.info("export path: %s" % export_filepath)
 
-            with open(export_filepath, 'w') as fh:
-                writer = csv.DictWriter(fh, fieldnames=field_names)
-                writer.writeheader()        
+            part_filepath = "%s.%s.part" % (export_filepath, uuid.uuid4().hex[:8])
 
-                for row in records.iterator():
-                    site_name = Site.fetch_site(site_id=row["site_id"])["name"]
-                    region_name = Site.fetch_region(region_id=row["region_id"])["name"]
+            self.__csv_file__(part_filepath, start_date, end_date, permitted_decrypted_data, region_id, site_id, progress)
 
-                    # specimen_collections
-                    specimen_collections_results = []
+            # a download or cache hit never sees a half written file
+            os.replace(part_filepath, export_filepath)
 
-                    specimen_collections = (
-                        self.Specimen_collections.select()
-                        .where(self.Specimen_collections.specimen_collection_records_id == row['record_id'])
-                        .dicts()
-                    )
+            self.Artifacts.register(name=export_file, format="csv", owner_id=owner_id)
 
-                    for specimen_collection in specimen_collections:
-                        specimen_collections_results.append(specimen_collection)
-            
-                    # labs
-                    labs_results = []
+            logger.info("- Export complete")
 
-                    labs = (
-                        self.Labs.select()
-                        .where(self.Labs.lab_records_id == row['record_id'])
-                        .dicts()
-                    )
+            return "%s/%s" % ("/downloads", export_file)
 
-                    for lab in labs:
-                        labs_results.append(lab)
+        except Exception as error:
+            raise InternalServerError(error)
 
-                    # follow_ups
-                    follow_ups_results = []
-    
-                    follow_ups = (
-                        self.Follow_ups.select()
-                        .where(self.Follow_ups.follow_up_records_id == row['record_id'])
-                        .dicts()
-                    )
+    def __parquet_schema__(self, field_names: list) -> tuple:
+        """
+        Arrow schema of a Parquet export: the CSV export's columns, typed
+        after their database fields.
 
-                    for follow_up in follow_ups:
-                        follow_ups_results.append(follow_up)
+        Arguments:
+            field_names: list
 
-                    # outcomes_recorded
-                    outcomes_recorded_results = []
-            
-                    outcomes_recorded = (
-                        self.Outcome_recorded.select()
-                        .where(self.Outcome_recorded.outcome_recorded_records_id == row['record_id'])
-                        .dicts()
-                    )
+        Returns:
+            (pyarrow.Schema, list (string columns to dictionary encode))
+        """
+        types = {
+            "INT": pyarrow.int64(),
+            "BIGINT": pyarrow.int64(),
+            "AUTO": pyarrow.int64(),
+            "BIGAUTO": pyarrow.int64(),
+            "BOOL": pyarrow.bool_(),
+            "FLOAT": pyarrow.float64(),
+            "DOUBLE": pyarrow.float64(),
+            "DATE": pyarrow.date32(),
+            "DATETIME": pyarrow.timestamp("us")
+        }
 
-                    for outcome_recorded in outcomes_recorded:
-                        outcomes_recorded_results.append(outcome_recorded)
+        fields = dict(self.Records._meta.fields)
 
-                    # tb_treatment_outcomes
-                    tb_treatment_outcomes_results = []
-            
-                    tb_treatment_outcomes = (
-                        self.Tb_treatment_outcomes.select()
-                        .where(self.Tb_treatment_outcomes.tb_treatment_outcome_records_id == row['record_id'])
-                        .dicts()
-                    )
+        for child, _ in self.children:
+            fields.update(child._meta.fields)
 
-                    for tb_treatment_outcome in tb_treatment_outcomes:
-                        tb_treatment_outcomes_results.append(tb_treatment_outcome)
-
-                    if permitted_decrypted_data:
-                        iv = row['iv']
-
-                        data = self.Data()
-
-                        writer.writerow({
-                            'record_id':row['record_id'],
-                            'site_name':site_name,
-                            'region_name':region_name,
-                            'records_user_id':row['records_user_id'],
-                            'records_date':row['records_date'],
-                            'records_name': data.decrypt(row['records_name'], iv),
-                            'records_age':row['records_age'],
-                            'records_sex':row['records_sex'],
-                            'records_date_of_test_request':row['records_date_of_test_request'],
-                            'records_address': data.decrypt(row['records_address'], iv),
-                            'records_telephone': data.decrypt(row['records_telephone'], iv),
-                            'records_telephone_2': data.decrypt(row['records_telephone_2'], iv),
-                            'records_has_art_unique_code':row['records_has_art_unique_code'],
-                            'records_art_unique_code': data.decrypt(row['records_art_unique_code'], iv),
-                            'records_status':row['records_status'],
-                            'records_ward_bed_number': data.decrypt(row['records_ward_bed_number'], iv),
-                            'records_currently_pregnant':row['records_currently_pregnant'],
-                            'records_symptoms_current_cough':row['records_symptoms_current_cough'],
-                            'records_symptoms_fever':row['records_symptoms_fever'],
-                            'records_symptoms_night_sweats':row['records_symptoms_night_sweats'],
-                            'records_symptoms_weight_loss':row['records_symptoms_weight_loss'],
-                            'records_symptoms_none_of_the_above':row['records_symptoms_none_of_the_above'],
-                            'records_patient_category_hospitalized':row['records_patient_category_hospitalized'],
-                            'records_patient_category_child':row['records_patient_category_child'],
-                            'records_patient_category_to_initiate_art':row['records_patient_category_to_initiate_art'],
-                            'records_patient_category_on_art_symptomatic':row['records_patient_category_on_art_symptomatic'],
-                            'records_patient_category_outpatient':row['records_patient_category_outpatient'],
-                            'records_patient_category_anc':row['records_patient_category_anc'],
-                            'records_patient_category_diabetes_clinic':row['records_patient_category_diabetes_clinic'],
-                            'records_patient_category_prisoner':row['records_patient_category_prisoner'],
-                            'records_patient_category_other':row['records_patient_category_other'],
-                            'records_reason_for_test':row['records_reason_for_test'],
-                            'records_reason_for_test_follow_up_months':row['records_reason_for_test_follow_up_months'],
-                            'records_tb_treatment_history':row['records_tb_treatment_history'],
-                            'records_tb_treatment_history_contact_of_tb_patient': row['records_tb_treatment_history_contact_of_tb_patient'],
-                            'records_tb_treatment_history_other': row['records_tb_treatment_history_other'],
-                            'records_tb_type':row['records_tb_type'],
-                            'records_tb_treatment_number':row['records_tb_treatment_number'],
-                            'records_sms_notifications':row['records_sms_notifications'],
-                            'records_requester_name': data.decrypt(row['records_requester_name'], iv),
-                            'records_requester_telephone': data.decrypt(row['records_requester_telephone'], iv),
-
-                            'specimen_collection_user_id': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_user_id'],
-                            'specimen_collection_1_date': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_date'],
-                            'specimen_collection_1_specimen_collection_type': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_specimen_collection_type'],
-                            'specimen_collection_1_other': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_other'],
-                            'specimen_collection_1_period': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_period'],
-                            'specimen_collection_1_aspect': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_aspect'],
-                            'specimen_collection_1_received_by': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_received_by'],
-                            'specimen_collection_2_date': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_date'],
-                            'specimen_collection_2_specimen_collection_type': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_specimen_collection_type'],
-                            'specimen_collection_2_other': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_other'],
-                            'specimen_collection_2_period': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_period'],
-                            'specimen_collection_2_aspect': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_aspect'],
-                            'specimen_collection_2_received_by': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_received_by'],
-
-                            'lab_user_id': None if len(labs_results)<1 else labs_results[0]['lab_user_id'],
-                            'lab_date_specimen_collection_received': None if len(labs_results)<1 else labs_results[0]['lab_date_specimen_collection_received'],
-                            'lab_received_by': None if len(labs_results)<1 else labs_results[0]['lab_received_by'],
-                            'lab_registration_number': None if len(labs_results)<1 else labs_results[0]['lab_registration_number'],
-                            'lab_smear_microscopy_result_result_1': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_result_1'],
-                            'lab_smear_microscopy_result_result_2': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_result_2'],
-                            'lab_smear_microscopy_result_date': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_date'],
-                            'lab_smear_microscopy_result_done_by': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_done_by'],
-                            'lab_xpert_mtb_rif_assay_result': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_result'],
-                            'lab_xpert_mtb_rif_assay_grades': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_grades'],
-                            'lab_xpert_mtb_rif_assay_rif_result': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_rif_result'],
-                            'lab_xpert_mtb_rif_assay_result_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_result_2'],
-                            'lab_xpert_mtb_rif_assay_grades_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_grades_2'],
-                            'lab_xpert_mtb_rif_assay_rif_result_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_rif_result_2'],
-                            'lab_xpert_mtb_rif_assay_date': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_date'],
-                            'lab_xpert_mtb_rif_assay_done_by': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_done_by'],
-                            'lab_urine_lf_lam_result': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_result'],
-                            'lab_urine_lf_lam_date': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_date'],
-                            'lab_urine_lf_lam_done_by': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_done_by'],
-                            'lab_culture_mgit_culture': None if len(labs_results)<1 else labs_results[0]['lab_culture_mgit_culture'],
-                            'lab_culture_lj_culture': None if len(labs_results)<1 else labs_results[0]['lab_culture_lj_culture'],
-                            'lab_culture_date': None if len(labs_results)<1 else labs_results[0]['lab_culture_date'],
-                            'lab_culture_done_by': None if len(labs_results)<1 else labs_results[0]['lab_culture_done_by'],
-                            'lab_lpa_mtbdrplus_isoniazid': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrplus_isoniazid'],
-                            'lab_lpa_mtbdrplus_rifampin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrplus_rifampin'],
-                            'lab_lpa_mtbdrs_flouoroquinolones': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_flouoroquinolones'],
-                            'lab_lpa_mtbdrs_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_kanamycin'],
-                            'lab_lpa_mtbdrs_amikacin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_amikacin'],
-                            'lab_lpa_mtbdrs_capreomycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_capreomycin'],
-                            'lab_lpa_mtbdrs_low_level_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_low_level_kanamycin'],
-                            'lab_lpa_date': None if len(labs_results)<1 else labs_results[0]['lab_lpa_date'],
-                            'lab_lpa_done_by': None if len(labs_results)<1 else labs_results[0]['lab_lpa_done_by'],
-                            'lab_dst_isonazid': None if len(labs_results)<1 else labs_results[0]['lab_dst_isonazid'],
-                            'lab_dst_rifampin': None if len(labs_results)<1 else labs_results[0]['lab_dst_rifampin'],
-                            'lab_dst_ethambutol': None if len(labs_results)<1 else labs_results[0]['lab_dst_ethambutol'],
-                            'lab_dst_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_kanamycin'],
-                            'lab_dst_ofloxacin': None if len(labs_results)<1 else labs_results[0]['lab_dst_ofloxacin'],
-                            'lab_dst_levofloxacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_levofloxacinekanamycin'],
-                            'lab_dst_moxifloxacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_moxifloxacinekanamycin'],
-                            'lab_dst_amikacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_amikacinekanamycin'],
-                            'lab_dst_date': None if len(labs_results)<1 else labs_results[0]['lab_dst_date'],
-                            'lab_dst_done_by': None if len(labs_results)<1 else labs_results[0]['lab_dst_done_by'],
-
-                            'follow_up_user_id': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_user_id'],
-                            'follow_up_xray': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_xray'],
-                            'follow_up_amoxicillin': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_amoxicillin'],
-                            'follow_up_other_antibiotic': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_other_antibiotic'],
-                            'follow_up_schedule_date': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_schedule_date'],
-                            'follow_up_comments': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_comments'],
-
-                            'outcome_recorded_user_id': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_user_id'],
-                            'outcome_recorded_started_tb_treatment_outcome': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_started_tb_treatment_outcome'],
-                            'outcome_recorded_tb_rx_number': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_tb_rx_number'],
-                            'outcome_recorded_other': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_other'],
-                            'outcome_recorded_comments': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_comments'],
-
-                            'tb_treatment_outcome_user_id': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_user_id'],
-                            'tb_treatment_outcome_result': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_result'],
-                            'tb_treatment_outcome_comments': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_comments'],
-                            'tb_treatment_outcome_close_patient_file': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_close_patient_file']
-                        })
-                    else:
-                        writer.writerow({
-                            'record_id':row['record_id'],
-                            'site_name':site_name,
-                            'region_name':region_name,
-                            'records_user_id':row['records_user_id'],
-                            'records_date':row['records_date'],
-                            'records_name':row['records_name'],
-                            'records_age':row['records_age'],
-                            'records_sex':row['records_sex'],
-                            'records_date_of_test_request':row['records_date_of_test_request'],
-                            'records_address':row['records_address'],
-                            'records_telephone':row['records_telephone'],
-                            'records_telephone_2':row['records_telephone_2'],
-                            'records_has_art_unique_code':row['records_has_art_unique_code'],
-                            'records_art_unique_code':row['records_art_unique_code'],
-                            'records_status':row['records_status'],
-                            'records_ward_bed_number':row['records_ward_bed_number'],
-                            'records_currently_pregnant':row['records_currently_pregnant'],
-                            'records_symptoms_current_cough':row['records_symptoms_current_cough'],
-                            'records_symptoms_fever':row['records_symptoms_fever'],
-                            'records_symptoms_night_sweats':row['records_symptoms_night_sweats'],
-                            'records_symptoms_weight_loss':row['records_symptoms_weight_loss'],
-                            'records_symptoms_none_of_the_above':row['records_symptoms_none_of_the_above'],
-                            'records_patient_category_hospitalized':row['records_patient_category_hospitalized'],
-                            'records_patient_category_child':row['records_patient_category_child'],
-                            'records_patient_category_to_initiate_art':row['records_patient_category_to_initiate_art'],
-                            'records_patient_category_on_art_symptomatic':row['records_patient_category_on_art_symptomatic'],
-                            'records_patient_category_outpatient':row['records_patient_category_outpatient'],
-                            'records_patient_category_anc':row['records_patient_category_anc'],
-                            'records_patient_category_diabetes_clinic':row['records_patient_category_diabetes_clinic'],
-                            'records_patient_category_prisoner':row['records_patient_category_prisoner'],
-                            'records_patient_category_other':row['records_patient_category_other'],
-                            'records_reason_for_test':row['records_reason_for_test'],
-                            'records_reason_for_test_follow_up_months':row['records_reason_for_test_follow_up_months'],
-                            'records_tb_treatment_history':row['records_tb_treatment_history'],
-                            'records_tb_treatment_history_contact_of_tb_patient':row['records_tb_treatment_history_contact_of_tb_patient'],
-                            'records_tb_treatment_history_other': row['records_tb_treatment_history_other'],
-                            'records_tb_type':row['records_tb_type'],
-                            'records_tb_treatment_number':row['records_tb_treatment_number'],
-                            'records_sms_notifications':row['records_sms_notifications'],
-                            'records_requester_name': row['records_requester_name'],
-                            'records_requester_telephone': row['records_requester_telephone'],
-
-                            'specimen_collection_user_id': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_user_id'],
-                            'specimen_collection_1_date': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_date'],
-                            'specimen_collection_1_specimen_collection_type': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_specimen_collection_type'],
-                            'specimen_collection_1_other': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_other'],
-                            'specimen_collection_1_period': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_period'],
-                            'specimen_collection_1_aspect': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_aspect'],
-                            'specimen_collection_1_received_by': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_1_received_by'],
-                            'specimen_collection_2_date': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_date'],
-                            'specimen_collection_2_specimen_collection_type': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_specimen_collection_type'],
-                            'specimen_collection_2_other': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_other'],
-                            'specimen_collection_2_period': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_period'],
-                            'specimen_collection_2_aspect': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_aspect'],
-                            'specimen_collection_2_received_by': None if len(specimen_collections_results)<1 else specimen_collections_results[0]['specimen_collection_2_received_by'],
-
-                            'lab_user_id': None if len(labs_results)<1 else labs_results[0]['lab_user_id'],
-                            'lab_date_specimen_collection_received': None if len(labs_results)<1 else labs_results[0]['lab_date_specimen_collection_received'],
-                            'lab_received_by': None if len(labs_results)<1 else labs_results[0]['lab_received_by'],
-                            'lab_registration_number': None if len(labs_results)<1 else labs_results[0]['lab_registration_number'],
-                            'lab_smear_microscopy_result_result_1': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_result_1'],
-                            'lab_smear_microscopy_result_result_2': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_result_2'],
-                            'lab_smear_microscopy_result_date': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_date'],
-                            'lab_smear_microscopy_result_done_by': None if len(labs_results)<1 else labs_results[0]['lab_smear_microscopy_result_done_by'],
-                            'lab_xpert_mtb_rif_assay_result': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_result'],
-                            'lab_xpert_mtb_rif_assay_grades': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_grades'],
-                            'lab_xpert_mtb_rif_assay_rif_result': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_rif_result'],
-                            'lab_xpert_mtb_rif_assay_result_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_result_2'],
-                            'lab_xpert_mtb_rif_assay_grades_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_grades_2'],
-                            'lab_xpert_mtb_rif_assay_rif_result_2': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_rif_result_2'],
-                            'lab_xpert_mtb_rif_assay_date': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_date'],
-                            'lab_xpert_mtb_rif_assay_done_by': None if len(labs_results)<1 else labs_results[0]['lab_xpert_mtb_rif_assay_done_by'],
-                            'lab_urine_lf_lam_result': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_result'],
-                            'lab_urine_lf_lam_date': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_date'],
-                            'lab_urine_lf_lam_done_by': None if len(labs_results)<1 else labs_results[0]['lab_urine_lf_lam_done_by'],
-                            'lab_culture_mgit_culture': None if len(labs_results)<1 else labs_results[0]['lab_culture_mgit_culture'],
-                            'lab_culture_lj_culture': None if len(labs_results)<1 else labs_results[0]['lab_culture_lj_culture'],
-                            'lab_culture_date': None if len(labs_results)<1 else labs_results[0]['lab_culture_date'],
-                            'lab_culture_done_by': None if len(labs_results)<1 else labs_results[0]['lab_culture_done_by'],
-                            'lab_lpa_mtbdrplus_isoniazid': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrplus_isoniazid'],
-                            'lab_lpa_mtbdrplus_rifampin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrplus_rifampin'],
-                            'lab_lpa_mtbdrs_flouoroquinolones': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_flouoroquinolones'],
-                            'lab_lpa_mtbdrs_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_kanamycin'],
-                            'lab_lpa_mtbdrs_amikacin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_amikacin'],
-                            'lab_lpa_mtbdrs_capreomycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_capreomycin'],
-                            'lab_lpa_mtbdrs_low_level_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_lpa_mtbdrs_low_level_kanamycin'],
-                            'lab_lpa_date': None if len(labs_results)<1 else labs_results[0]['lab_lpa_date'],
-                            'lab_lpa_done_by': None if len(labs_results)<1 else labs_results[0]['lab_lpa_done_by'],
-                            'lab_dst_isonazid': None if len(labs_results)<1 else labs_results[0]['lab_dst_isonazid'],
-                            'lab_dst_rifampin': None if len(labs_results)<1 else labs_results[0]['lab_dst_rifampin'],
-                            'lab_dst_ethambutol': None if len(labs_results)<1 else labs_results[0]['lab_dst_ethambutol'],
-                            'lab_dst_kanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_kanamycin'],
-                            'lab_dst_ofloxacin': None if len(labs_results)<1 else labs_results[0]['lab_dst_ofloxacin'],
-                            'lab_dst_levofloxacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_levofloxacinekanamycin'],
-                            'lab_dst_moxifloxacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_moxifloxacinekanamycin'],
-                            'lab_dst_amikacinekanamycin': None if len(labs_results)<1 else labs_results[0]['lab_dst_amikacinekanamycin'],
-                            'lab_dst_date': None if len(labs_results)<1 else labs_results[0]['lab_dst_date'],
-                            'lab_dst_done_by': None if len(labs_results)<1 else labs_results[0]['lab_dst_done_by'],
-
-                            'follow_up_user_id': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_user_id'],
-                            'follow_up_xray': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_xray'],
-                            'follow_up_amoxicillin': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_amoxicillin'],
-                            'follow_up_other_antibiotic': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_other_antibiotic'],
-                            'follow_up_schedule_date': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_schedule_date'],
-                            'follow_up_comments': None if len(follow_ups_results)<1 else follow_ups_results[0]['follow_up_comments'],
-
-                            'outcome_recorded_user_id': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_user_id'],
-                            'outcome_recorded_started_tb_treatment_outcome': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_started_tb_treatment_outcome'],
-                            'outcome_recorded_tb_rx_number': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_tb_rx_number'],
-                            'outcome_recorded_other': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_other'],
-                            'outcome_recorded_comments': None if len(outcomes_recorded_results)<1 else outcomes_recorded_results[0]['outcome_recorded_comments'],
-
-                            'tb_treatment_outcome_user_id': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_user_id'],
-                            'tb_treatment_outcome_result': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_result'],
-                            'tb_treatment_outcome_comments': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_comments'],
-                            'tb_treatment_outcome_close_patient_file': None if len(tb_treatment_outcomes_results)<1 else tb_treatment_outcomes_results[0]['tb_treatment_outcome_close_patient_file']
-                        })
+        columns = []
+        dictionary = []
 
-            logger.info("- Export complete")
+        for name in field_names:
+            field_type = fields[name].field_type if name in fields else "VARCHAR"
+
+            columns.append(pyarrow.field(name, types.get(field_type, pyarrow.string())))
+
+            # names, numbers and free text are mostly distinct, result columns repeat a few values
+            if not field_type in types and field_type != "TEXT" and not name in encrypted_fields:
+                dictionary.append(name)
+
+        return pyarrow.schema(columns), dictionary
+
+    def parquet(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None, progress=None, owner_id: int = None) -> str:
+        """
+        Write a Parquet export into the datasets directory, or return the
+        artifact of the same export if no record in its scope has changed
+        since it was written.
+
+        Columns are those of the CSV export with their database types.
+        Rows are written in row groups of EXPORT.PARQUET_ROW_GROUP_SIZE as
+        they are read, so memory holds one row group.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            permitted_decrypted_data: bool,
+            region_id: str,
+            site_id: str,
+            progress: callable(rows_done: int) (optional),
+            owner_id: int (user the artifact is written for)
+
+        Returns:
+            str
+        """
+        try:
+            if not pyarrow:
+                raise ModuleNotFoundError("parquet exports need pyarrow, pip install pyarrow")
+
+            export_filepath, cached = self.__export_path__("parquet", start_date, end_date, permitted_decrypted_data, region_id, site_id)
+            export_file = os.path.basename(export_filepath)
+
+            if cached:
+                return "%s/%s" % ("/downloads", export_file)
+
+            logger.debug("exporting data please wait ...")
+
+            logger.info("export path: %s" % export_filepath)
+
+            field_names, child_fields = self.__csv_fields__()
+            schema, dictionary = self.__parquet_schema__(field_names)
+
+            part_filepath = "%s.%s.part" % (export_filepath, uuid.uuid4().hex[:8])
 
-            self.purge(max_days=7)
+            with pyarrow.parquet.ParquetWriter(part_filepath, schema, compression=parquet_compression, use_dictionary=dictionary) as writer:
+                columns = {name: [] for name in schema.names}
+                rows = 0
+
+                for csv_row in self.__csv_rows__(child_fields, start_date, end_date, permitted_decrypted_data, region_id, site_id, progress):
+                    for name, values in columns.items():
+                        values.append(csv_row.get(name))
+
+                    rows += 1
+
+                    if rows == parquet_row_group_size:
+                        writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+                        columns = {name: [] for name in schema.names}
+                        rows = 0
+
+                if rows:
+                    writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+
+            os.replace(part_filepath, export_filepath)
+
+            self.Artifacts.register(name=export_file, format="parquet", owner_id=owner_id)
+
+            logger.info("- Export complete")
 
             return "%s/%s" % ("/downloads", export_file)
 
         except Exception as error:
             raise InternalServerError(error)
 
-    def pdf(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None) -> dict:
+    def csv_stream(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None, compress: bool = False):
         """
+        Stream a CSV export as it is read from the database.
+
+        The header is sent before the first query runs. Rows are buffered up
+        to EXPORT.STREAM_BUFFER bytes between writes, so memory stays flat
+        for any date range. The database connections the stream opens are
+        returned to the pool when it ends.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            permitted_decrypted_data: bool,
+            region_id: str,
+            site_id: str,
+            compress: bool (gzip)
+
+        Yields:
+            bytes
         """
-        try:         
-            Site = Site_Model()
-            data = self.Data()
-            pdf_data = []
-            date_format = "%d/%m/%Y"
-                    
-            logger.debug("Gathering data ...")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
 
-            if region_id == "all" and site_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date)
-                    ).dicts()        
-            elif region_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date), 
-                    self.Records.site_id == site_id
-                    ).dicts()       
-            elif site_id == "all":
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date), 
-                    self.Records.region_id == region_id
-                    ).dicts()        
-            else:
-                records = self.Records.select().where(
-                    self.Records.records_date_of_test_request.between(start_date, end_date),
-                    self.Records.region_id == region_id,
-                    self.Records.site_id == site_id
-                    ).dicts()
+        def encode(text: str, final: bool = False) -> bytes:
+            chunk = text.encode("utf-8")
 
-            logger.debug("exporting data please wait ...")
+            if not compressor:
+                return chunk
 
-            for row in records.iterator():
-                iv = row["iv"]
-                dict_data = {}
-
-                site_name = Site.fetch_site(site_id=row["site_id"])["name"]
-                region_name = Site.fetch_region(region_id=row["region_id"])["name"]
-
-                for record_field in self.Records._meta.fields.keys():
-                    if record_field == "site_id":
-                        dict_data["site_name"] = site_name
-                    elif record_field == "region_id":
-                        dict_data["region_name"] = region_name
-                    elif record_field == "records_name":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_address":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_telephone":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_telephone_2":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_art_unique_code":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_ward_bed_number":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_requester_name":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif record_field == "records_requester_telephone":
-                        if permitted_decrypted_data:
-                            dict_data[f"{record_field}"] = data.decrypt(row[f"{record_field}"], iv)
-                        else:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"]
-                    elif "date" in record_field:
-                        if row[f"{record_field}"]:
-                            dict_data[f"{record_field}"] = row[f"{record_field}"].strftime(date_format)
-                        else:
-                            dict_data[f"{record_field}"] = None
-                    elif record_field == "iv":
-                        pass
-                    else:
-                        dict_data[f"{record_field}"] = row[f"{record_field}"]
+            return compressor.compress(chunk) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
 
-                # specimen_collections
-                specimen_collections = (
-                    self.Specimen_collections.select()
-                    .where(self.Specimen_collections.specimen_collection_records_id == row['record_id'])
-                    .dicts()
-                )
+        try:
+            field_names, child_fields = self.__csv_fields__()
 
-                for specimen_collections_field in self.Specimen_collections._meta.fields.keys():
-                    if len(specimen_collections)<1:
-                        dict_data[f"{specimen_collections_field}"] = None
-                    else:
-                        if "date" in specimen_collections_field:
-                            if specimen_collections[0][f"{specimen_collections_field}"]:
-                                dict_data[f"{specimen_collections_field}"] = specimen_collections[0][f"{specimen_collections_field}"].strftime(date_format)
-                            else:
-                                dict_data[f"{specimen_collections_field}"] = None
-                        else:
-                            dict_data[f"{specimen_collections_field}"] = specimen_collections[0][f"{specimen_collections_field}"]
-        
-                # labs
-                labs = (
-                    self.Labs.select()
-                    .where(self.Labs.lab_records_id == row['record_id'])
-                    .dicts()
-                )
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=field_names)
+            writer.writeheader()
 
-                for labs_field in self.Labs._meta.fields.keys():
-                    if len(labs)<1:
-                        dict_data[f"{labs_field}"] = None
-                    else:
-                        if "date" in labs_field:
-                            if labs[0][f"{labs_field}"]:
-                                dict_data[f"{labs_field}"] = labs[0][f"{labs_field}"].strftime(date_format)
-                            else:
-                                dict_data[f"{labs_field}"] = None
-                        else:
-                            dict_data[f"{labs_field}"] = labs[0][f"{labs_field}"]
-
-                # follow_ups
-                follow_ups = (
-                    self.Follow_ups.select()
-                    .where(self.Follow_ups.follow_up_records_id == row['record_id'])
-                    .dicts()
-                )
+            yield encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
 
-                for follow_ups_field in self.Follow_ups._meta.fields.keys():
-                    if len(follow_ups)<1:
-                        dict_data[f"{follow_ups_field}"] = None
-                    else:
-                        if "date" in follow_ups_field:
-                            if follow_ups[0][f"{follow_ups_field}"]:
-                                dict_data[f"{follow_ups_field}"] = follow_ups[0][f"{follow_ups_field}"].strftime(date_format)
-                            else:
-                                dict_data[f"{follow_ups_field}"] = None
-                        else:
-                            dict_data[f"{follow_ups_field}"] = follow_ups[0][f"{follow_ups_field}"]
-                            
-                # outcomes_recorded        
-                outcomes_recorded = (
-                    self.Outcome_recorded.select()
-                    .where(self.Outcome_recorded.outcome_recorded_records_id == row['record_id'])
-                    .dicts()
-                )
+            logger.debug("streaming export please wait ...")
 
-                for outcome_recorded_field in self.Outcome_recorded._meta.fields.keys():
-                    if len(outcomes_recorded)<1:
-                        dict_data[f"{outcome_recorded_field}"] = None
-                    else:
-                        if "date" in outcome_recorded_field:
-                            if outcomes_recorded[0][f"{outcome_recorded_field}"]:
-                                dict_data[f"{outcome_recorded_field}"] = outcomes_recorded[0][f"{outcome_recorded_field}"].strftime(date_format)
-                            else:
-                                dict_data[f"{outcome_recorded_field}"] = None
-                        else:
-                            dict_data[f"{outcome_recorded_field}"] = outcomes_recorded[0][f"{outcome_recorded_field}"]
-
-                # tb_treatment_outcomes        
-                tb_treatment_outcomes = (
-                    self.Tb_treatment_outcomes.select()
-                    .where(self.Tb_treatment_outcomes.tb_treatment_outcome_records_id == row['record_id'])
-                    .dicts()
-                )
+            for csv_row in self.__csv_rows__(child_fields, start_date, end_date, permitted_decrypted_data, region_id, site_id):
+                writer.writerow(csv_row)
+
+                if buffer.tell() >= stream_buffer:
+                    yield encode(buffer.getvalue())
+                    buffer.seek(0)
+                    buffer.truncate()
+
+            yield encode(buffer.getvalue(), final=True)
+
+            logger.info("- Export stream complete")
 
-                for tb_treatment_outcomes_field in self.Tb_treatment_outcomes._meta.fields.keys():
-                    if len(tb_treatment_outcomes)<1:
-                        dict_data[f"{tb_treatment_outcomes_field}"] = None
+        except Exception as error:
+            logger.exception(error)
+            raise
+
+        finally:
+            for database in (self.Records._meta.database, Site_Model().Sites._meta.database):
+                if not database.is_closed():
+                    database.close()
+
+    def __pdf_row__(self, row: dict, children: dict, site_names: dict, region_names: dict) -> dict:
+        """
+        Fields of one record and its first child rows as the PDF shows them.
+
+        Arguments:
+            row: dict,
+            children: dict,
+            site_names: dict,
+            region_names: dict
+
+        Returns:
+            dict
+        """
+        date_format = "%d/%m/%Y"
+        dict_data = {}
+
+        for record_field in self.Records._meta.fields.keys():
+            if record_field == "site_id":
+                dict_data["site_name"] = site_names[row["site_id"]]
+            elif record_field == "region_id":
+                dict_data["region_name"] = region_names[row["region_id"]]
+            elif record_field in encrypted_fields:
+                dict_data[f"{record_field}"] = row[f"{record_field}"]
+            elif "date" in record_field:
+                if row[f"{record_field}"]:
+                    dict_data[f"{record_field}"] = row[f"{record_field}"].strftime(date_format)
+                else:
+                    dict_data[f"{record_field}"] = None
+            elif record_field == "iv":
+                pass
+            else:
+                dict_data[f"{record_field}"] = row[f"{record_field}"]
+
+        for child, child_row in children.items():
+            for child_field in child._meta.fields.keys():
+                if not child_row:
+                    dict_data[f"{child_field}"] = None
+                elif "date" in child_field:
+                    if child_row[f"{child_field}"]:
+                        dict_data[f"{child_field}"] = child_row[f"{child_field}"].strftime(date_format)
                     else:
-                        if "date" in tb_treatment_outcomes_field:
-                            if tb_treatment_outcomes[0][f"{tb_treatment_outcomes_field}"]:
-                                dict_data[f"{tb_treatment_outcomes_field}"] = tb_treatment_outcomes[0][f"{tb_treatment_outcomes_field}"].strftime(date_format)
-                            else:
-                                dict_data[f"{tb_treatment_outcomes_field}"] = None
-                        else:
-                            dict_data[f"{tb_treatment_outcomes_field}"] = tb_treatment_outcomes[0][f"{tb_treatment_outcomes_field}"]
+                        dict_data[f"{child_field}"] = None
+                else:
+                    dict_data[f"{child_field}"] = child_row[f"{child_field}"]
 
-                pdf_data.append(dict_data)
+        return dict_data
 
-            logger.info("- Export complete")
+    def pdf_filename(self) -> str:
+        """
+        Name of a PDF export created now.
 
-            self.purge(max_days=7)
+        Returns:
+            str
+        """
+        date_time = datetime.now().strftime("%m-%d-%Y-%H_%M_%S")
 
-            pdf_url = export["PDF_URL"]
+        return '%s_record_export.pdf' % date_time
 
-            res = requests.post(url=pdf_url, json=pdf_data)
+    def pdf(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None, progress=None, owner_id: int = None) -> str:
+        """
+        Render a PDF export into the datasets directory.
+
+        Records are read in chunks and written a page at a time, so memory
+        stays flat for any date range. Each record is one section listing
+        its fields that have a value. Unchanged exports are served from
+        the datasets directory, as with csv. With EXPORT.PDF_RENDERER = service
+        the rows are posted to PDF_URL instead and its reply is returned.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            permitted_decrypted_data: bool,
+            region_id: str,
+            site_id: str,
+            progress: callable(rows_done: int) (optional),
+            owner_id: int (user the artifact is written for)
+
+        Returns:
+            str
+        """
+        if pdf_renderer == "service":
+            return self.pdf_service(start_date, end_date, permitted_decrypted_data, region_id, site_id, progress)
 
-            return res.text.strip()
+        try:
+            export_filepath, cached = self.__export_path__("pdf", start_date, end_date, permitted_decrypted_data, region_id, site_id)
+            export_file = os.path.basename(export_filepath)
+
+            if cached:
+                return "%s/%s" % ("/downloads", export_file)
+
+            logger.debug("exporting data please wait ...")
+
+            logger.info("export path: %s" % export_filepath)
+
+            site_names, region_names = self.__names__()
+
+            title = "Records tested %s to %s" % (start_date.strftime("%d/%m/%Y"), end_date.strftime("%d/%m/%Y"))
+
+            part_filepath = "%s.%s.part" % (export_filepath, uuid.uuid4().hex[:8])
+
+            # a download or cache hit never sees a half written file
+            with open(part_filepath, "wb") as fh:
+                writer = PDF_Writer(fh, title=title)
+
+                for row, children in self.__rows__(start_date, end_date, region_id, site_id, progress, decrypt=permitted_decrypted_data):
+                    pdf_row = self.__pdf_row__(row, children, site_names, region_names)
+
+                    writer.section(
+                        heading="Record %s" % row["record_id"],
+                        fields=[(field, value) for field, value in pdf_row.items() if value is not None and value != ""]
+                    )
+
+                writer.close()
+
+            os.replace(part_filepath, export_filepath)
+
+            self.Artifacts.register(name=export_file, format="pdf", owner_id=owner_id)
+
+            logger.info("- Export complete")
+
+            return "%s/%s" % ("/downloads", export_file)
 
         except Exception as error:
             raise InternalServerError(error)
 
-    def purge(self, max_days:int) -> None:
+    def pdf_service(self, start_date:str, end_date:str, permitted_decrypted_data: bool, region_id:str = None, site_id:str = None, progress=None) -> str:
         """
+        Post every exported row to the PDF service at EXPORT.PDF_URL in one
+        request and return its reply.
+
+        Arguments:
+            start_date: str,
+            end_date: str,
+            permitted_decrypted_data: bool,
+            region_id: str,
+            site_id: str,
+            progress: callable(rows_done: int) (optional)
+
+        Returns:
+            str
         """
-        try:
-            logger.debug("removing export files older than %d day(s) ..." % max_days)
+        try:         
+            pdf_data = []
+                    
+            logger.debug("Gathering data ...")
+
+            site_names, region_names = self.__names__()
+
+            logger.debug("exporting data please wait ...")
+
+            for row, children in self.__rows__(start_date, end_date, region_id, site_id, progress, decrypt=permitted_decrypted_data):
+                pdf_data.append(self.__pdf_row__(row, children, site_names, region_names))
 
-            export_filepath = os.path.join("%s/datasets" % export["PATH"])
-            date_limit = datetime.now() - timedelta(max_days)
-            files = os.listdir(export_filepath)
+            logger.info("- Export complete")
+
+            pdf_url = export["PDF_URL"]
 
-            for file in files:
-                file_path = os.path.join("%s/datasets" % export["PATH"], file)
-                filetime = datetime.fromtimestamp(os.path.getctime(file_path))
-            
-                if filetime < date_limit:
-                    os.remove(file_path)
-                    logger.info("- '%s' removed. Created: %s" % (file, filetime))
+            res = requests.post(url=pdf_url, json=pdf_data)
+
+            return res.text.strip()
 
         except Exception as error:
-            raise InternalServerError(error)
\ No newline at end of file
+            raise InternalServerError(error)
@@ -1,8 +1,6 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
-
 # configurations
 from Configs import baseConfig
 config = baseConfig()
@@ -12,6 +10,8 @@ from peewee import DatabaseError
 
 from schemas.users.users_otp import Users_otp
 
+from models.sms_outbox import SMS_Outbox_Model
+
 from datetime import datetime
 
 from werkzeug.exceptions import Forbidden
@@ -122,48 +122,11 @@ class OTP_Model:
 
     def __send__(self, text: str, contacts: list):
         """
+        Queue the code for every contact in the SMS outbox.
         """
-        sms_url = f"{self.openapi_url}/v1/sms"
-        operator_url = f"{self.openapi_url}/v1/sms/operators"
-        auth_id = self.auth_id
-
-        payload = []
-
-        for contact in contacts:
-            payload.append({
-                "operator_name":"",
-                "text":text.strip()[:149],
-                "number":contact
-            })
-
         try:
-            operator_res = requests.post(url=operator_url, json=payload)
-
-            if operator_res.status_code == 200:
-                logger.info("- Successfully fetched operator names.")
-
-                operator_data = operator_res.json()
-
-                sms_data = {
-                    "auth_id":auth_id,
-                    "data": operator_data,
-                    "callback_url": ""
-                    }
-                
-                sms_res = requests.post(url=sms_url, json=sms_data)
-
-                if sms_res.status_code == 200:
-                    logger.info("- Successfully sent.")
-                    return None
-                else:
-                    logger.error("- Cannot send SMS")
-                    raise InternalServerError(sms_res.text)    
-
-            else:
-                logger.error("- Cannot get operator_name")
-                raise InternalServerError(operator_res.text)
+            Outbox = SMS_Outbox_Model()
+            Outbox.enqueue(text=text, contacts=contacts)
 
         except Exception as error:
             raise InternalServerError(error)
-
-
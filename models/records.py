@@ -1,23 +1,203 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from Configs import baseConfig
+config = baseConfig()
+api = config["API"]
+ingest_max_records = api.getint("INGEST_MAX_RECORDS", fallback=500)
+sync_settle = api.getint("SYNC_SETTLE", fallback=5)
+
 from security.data import Data
+from security import search
 
+from peewee import fn
+from peewee import JOIN
+from peewee import Tuple
+from peewee import Value
 from peewee import DatabaseError
 from peewee import OperationalError
 from peewee import IntegrityError
+from peewee import CharField
+from peewee import TextField
+from peewee import DateField
+from peewee import IntegerField
+from peewee import BooleanField
 
 from schemas.records.records import Records
+from schemas.records.records_search import Records_search
+from schemas.records.records_ingest import Records_ingest
+from schemas.records.records_changes import Records_changes
 from schemas.records.specimen_collection import Specimen_collections
 from schemas.records.lab import Labs
 from schemas.records.follow_up import Follow_ups
 from schemas.records.outcome_recorded import Outcome_recorded
 from schemas.records.tb_treatment_outcome import Tb_treatment_outcomes
 
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from dateutil.parser import parse
+
 from datetime import date
+from datetime import datetime
+from datetime import timedelta
 
 from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import Conflict
+
+from models.exports import encrypted_fields
+
+page_size = 10
+max_page_size = 100
+
+changes_page_size = 100
+max_changes_page_size = 1000
+
+# rows per multi-row INSERT during bulk ingestion
+ingest_chunk_size = 100
+
+# child forms a bulk record may carry: model, its record and user fields
+children = {
+    "specimen_collections": (Specimen_collections, "specimen_collection_records_id", "specimen_collection_user_id"),
+    "labs": (Labs, "lab_records_id", "lab_user_id"),
+    "follow_ups": (Follow_ups, "follow_up_records_id", "follow_up_user_id"),
+    "outcome_recorded": (Outcome_recorded, "outcome_recorded_records_id", "outcome_recorded_user_id"),
+    "tb_treatment_outcomes": (Tb_treatment_outcomes, "tb_treatment_outcome_records_id", "tb_treatment_outcome_user_id")
+}
+
+def form_fields(model, skip: list) -> list:
+    """
+    Fields of a model a client fills in: all but the primary key, the
+    given ones and those stamped with the time of writing.
+
+    Arguments:
+        model: Model,
+        skip: list
+
+    Returns:
+        list
+    """
+    return [
+        field for field in model._meta.sorted_fields
+        if not (field.primary_key or field.name in skip or callable(field.default))
+    ]
+
+def form_value(field, value, encrypted: bool = False):
+    """
+    Check and convert one submitted value the way the database would
+    store it, so a single bad value cannot fail a whole multi-row INSERT.
+
+    Arguments:
+        field: Field,
+        value: any,
+        encrypted: bool (optional)
+
+    Returns:
+        any
+    """
+    if value is None or value == "":
+        # empty strings encrypt to NULL
+        if field.null or (value == "" and isinstance(field, (CharField, TextField)) and not encrypted):
+            return value
+
+        raise BadRequest("missing %s" % field.name)
+
+    try:
+        if isinstance(field, BooleanField):
+            if not value in (True, False):
+                raise ValueError(value)
+
+            return bool(value)
+
+        if isinstance(field, IntegerField):
+            if isinstance(value, bool) or int(value) != float(value):
+                raise ValueError(value)
+
+            return int(value)
+
+        if isinstance(field, DateField):
+            return parse(value).date()
+
+        if isinstance(field, (CharField, TextField)):
+            if not isinstance(value, (str, int, float)):
+                raise ValueError(value)
+
+            value = str(value)
+            length = len(value.encode("utf-8"))
+
+            # base64 of the value padded to whole AES blocks
+            if encrypted:
+                length = (length // 16 + 1) * 16
+                length = (length + 2) // 3 * 4
+
+            if isinstance(field, CharField) and length > field.max_length:
+                raise ValueError(value)
+
+            return value
+
+        return value
+
+    except (ValueError, TypeError, OverflowError):
+        raise BadRequest("invalid %s" % field.name)
+
+def form_row(fields: list, form: dict, encrypted: list = []) -> dict:
+    """
+    Build a row from a submitted form.
+
+    Arguments:
+        fields: list,
+        form: dict,
+        encrypted: list (optional)
+
+    Returns:
+        dict
+    """
+    if not isinstance(form, dict):
+        raise BadRequest("invalid form")
+
+    row = {}
+
+    for field in fields:
+        if not field.name in form:
+            raise BadRequest("missing %s" % field.name)
+
+        row[field.name] = form_value(field, form[field.name], encrypted=field.name in encrypted)
+
+    return row
+
+def encode_cursor(records_date: datetime, record_id: int) -> str:
+    """
+    Opaque token for the position after a record.
+
+    Arguments:
+        records_date: datetime,
+        record_id: int
+
+    Returns:
+        str
+    """
+    position = json.dumps([records_date.isoformat(), record_id])
+
+    return urlsafe_b64encode(position.encode("utf-8")).decode("utf-8")
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Read a token made by encode_cursor.
+
+    Arguments:
+        cursor: str
+
+    Returns:
+        (datetime, int)
+    """
+    try:
+        records_date, record_id = json.loads(urlsafe_b64decode(cursor.encode("utf-8")))
+
+        return datetime.fromisoformat(records_date), int(record_id)
+
+    except (ValueError, TypeError) as error:
+        logger.error("invalid cursor: %s" % error)
+        raise BadRequest("invalid cursor")
 
 class Record_Model:
     """
@@ -26,6 +206,9 @@ class Record_Model:
         """
         """
         self.Records = Records
+        self.Records_search = Records_search
+        self.Records_ingest = Records_ingest
+        self.Records_changes = Records_changes
         self.Specimen_collections = Specimen_collections
         self.Labs = Labs
         self.Follow_ups = Follow_ups
@@ -44,48 +227,52 @@ class Record_Model:
             
             data = self.Data()
 
-            record = Records.create(
-                site_id=site_id,
-                region_id=region_id,
-                records_user_id=records_user_id,
-                records_name= data.encrypt(records_name)["e_data"],
-                records_age=records_age,
-                records_sex=records_sex,
-                records_date_of_test_request=records_date_of_test_request,
-                records_address= data.encrypt(records_address)["e_data"],
-                records_telephone= data.encrypt(records_telephone)["e_data"],
-                records_telephone_2= data.encrypt(records_telephone_2)["e_data"],
-                records_has_art_unique_code=records_has_art_unique_code,
-                records_art_unique_code= data.encrypt(records_art_unique_code)["e_data"],
-                records_status=records_status,
-                records_ward_bed_number= data.encrypt(records_ward_bed_number)["e_data"],
-                records_currently_pregnant=records_currently_pregnant,
-                records_symptoms_current_cough=records_symptoms_current_cough,
-                records_symptoms_fever=records_symptoms_fever,
-                records_symptoms_night_sweats=records_symptoms_night_sweats,
-                records_symptoms_weight_loss=records_symptoms_weight_loss,
-                records_symptoms_none_of_the_above=records_symptoms_none_of_the_above,
-                records_patient_category_hospitalized=records_patient_category_hospitalized,
-                records_patient_category_child=records_patient_category_child,
-                records_patient_category_to_initiate_art=records_patient_category_to_initiate_art,
-                records_patient_category_on_art_symptomatic=records_patient_category_on_art_symptomatic,
-                records_patient_category_outpatient=records_patient_category_outpatient,
-                records_patient_category_anc=records_patient_category_anc,
-                records_patient_category_diabetes_clinic=records_patient_category_diabetes_clinic,
-                records_patient_category_prisoner=records_patient_category_prisoner,
-                records_patient_category_other=records_patient_category_other,
-                records_reason_for_test=records_reason_for_test,
-                records_reason_for_test_follow_up_months=records_reason_for_test_follow_up_months,
-                records_tb_treatment_history=records_tb_treatment_history,
-                records_tb_treatment_history_contact_of_tb_patient= records_tb_treatment_history_contact_of_tb_patient,
-                records_tb_treatment_history_other= records_tb_treatment_history_other,
-                records_tb_type=records_tb_type,
-                records_tb_treatment_number=records_tb_treatment_number,
-                records_sms_notifications=records_sms_notifications,
-                records_requester_name= data.encrypt(records_requester_name)["e_data"],
-                records_requester_telephone= data.encrypt(records_requester_telephone)["e_data"],
-                iv = data.iv
-            )
+            with self.Records._meta.database.atomic():
+                record = Records.create(
+                    site_id=site_id,
+                    region_id=region_id,
+                    records_user_id=records_user_id,
+                    records_name= data.encrypt(records_name)["e_data"],
+                    records_age=records_age,
+                    records_sex=records_sex,
+                    records_date_of_test_request=records_date_of_test_request,
+                    records_address= data.encrypt(records_address)["e_data"],
+                    records_telephone= data.encrypt(records_telephone)["e_data"],
+                    records_telephone_2= data.encrypt(records_telephone_2)["e_data"],
+                    records_has_art_unique_code=records_has_art_unique_code,
+                    records_art_unique_code= data.encrypt(records_art_unique_code)["e_data"],
+                    records_status=records_status,
+                    records_ward_bed_number= data.encrypt(records_ward_bed_number)["e_data"],
+                    records_currently_pregnant=records_currently_pregnant,
+                    records_symptoms_current_cough=records_symptoms_current_cough,
+                    records_symptoms_fever=records_symptoms_fever,
+                    records_symptoms_night_sweats=records_symptoms_night_sweats,
+                    records_symptoms_weight_loss=records_symptoms_weight_loss,
+                    records_symptoms_none_of_the_above=records_symptoms_none_of_the_above,
+                    records_patient_category_hospitalized=records_patient_category_hospitalized,
+                    records_patient_category_child=records_patient_category_child,
+                    records_patient_category_to_initiate_art=records_patient_category_to_initiate_art,
+                    records_patient_category_on_art_symptomatic=records_patient_category_on_art_symptomatic,
+                    records_patient_category_outpatient=records_patient_category_outpatient,
+                    records_patient_category_anc=records_patient_category_anc,
+                    records_patient_category_diabetes_clinic=records_patient_category_diabetes_clinic,
+                    records_patient_category_prisoner=records_patient_category_prisoner,
+                    records_patient_category_other=records_patient_category_other,
+                    records_reason_for_test=records_reason_for_test,
+                    records_reason_for_test_follow_up_months=records_reason_for_test_follow_up_months,
+                    records_tb_treatment_history=records_tb_treatment_history,
+                    records_tb_treatment_history_contact_of_tb_patient= records_tb_treatment_history_contact_of_tb_patient,
+                    records_tb_treatment_history_other= records_tb_treatment_history_other,
+                    records_tb_type=records_tb_type,
+                    records_tb_treatment_number=records_tb_treatment_number,
+                    records_sms_notifications=records_sms_notifications,
+                    records_requester_name= data.encrypt(records_requester_name)["e_data"],
+                    records_requester_telephone= data.encrypt(records_requester_telephone)["e_data"],
+                    iv = data.iv
+                )
+
+                self.__index__(record_id=record.record_id, site_id=site_id, region_id=region_id, records_name=records_name, records_telephone=records_telephone)
+                self.__change__(entity="records", row_id=record.record_id, record_id=record.record_id)
 
             logger.info("- Record %s successfully created" % record)
             return str(record)
@@ -107,51 +294,66 @@ class Record_Model:
             
             data = self.Data()
 
-            record = Records.update(
-                site_id=site_id,
-                region_id=region_id,
-                records_name= data.encrypt(records_name)["e_data"],
-                records_age=records_age,
-                records_sex=records_sex,
-                records_date_of_test_request=records_date_of_test_request,
-                records_address= data.encrypt(records_address)["e_data"],
-                records_telephone= data.encrypt(records_telephone)["e_data"],
-                records_telephone_2= data.encrypt(records_telephone_2)["e_data"],
-                records_has_art_unique_code=records_has_art_unique_code,
-                records_art_unique_code= data.encrypt(records_art_unique_code)["e_data"],
-                records_status=records_status,
-                records_ward_bed_number= data.encrypt(records_ward_bed_number)["e_data"],
-                records_currently_pregnant=records_currently_pregnant,
-                records_symptoms_current_cough=records_symptoms_current_cough,
-                records_symptoms_fever=records_symptoms_fever,
-                records_symptoms_night_sweats=records_symptoms_night_sweats,
-                records_symptoms_weight_loss=records_symptoms_weight_loss,
-                records_symptoms_none_of_the_above=records_symptoms_none_of_the_above,
-                records_patient_category_hospitalized=records_patient_category_hospitalized,
-                records_patient_category_child=records_patient_category_child,
-                records_patient_category_to_initiate_art=records_patient_category_to_initiate_art,
-                records_patient_category_on_art_symptomatic=records_patient_category_on_art_symptomatic,
-                records_patient_category_outpatient=records_patient_category_outpatient,
-                records_patient_category_anc=records_patient_category_anc,
-                records_patient_category_diabetes_clinic=records_patient_category_diabetes_clinic,
-                records_patient_category_prisoner=records_patient_category_prisoner,
-                records_patient_category_other=records_patient_category_other,
-                records_reason_for_test=records_reason_for_test,
-                records_reason_for_test_follow_up_months=records_reason_for_test_follow_up_months,
-                records_tb_treatment_history=records_tb_treatment_history,
-                records_tb_treatment_history_contact_of_tb_patient= records_tb_treatment_history_contact_of_tb_patient,
-                records_tb_treatment_history_other= records_tb_treatment_history_other,
-                records_tb_type=records_tb_type,
-                records_tb_treatment_number=records_tb_treatment_number,
-                records_sms_notifications=records_sms_notifications,
-                records_requester_name= data.encrypt(records_requester_name)["e_data"],
-                records_requester_telephone= data.encrypt(records_requester_telephone)["e_data"],
-                iv = data.iv
-            ).where(
-                self.Records.record_id == record_id
-            )
+            with self.Records._meta.database.atomic():
+                previous = (
+                    self.Records.select(self.Records.site_id, self.Records.region_id)
+                    .where(self.Records.record_id == record_id)
+                    .dicts()
+                    .first()
+                )
 
-            record.execute()
+                record = Records.update(
+                    site_id=site_id,
+                    region_id=region_id,
+                    records_name= data.encrypt(records_name)["e_data"],
+                    records_age=records_age,
+                    records_sex=records_sex,
+                    records_date_of_test_request=records_date_of_test_request,
+                    records_address= data.encrypt(records_address)["e_data"],
+                    records_telephone= data.encrypt(records_telephone)["e_data"],
+                    records_telephone_2= data.encrypt(records_telephone_2)["e_data"],
+                    records_has_art_unique_code=records_has_art_unique_code,
+                    records_art_unique_code= data.encrypt(records_art_unique_code)["e_data"],
+                    records_status=records_status,
+                    records_ward_bed_number= data.encrypt(records_ward_bed_number)["e_data"],
+                    records_currently_pregnant=records_currently_pregnant,
+                    records_symptoms_current_cough=records_symptoms_current_cough,
+                    records_symptoms_fever=records_symptoms_fever,
+                    records_symptoms_night_sweats=records_symptoms_night_sweats,
+                    records_symptoms_weight_loss=records_symptoms_weight_loss,
+                    records_symptoms_none_of_the_above=records_symptoms_none_of_the_above,
+                    records_patient_category_hospitalized=records_patient_category_hospitalized,
+                    records_patient_category_child=records_patient_category_child,
+                    records_patient_category_to_initiate_art=records_patient_category_to_initiate_art,
+                    records_patient_category_on_art_symptomatic=records_patient_category_on_art_symptomatic,
+                    records_patient_category_outpatient=records_patient_category_outpatient,
+                    records_patient_category_anc=records_patient_category_anc,
+                    records_patient_category_diabetes_clinic=records_patient_category_diabetes_clinic,
+                    records_patient_category_prisoner=records_patient_category_prisoner,
+                    records_patient_category_other=records_patient_category_other,
+                    records_reason_for_test=records_reason_for_test,
+                    records_reason_for_test_follow_up_months=records_reason_for_test_follow_up_months,
+                    records_tb_treatment_history=records_tb_treatment_history,
+                    records_tb_treatment_history_contact_of_tb_patient= records_tb_treatment_history_contact_of_tb_patient,
+                    records_tb_treatment_history_other= records_tb_treatment_history_other,
+                    records_tb_type=records_tb_type,
+                    records_tb_treatment_number=records_tb_treatment_number,
+                    records_sms_notifications=records_sms_notifications,
+                    records_requester_name= data.encrypt(records_requester_name)["e_data"],
+                    records_requester_telephone= data.encrypt(records_requester_telephone)["e_data"],
+                    iv = data.iv
+                ).where(
+                    self.Records.record_id == record_id
+                )
+
+                record.execute()
+
+                self.__index__(record_id=record_id, site_id=site_id, region_id=region_id, records_name=records_name, records_telephone=records_telephone)
+
+                if previous and (previous["site_id"], previous["region_id"]) != (int(site_id), int(region_id)):
+                    self.__move__(record_id=record_id, previous=previous)
+
+                self.__change__(entity="records", row_id=record_id, record_id=record_id)
 
             logger.info("- Record %s successfully updated" % record_id)
             return record_id
@@ -164,6 +366,520 @@ class Record_Model:
             logger.error("updating record %s failed check logs" % record_id)
             raise InternalServerError(err)
 
+    def __index__(self, record_id: int, site_id: int, region_id: int, records_name: str, records_telephone: str) -> None:
+        """
+        Replace a record's search tokens.
+
+        Arguments:
+            record_id: int,
+            site_id: int,
+            region_id: int,
+            records_name: str,
+            records_telephone: str
+
+        Returns:
+            None
+        """
+        self.Records_search.delete().where(self.Records_search.record_id == record_id).execute()
+
+        rows = []
+
+        for field, value in (("name", records_name), ("telephone", records_telephone)):
+            for token in search.index_tokens(field, value):
+                rows.append({
+                    "record_id": record_id,
+                    "site_id": site_id,
+                    "region_id": region_id,
+                    "field": field,
+                    "token": token
+                })
+
+        if rows:
+            self.Records_search.insert_many(rows).execute()
+
+    def __change__(self, entity: str, row_id: int, record_id: int = None, op: str = "upsert") -> None:
+        """
+        Add a row's write to the change feed, under its record's current site.
+
+        Arguments:
+            entity: str,
+            row_id: int,
+            record_id: int (optional, looked up from the child row),
+            op: str (optional)
+
+        Returns:
+            None
+        """
+        if record_id is None:
+            model, record_field, user_field = children[entity]
+
+            record_id = model.select(getattr(model, record_field)).where(model._meta.primary_key == row_id)
+
+        query = (
+            self.Records.select(
+                self.Records.site_id,
+                self.Records.region_id,
+                self.Records.record_id,
+                Value(entity),
+                Value(row_id),
+                Value(op),
+                Value(datetime.now())
+            )
+            .where(self.Records.record_id == record_id)
+        )
+
+        self.Records_changes.insert_from(query, [
+            self.Records_changes.site_id,
+            self.Records_changes.region_id,
+            self.Records_changes.record_id,
+            self.Records_changes.entity,
+            self.Records_changes.row_id,
+            self.Records_changes.op,
+            self.Records_changes.createdAt
+        ]).execute()
+
+    def __move__(self, record_id: int, previous: dict) -> None:
+        """
+        Feed a record's move to another site: a tombstone for the old site
+        and its child forms again for the new one (the record follows).
+
+        Arguments:
+            record_id: int,
+            previous: dict (old site_id and region_id)
+
+        Returns:
+            None
+        """
+        self.Records_changes.create(
+            site_id=previous["site_id"],
+            region_id=previous["region_id"],
+            record_id=record_id,
+            entity="records",
+            row_id=record_id,
+            op="delete"
+        )
+
+        for name, (model, record_field, user_field) in children.items():
+            for row_id in [row[0] for row in model.select(model._meta.primary_key).where(getattr(model, record_field) == record_id).tuples()]:
+                self.__change__(entity=name, row_id=row_id, record_id=record_id)
+
+    def fetch_changes(self, sites: list, since: int, permitted_decrypted_data: bool, limit: int = changes_page_size) -> dict:
+        """
+        Records and child forms of the given sites written after a watermark.
+
+        Changes come in seq order. Changes newer than SYNC_SETTLE seconds
+        are held back, along with everything after them, so that a write
+        still committing cannot fall behind a watermark already handed out.
+        A change whose row is no longer in the given sites comes back as a
+        delete.
+
+        Arguments:
+            sites: list (of (site_id, region_id)),
+            since: int,
+            permitted_decrypted_data: bool,
+            limit: int (optional)
+
+        Returns:
+            dict ("changes", "watermark", "more")
+        """
+        try:
+            logger.debug("finding changes after %d in %d site(s) ..." % (since, len(sites)))
+
+            result = {"changes": [], "watermark": since, "more": False}
+
+            if not sites:
+                return result
+
+            barrier = (
+                self.Records_changes.select(fn.MIN(self.Records_changes.seq))
+                .where(self.Records_changes.createdAt > datetime.now() - timedelta(seconds=sync_settle))
+                .scalar()
+            )
+
+            changes = self.Records_changes.select().where(
+                self.Records_changes.seq > since,
+                Tuple(self.Records_changes.site_id, self.Records_changes.region_id).in_(sites)
+            )
+
+            if barrier:
+                changes = changes.where(self.Records_changes.seq < barrier)
+
+            changes = list(changes.order_by(self.Records_changes.seq).limit(limit + 1).dicts())
+
+            if len(changes) > limit:
+                changes = changes[:limit]
+                result["more"] = True
+
+            if not changes:
+                return result
+
+            result["watermark"] = changes[-1]["seq"]
+
+            # only the latest change of each row matters to a client
+            latest = {}
+
+            for change in changes:
+                latest[(change["entity"], change["row_id"])] = change
+
+            changes = sorted(latest.values(), key=lambda change: change["seq"])
+
+            rows = {}
+
+            for entity in set(change["entity"] for change in changes):
+                ids = [change["row_id"] for change in changes if change["entity"] == entity and change["op"] == "upsert"]
+
+                if not ids:
+                    continue
+
+                if entity == "records":
+                    query = self.Records.select().where(
+                        self.Records.record_id.in_(ids),
+                        Tuple(self.Records.site_id, self.Records.region_id).in_(sites)
+                    )
+
+                    found = list(query.dicts())
+
+                    if permitted_decrypted_data:
+                        data = self.Data()
+                        found = data.decrypt_rows(rows=found, fields=encrypted_fields)
+
+                    for row in found:
+                        row.pop("iv")
+                        rows[(entity, row["record_id"])] = row
+                else:
+                    model, record_field, user_field = children[entity]
+
+                    query = (
+                        model.select(model)
+                        .join(self.Records, on=(getattr(model, record_field) == self.Records.record_id))
+                        .where(
+                            model._meta.primary_key.in_(ids),
+                            Tuple(self.Records.site_id, self.Records.region_id).in_(sites)
+                        )
+                    )
+
+                    for row in query.dicts():
+                        rows[(entity, row[model._meta.primary_key.name])] = row
+
+            for change in changes:
+                row = rows.get((change["entity"], change["row_id"]))
+
+                result["changes"].append({
+                    "seq": change["seq"],
+                    "entity": change["entity"],
+                    "id": change["row_id"],
+                    "record_id": change["record_id"],
+                    "op": "upsert" if row else "delete",
+                    "data": row
+                })
+
+            logger.info("- Found %d change(s) up to %d" % (len(result["changes"]), result["watermark"]))
+            return result
+
+        except DatabaseError as err:
+            logger.error("failed to find changes after %d check logs" % since)
+            raise InternalServerError(err)
+
+    def backfill_changes(self, after_record_id: int = 0, limit: int = 1000) -> int:
+        """
+        Feed a batch of records written before the change feed existed, with
+        their child forms, in record_id order.
+
+        Arguments:
+            after_record_id: int,
+            limit: int
+
+        Returns:
+            int (last record_id fed, 0 when there are no more)
+        """
+        try:
+            ids = [
+                record[0] for record in
+                self.Records.select(self.Records.record_id)
+                .where(self.Records.record_id > after_record_id)
+                .order_by(self.Records.record_id)
+                .limit(limit)
+                .tuples()
+            ]
+
+            if not ids:
+                return 0
+
+            now = datetime.now()
+            fields = [
+                self.Records_changes.site_id,
+                self.Records_changes.region_id,
+                self.Records_changes.record_id,
+                self.Records_changes.entity,
+                self.Records_changes.row_id,
+                self.Records_changes.op,
+                self.Records_changes.createdAt
+            ]
+
+            with self.Records._meta.database.atomic():
+                self.Records_changes.insert_from(
+                    self.Records.select(
+                        self.Records.site_id,
+                        self.Records.region_id,
+                        self.Records.record_id,
+                        Value("records"),
+                        self.Records.record_id,
+                        Value("upsert"),
+                        Value(now)
+                    ).where(self.Records.record_id.in_(ids)),
+                    fields
+                ).execute()
+
+                for name, (model, record_field, user_field) in children.items():
+                    self.Records_changes.insert_from(
+                        model.select(
+                            self.Records.site_id,
+                            self.Records.region_id,
+                            self.Records.record_id,
+                            Value(name),
+                            model._meta.primary_key,
+                            Value("upsert"),
+                            Value(now)
+                        )
+                        .join(self.Records, on=(getattr(model, record_field) == self.Records.record_id))
+                        .where(self.Records.record_id.in_(ids)),
+                        fields
+                    ).execute()
+
+            logger.info("- Fed records %d to %d" % (ids[0], ids[-1]))
+            return ids[-1]
+
+        except DatabaseError as err:
+            logger.error("feeding records after %d failed check logs" % after_record_id)
+            raise InternalServerError(err)
+
+    def reindex_records(self, after_record_id: int = 0, limit: int = 1000) -> int:
+        """
+        Rebuild the search tokens of a batch of records, in record_id order.
+
+        Arguments:
+            after_record_id: int,
+            limit: int
+
+        Returns:
+            int (last record_id indexed, 0 when there are no more)
+        """
+        try:
+            records = list(
+                self.Records.select(
+                    self.Records.record_id,
+                    self.Records.site_id,
+                    self.Records.region_id,
+                    self.Records.records_name,
+                    self.Records.records_telephone,
+                    self.Records.iv
+                )
+                .where(self.Records.record_id > after_record_id)
+                .order_by(self.Records.record_id)
+                .limit(limit)
+                .dicts()
+            )
+
+            if not records:
+                return 0
+
+            data = self.Data()
+            records = data.decrypt_rows(rows=records, fields=["records_name", "records_telephone"])
+
+            with self.Records._meta.database.atomic():
+                for record in records:
+                    self.__index__(
+                        record_id=record["record_id"],
+                        site_id=record["site_id"],
+                        region_id=record["region_id"],
+                        records_name=record["records_name"],
+                        records_telephone=record["records_telephone"]
+                    )
+
+            logger.info("- Indexed records %d to %d" % (records[0]["record_id"], records[-1]["record_id"]))
+            return records[-1]["record_id"]
+
+        except DatabaseError as err:
+            logger.error("indexing records after %d failed check logs" % after_record_id)
+            raise InternalServerError(err)
+
+    def ingest_records(self, site_id: int, region_id: int, records_user_id: int, items: list) -> list:
+        """
+        Create many records, and the child forms they carry, in one transaction.
+
+        Each item is a record form with an idempotency_key and optional
+        lists of specimen_collections, labs, follow_ups, outcome_recorded
+        and tb_treatment_outcomes forms. Invalid items are reported and
+        skipped. Items whose key this user already sent are not created
+        again and return their first record_id. The rest are encrypted in
+        one batch and written with multi-row INSERTs.
+
+        Arguments:
+            site_id: int,
+            region_id: int,
+            records_user_id: int,
+            items: list
+
+        Returns:
+            list (one result per item)
+        """
+        try:
+            logger.debug("ingesting %d record(s) for %s ..." % (len(items), records_user_id))
+
+            record_fields = form_fields(self.Records, ["site_id", "region_id", "records_user_id", "iv"])
+            child_fields = {name: form_fields(model, [record_field, user_field]) for name, (model, record_field, user_field) in children.items()}
+
+            results = []
+            valid = []
+            keys = set()
+
+            for index, item in enumerate(items):
+                key = item.get("idempotency_key") if isinstance(item, dict) else None
+                results.append({"index": index, "idempotency_key": key})
+
+                try:
+                    if not isinstance(key, str) or not 0 < len(key) <= 64:
+                        raise BadRequest("invalid idempotency_key")
+                    elif key in keys:
+                        raise BadRequest("duplicate idempotency_key")
+
+                    keys.add(key)
+
+                    row = form_row(record_fields, item, encrypted=encrypted_fields)
+                    forms = {}
+
+                    for name in children:
+                        if not isinstance(item.get(name) or [], list):
+                            raise BadRequest("invalid %s" % name)
+
+                        forms[name] = [form_row(child_fields[name], form) for form in item.get(name) or []]
+
+                except BadRequest as error:
+                    results[index].update({"status": "invalid", "error": error.description})
+                else:
+                    valid.append((index, key, row, forms))
+
+            replayed = {}
+
+            if keys:
+                replayed = {
+                    ingest["idempotency_key"]: ingest["record_id"] for ingest in
+                    self.Records_ingest.select(self.Records_ingest.idempotency_key, self.Records_ingest.record_id)
+                    .where(self.Records_ingest.user_id == records_user_id, self.Records_ingest.idempotency_key.in_(list(keys)))
+                    .dicts()
+                }
+
+            created = []
+
+            for index, key, row, forms in valid:
+                if key in replayed:
+                    results[index].update({"status": "replayed", "record_id": replayed[key]})
+                else:
+                    created.append((index, key, row, forms))
+
+            if not created:
+                return results
+
+            data = self.Data()
+
+            # whole seconds, so the stored value compares equal
+            records_date = datetime.now().replace(microsecond=0)
+
+            rows = data.encrypt_rows(rows=[row for index, key, row, forms in created], fields=encrypted_fields)
+
+            for row in rows:
+                row.update({"site_id": site_id, "region_id": region_id, "records_user_id": records_user_id, "records_date": records_date})
+
+            with self.Records._meta.database.atomic():
+                for start in range(0, len(rows), ingest_chunk_size):
+                    self.Records.insert_many(rows[start:start + ingest_chunk_size]).execute()
+
+                # every row has its own random iv, which tells the new ids apart
+                record_ids = {}
+
+                for start in range(0, len(rows), ingest_chunk_size):
+                    record_ids.update({
+                        record["iv"]: record["record_id"] for record in
+                        self.Records.select(self.Records.record_id, self.Records.iv)
+                        .where(
+                            self.Records.site_id == site_id,
+                            self.Records.region_id == region_id,
+                            self.Records.records_date == records_date,
+                            self.Records.iv.in_([row["iv"] for row in rows[start:start + ingest_chunk_size]])
+                        )
+                        .dicts()
+                    })
+
+                ingests = []
+                tokens = []
+                forms_rows = {name: [] for name in children}
+
+                for (index, key, row, forms), encrypted_row in zip(created, rows):
+                    record_id = record_ids[encrypted_row["iv"]]
+
+                    results[index].update({"status": "created", "record_id": record_id})
+                    ingests.append({"user_id": records_user_id, "idempotency_key": key, "record_id": record_id})
+
+                    for field, value in (("name", row["records_name"]), ("telephone", row["records_telephone"])):
+                        for token in search.index_tokens(field, value):
+                            tokens.append({"record_id": record_id, "site_id": site_id, "region_id": region_id, "field": field, "token": token})
+
+                    for name, (model, record_field, user_field) in children.items():
+                        for form in forms[name]:
+                            forms_rows[name].append(dict(form, **{record_field: record_id, user_field: records_user_id}))
+
+                for start in range(0, len(ingests), ingest_chunk_size):
+                    self.Records_ingest.insert_many(ingests[start:start + ingest_chunk_size]).execute()
+
+                for start in range(0, len(tokens), ingest_chunk_size * 10):
+                    self.Records_search.insert_many(tokens[start:start + ingest_chunk_size * 10]).execute()
+
+                ids = sorted(record_ids.values())
+                changes = [{"site_id": site_id, "region_id": region_id, "record_id": record_id, "entity": "records", "row_id": record_id, "op": "upsert"} for record_id in ids]
+
+                for name, (model, record_field, user_field) in children.items():
+                    if not forms_rows[name]:
+                        continue
+
+                    for start in range(0, len(forms_rows[name]), ingest_chunk_size):
+                        model.insert_many(forms_rows[name][start:start + ingest_chunk_size]).execute()
+
+                    # the records are new, so all their children are the ones just written
+                    child_ids = {}
+
+                    for child in (
+                        model.select(model._meta.primary_key, getattr(model, record_field))
+                        .where(getattr(model, record_field).in_(ids))
+                        .order_by(model._meta.primary_key)
+                        .tuples()
+                    ):
+                        child_ids.setdefault(child[1], []).append(child[0])
+
+                    for index, key, row, forms in created:
+                        if forms[name]:
+                            results[index][name] = child_ids[results[index]["record_id"]]
+
+                            for child_id in child_ids[results[index]["record_id"]]:
+                                changes.append({"site_id": site_id, "region_id": region_id, "record_id": results[index]["record_id"], "entity": name, "row_id": child_id, "op": "upsert"})
+
+                for start in range(0, len(changes), ingest_chunk_size):
+                    self.Records_changes.insert_many(changes[start:start + ingest_chunk_size]).execute()
+
+            logger.info("- Ingested %d record(s), %d replayed, %d invalid" % (len(created), len(valid) - len(created), len(items) - len(valid)))
+            return results
+
+        except IntegrityError as error:
+            logger.error(error)
+            raise Conflict("idempotency_key in use by a concurrent request")
+
+        except OperationalError as error:
+            logger.error(error)
+            raise BadRequest()
+
+        except DatabaseError as err:
+            logger.error("ingesting records for %s failed check logs" % records_user_id)
+            raise InternalServerError(err)
+
     def fetch_record(self, record_id: int, site_id: int, region_id: int, records_user_id: int, permitted_decrypted_data: bool) -> list:
         """
         Fetch a record by record_id, site_id and region_id.
@@ -292,130 +1008,261 @@ class Record_Model:
             logger.error("failed to find record for %s check logs" % records_user_id)
             raise InternalServerError(err)
 
-    def fetch_records(self, site_id: int, region_id: int, records_user_id: int, permitted_decrypted_data: bool, records_name: str, record_id: int, records_telephone: str) -> list:
+    def fetch_records(self, sites: list, records_user_id: int, permitted_decrypted_data: bool, records_name: str, record_id: int, records_telephone: str, limit: int = page_size, cursor: str = None) -> tuple:
         """
-        Fetch all records >= today by site_id and region_id.
+        Fetch a page of records across sites, newest first.
+
+        Pages are keyset on (records_date, record_id): the cursor returned
+        with one page picks up strictly after its last record, so a page
+        costs the same however deep it is.
 
         Arguments:
-            site_id: int,
-            region_id: int,
+            sites: list [(site_id, region_id)],
             records_user_id: int,
             permitted_decrypted_data; bool,
-            name: str,
+            records_name: str,
             record_id: int,
-            phone_number: str
+            records_telephone: str,
+            limit: int,
+            cursor: str (optional)
 
         Returns:
-            list
+            (list, str) the page and the next page's cursor, None on the last page
         """
         try:
             logger.debug("finding records for %s ..." % records_user_id)
 
             result = []
 
-            if record_id:
-                records = (
-                    self.Records.select(
-                        self.Records.record_id,
-                        self.Records.records_name,
-                        self.Records.records_telephone,
-                        self.Records.records_date,
-                        self.Records.records_sex,
-                        self.Records.records_date_of_test_request,
-                        self.Records.iv
-                    ).where(
-                        self.Records.record_id == record_id,
-                        self.Records.site_id == site_id,
-                        self.Records.region_id == region_id,
-                    ).dicts()
-                )
-            elif records_telephone or records_name:
-                records = (
-                    self.Records.select(
-                        self.Records.record_id,
-                        self.Records.records_name,
-                        self.Records.records_telephone,
-                        self.Records.records_date,
-                        self.Records.records_sex,
-                        self.Records.records_date_of_test_request,
-                        self.Records.iv
-                    ).where(
-                        self.Records.site_id == site_id,
-                        self.Records.region_id == region_id,
-                    ).dicts()
+            if len(sites) < 1:
+                return result, None
+
+            records = (
+                self.Records.select(
+                    self.Records.record_id,
+                    self.Records.records_name,
+                    self.Records.records_telephone,
+                    self.Records.records_date,
+                    self.Records.records_sex,
+                    self.Records.records_date_of_test_request,
+                    self.Records.iv
+                ).where(
+                    Tuple(self.Records.site_id, self.Records.region_id).in_(sites)
                 )
-            else:
-                records = (
-                    self.Records.select(
-                        self.Records.record_id,
-                        self.Records.records_name,
-                        self.Records.records_telephone,
-                        self.Records.records_date,
-                        self.Records.records_sex,
-                        self.Records.records_date_of_test_request,
-                        self.Records.iv
-                    )
+            )
+
+            if record_id:
+                records = records.where(self.Records.record_id == record_id)
+            elif permitted_decrypted_data and (records_telephone or records_name):
+                field, query = ("name", records_name) if records_name else ("telephone", records_telephone)
+                tokens = search.query_tokens(field, query)
+
+                matched = (
+                    self.Records_search.select(self.Records_search.record_id)
                     .where(
-                        self.Records.site_id == site_id,
-                        self.Records.region_id == region_id,
+                        Tuple(self.Records_search.site_id, self.Records_search.region_id).in_(sites),
+                        self.Records_search.field == field,
+                        self.Records_search.token.in_(list(tokens))
                     )
-                    .order_by(self.Records.records_date.desc())
-                    .limit(10)
-                    .dicts()
+                    .group_by(self.Records_search.record_id)
+                    .having(fn.COUNT(fn.DISTINCT(self.Records_search.token)) == len(tokens))
                 )
 
-            for record in records.iterator():
-                if permitted_decrypted_data:
-                    iv = record["iv"]
+                records = records.where(self.Records.record_id.in_(matched))
 
-                    data = self.Data()
+            records = records.order_by(self.Records.records_date.desc(), self.Records.record_id.desc())
 
-                    if records_name:
-                        if records_name.lower() in data.decrypt(record["records_name"], iv).lower():
-                            result.append({
-                                "record_id" : record["record_id"],
-                                "records_name" : data.decrypt(record["records_name"], iv),
-                                "records_telephone": data.decrypt(record["records_telephone"], iv),
-                                "records_date" : record["records_date"],
-                                "records_sex" : record["records_sex"],
-                                "records_date_of_test_request" : record["records_date_of_test_request"]
-                            })
-                    elif records_telephone:
-                        if records_telephone in data.decrypt(record["records_telephone"], iv):
-                            result.append({
-                                "record_id" : record["record_id"],
-                                "records_name" : data.decrypt(record["records_name"], iv),
-                                "records_telephone": data.decrypt(record["records_telephone"], iv),
-                                "records_date" : record["records_date"],
-                                "records_sex" : record["records_sex"],
-                                "records_date_of_test_request" : record["records_date_of_test_request"]
-                            })
-                    else:
-                        result.append({
-                            "record_id" : record["record_id"],
-                            "records_name" : data.decrypt(record["records_name"], iv),
-                            "records_telephone": data.decrypt(record["records_telephone"], iv),
-                            "records_date" : record["records_date"],
-                            "records_sex" : record["records_sex"],
-                            "records_date_of_test_request" : record["records_date_of_test_request"]
-                        })
+            # n-gram tokens can match values that only contain the query's
+            # pieces, so a search reads on until a full page passes the check
+            filtered = permitted_decrypted_data and not record_id and (records_name or records_telephone)
+
+            data = self.Data()
+            page = []
+            batch = self.__after__(records, *decode_cursor(cursor)) if cursor else records
+
+            while True:
+                rows = list(batch.limit(limit + 1).dicts())
+
+                if permitted_decrypted_data:
+                    rows = data.decrypt_rows(rows=rows, fields=["records_name", "records_telephone"])
+
+                if filtered and records_name:
+                    page += [row for row in rows if search.matches("name", records_name, row["records_name"])]
+                elif filtered:
+                    page += [row for row in rows if search.matches("telephone", records_telephone, row["records_telephone"])]
                 else:
-                    result.append({
-                        "record_id" : record["record_id"],
-                        "records_name" : record["records_name"],
-                        "records_telephone" : record["records_telephone"],
-                        "records_date" : record["records_date"],
-                        "records_sex" : record["records_sex"],
-                        "records_date_of_test_request" : record["records_date_of_test_request"]
-                    })
+                    page += rows
 
-            logger.info("- Successfully found records with site_id = %s & region_id = %s requested by user_id = %s" % (site_id, region_id, records_user_id))
-            return result
+                if not filtered or len(page) > limit or len(rows) <= limit:
+                    break
+
+                batch = self.__after__(records, rows[-1]["records_date"], rows[-1]["record_id"])
+
+            next_cursor = None
+
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = encode_cursor(page[-1]["records_date"], page[-1]["record_id"])
+
+            for record in page:
+                result.append({
+                    "record_id" : record["record_id"],
+                    "records_name" : record["records_name"],
+                    "records_telephone" : record["records_telephone"],
+                    "records_date" : record["records_date"],
+                    "records_sex" : record["records_sex"],
+                    "records_date_of_test_request" : record["records_date_of_test_request"]
+                })
+
+            logger.info("- Successfully found %d record(s) in %d site(s) requested by user_id = %s" % (len(result), len(sites), records_user_id))
+            return result, next_cursor
 
         except DatabaseError as err:
             logger.error("failed to find record for %s check logs" % records_user_id)
             raise InternalServerError(err)
 
+    def __after__(self, records, last_date: datetime, last_record_id: int):
+        """
+        Narrow a newest-first records query to the rows after a page's last record.
+        """
+        return records.where(
+            (self.Records.records_date < last_date) |
+            ((self.Records.records_date == last_date) & (self.Records.record_id < last_record_id))
+        )
+
+    def __settled__(self, seq: int) -> bool:
+        """
+        Whether writes fed before seq have had SYNC_SETTLE seconds to commit.
+        """
+        created = self.Records_changes.select(self.Records_changes.createdAt).where(self.Records_changes.seq == seq).scalar()
+
+        return not created or created <= datetime.now() - timedelta(seconds=sync_settle)
+
+    def sites_version(self, sites: list) -> int:
+        """
+        Latest change feed position of the given sites, for entity tags.
+
+        Arguments:
+            sites: list (of (site_id, region_id))
+
+        Returns:
+            int (None while a recent write may still be committing)
+        """
+        try:
+            if not sites:
+                return 0
+
+            versions = (
+                self.Records_changes.select(fn.MAX(self.Records_changes.seq))
+                .where(Tuple(self.Records_changes.site_id, self.Records_changes.region_id).in_(sites))
+                .group_by(self.Records_changes.site_id, self.Records_changes.region_id)
+                .tuples()
+            )
+
+            version = max([row[0] for row in versions], default=0)
+
+            if version and not self.__settled__(version):
+                return None
+
+            return version
+
+        except DatabaseError as err:
+            logger.error("failed to find version of %d site(s) check logs" % len(sites))
+            raise InternalServerError(err)
+
+    def record_version(self, record_id: int, sites: list) -> tuple:
+        """
+        Latest change feed position of a record and its child forms, for
+        entity tags.
+
+        Arguments:
+            record_id: int,
+            sites: list (of (site_id, region_id))
+
+        Returns:
+            (bool, int) (whether the record is in the sites, None while a recent write may still be committing)
+        """
+        try:
+            if not sites:
+                return False, None
+
+            found, version = (
+                self.Records.select(fn.COUNT(self.Records.record_id), fn.MAX(self.Records_changes.seq))
+                .join(self.Records_changes, JOIN.LEFT_OUTER, on=(self.Records_changes.record_id == self.Records.record_id))
+                .where(
+                    self.Records.record_id == record_id,
+                    Tuple(self.Records.site_id, self.Records.region_id).in_(sites)
+                )
+                .tuples()
+                .get()
+            )
+
+            if not found:
+                return False, None
+
+            if version and not self.__settled__(version):
+                return True, None
+
+            return True, version or 0
+
+        except DatabaseError as err:
+            logger.error("failed to find version of record %s check logs" % record_id)
+            raise InternalServerError(err)
+
+    def fetch_bundle(self, record_id: int, sites: list, permitted_decrypted_data: bool) -> dict:
+        """
+        Fetch a record and all its child forms.
+
+        Arguments:
+            record_id: int,
+            sites: list (of (site_id, region_id)),
+            permitted_decrypted_data: bool
+
+        Returns:
+            dict (None when the record is not in the sites)
+        """
+        try:
+            logger.debug("finding bundle of record %s ..." % record_id)
+
+            if not sites:
+                return None
+
+            record = (
+                self.Records.select()
+                .where(
+                    self.Records.record_id == record_id,
+                    Tuple(self.Records.site_id, self.Records.region_id).in_(sites)
+                )
+                .dicts()
+                .first()
+            )
+
+            if not record:
+                return None
+
+            if permitted_decrypted_data:
+                data = self.Data()
+                record = data.decrypt_rows(rows=[record], fields=encrypted_fields)[0]
+
+            record.pop("iv")
+
+            result = {"record": record}
+
+            for name, (model, record_field, user_field) in children.items():
+                result[name] = list(
+                    model.select()
+                    .where(getattr(model, record_field) == record_id)
+                    .order_by(model._meta.primary_key)
+                    .dicts()
+                )
+
+            logger.info("- Successfully found bundle of record %s" % record_id)
+            return result
+
+        except DatabaseError as err:
+            logger.error("failed to find bundle of record %s check logs" % record_id)
+            raise InternalServerError(err)
+
     # specimen collection 
 
     def create_specimen_collection(self, specimen_collection_records_id: int, specimen_collection_user_id: int, specimen_collection_1_date: str, specimen_collection_1_specimen_collection_type: str, specimen_collection_1_other: str, specimen_collection_1_period: str, specimen_collection_1_aspect: str, specimen_collection_1_received_by: str, specimen_collection_2_date: str, specimen_collection_2_specimen_collection_type: str, specimen_collection_2_other: str, specimen_collection_2_period: str, specimen_collection_2_aspect: str, specimen_collection_2_received_by: str) -> str:
@@ -444,22 +1291,25 @@ class Record_Model:
         try:
             logger.debug("creating specimen_collection record for %s ..." % specimen_collection_user_id)
             
-            specimen_collection = self.Specimen_collections.create(
-                specimen_collection_records_id=specimen_collection_records_id,
-                specimen_collection_user_id=specimen_collection_user_id,
-                specimen_collection_1_date=specimen_collection_1_date,
-                specimen_collection_1_specimen_collection_type=specimen_collection_1_specimen_collection_type,
-                specimen_collection_1_other=specimen_collection_1_other,
-                specimen_collection_1_period=specimen_collection_1_period,
-                specimen_collection_1_aspect=specimen_collection_1_aspect,
-                specimen_collection_1_received_by=specimen_collection_1_received_by,
-                specimen_collection_2_date=specimen_collection_2_date,
-                specimen_collection_2_specimen_collection_type=specimen_collection_2_specimen_collection_type,
-                specimen_collection_2_other=specimen_collection_2_other,
-                specimen_collection_2_period=specimen_collection_2_period,
-                specimen_collection_2_aspect=specimen_collection_2_aspect,
-                specimen_collection_2_received_by=specimen_collection_2_received_by
-            )
+            with self.Records._meta.database.atomic():
+                specimen_collection = self.Specimen_collections.create(
+                    specimen_collection_records_id=specimen_collection_records_id,
+                    specimen_collection_user_id=specimen_collection_user_id,
+                    specimen_collection_1_date=specimen_collection_1_date,
+                    specimen_collection_1_specimen_collection_type=specimen_collection_1_specimen_collection_type,
+                    specimen_collection_1_other=specimen_collection_1_other,
+                    specimen_collection_1_period=specimen_collection_1_period,
+                    specimen_collection_1_aspect=specimen_collection_1_aspect,
+                    specimen_collection_1_received_by=specimen_collection_1_received_by,
+                    specimen_collection_2_date=specimen_collection_2_date,
+                    specimen_collection_2_specimen_collection_type=specimen_collection_2_specimen_collection_type,
+                    specimen_collection_2_other=specimen_collection_2_other,
+                    specimen_collection_2_period=specimen_collection_2_period,
+                    specimen_collection_2_aspect=specimen_collection_2_aspect,
+                    specimen_collection_2_received_by=specimen_collection_2_received_by
+                )
+
+                self.__change__(entity="specimen_collections", row_id=specimen_collection.specimen_collection_id, record_id=specimen_collection_records_id)
 
             logger.info("- Specimen_collection record %s successfully created" % specimen_collection)
             return str(specimen_collection)
@@ -482,24 +1332,27 @@ class Record_Model:
         try:
             logger.debug("updating specimen_collection record %s ..." % specimen_collection_id)
             
-            specimen_collection = self.Specimen_collections.update(
-                specimen_collection_1_date=specimen_collection_1_date,
-                specimen_collection_1_specimen_collection_type=specimen_collection_1_specimen_collection_type,
-                specimen_collection_1_other=specimen_collection_1_other,
-                specimen_collection_1_period=specimen_collection_1_period,
-                specimen_collection_1_aspect=specimen_collection_1_aspect,
-                specimen_collection_1_received_by=specimen_collection_1_received_by,
-                specimen_collection_2_date=specimen_collection_2_date,
-                specimen_collection_2_specimen_collection_type=specimen_collection_2_specimen_collection_type,
-                specimen_collection_2_other=specimen_collection_2_other,
-                specimen_collection_2_period=specimen_collection_2_period,
-                specimen_collection_2_aspect=specimen_collection_2_aspect,
-                specimen_collection_2_received_by=specimen_collection_2_received_by
-            ).where(
-                self.Specimen_collections.specimen_collection_id == specimen_collection_id
-            )
+            with self.Records._meta.database.atomic():
+                specimen_collection = self.Specimen_collections.update(
+                    specimen_collection_1_date=specimen_collection_1_date,
+                    specimen_collection_1_specimen_collection_type=specimen_collection_1_specimen_collection_type,
+                    specimen_collection_1_other=specimen_collection_1_other,
+                    specimen_collection_1_period=specimen_collection_1_period,
+                    specimen_collection_1_aspect=specimen_collection_1_aspect,
+                    specimen_collection_1_received_by=specimen_collection_1_received_by,
+                    specimen_collection_2_date=specimen_collection_2_date,
+                    specimen_collection_2_specimen_collection_type=specimen_collection_2_specimen_collection_type,
+                    specimen_collection_2_other=specimen_collection_2_other,
+                    specimen_collection_2_period=specimen_collection_2_period,
+                    specimen_collection_2_aspect=specimen_collection_2_aspect,
+                    specimen_collection_2_received_by=specimen_collection_2_received_by
+                ).where(
+                    self.Specimen_collections.specimen_collection_id == specimen_collection_id
+                )
+
+                specimen_collection.execute()
 
-            specimen_collection.execute()
+                self.__change__(entity="specimen_collections", row_id=specimen_collection_id)
 
             logger.info("- Specimen_collection record %s successfully updated" % specimen_collection_id)
             return specimen_collection_id
@@ -555,51 +1408,54 @@ class Record_Model:
         try:
             logger.debug("creating lab record for %s ..." % lab_user_id)
             
-            lab = self.Labs.create(
-                lab_records_id=lab_records_id,
-                lab_user_id=lab_user_id,
-                lab_date_specimen_collection_received=lab_date_specimen_collection_received,
-                lab_received_by=lab_received_by,
-                lab_registration_number=lab_registration_number,
-                lab_smear_microscopy_result_result_1=lab_smear_microscopy_result_result_1,
-                lab_smear_microscopy_result_result_2=lab_smear_microscopy_result_result_2,
-                lab_smear_microscopy_result_date=lab_smear_microscopy_result_date,
-                lab_smear_microscopy_result_done_by=lab_smear_microscopy_result_done_by,
-                lab_xpert_mtb_rif_assay_result=lab_xpert_mtb_rif_assay_result,
-                lab_xpert_mtb_rif_assay_grades=lab_xpert_mtb_rif_assay_grades,
-                lab_xpert_mtb_rif_assay_rif_result=lab_xpert_mtb_rif_assay_rif_result,
-                lab_xpert_mtb_rif_assay_result_2=lab_xpert_mtb_rif_assay_result_2,
-                lab_xpert_mtb_rif_assay_grades_2=lab_xpert_mtb_rif_assay_grades_2,
-                lab_xpert_mtb_rif_assay_rif_result_2=lab_xpert_mtb_rif_assay_rif_result_2,
-                lab_xpert_mtb_rif_assay_date=lab_xpert_mtb_rif_assay_date,
-                lab_xpert_mtb_rif_assay_done_by=lab_xpert_mtb_rif_assay_done_by,
-                lab_urine_lf_lam_result=lab_urine_lf_lam_result,
-                lab_urine_lf_lam_date=lab_urine_lf_lam_date,
-                lab_urine_lf_lam_done_by=lab_urine_lf_lam_done_by,
-                lab_culture_mgit_culture=lab_culture_mgit_culture,
-                lab_culture_lj_culture=lab_culture_lj_culture,
-                lab_culture_date=lab_culture_date,
-                lab_culture_done_by=lab_culture_done_by,
-                lab_lpa_mtbdrplus_isoniazid=lab_lpa_mtbdrplus_isoniazid,
-                lab_lpa_mtbdrplus_rifampin=lab_lpa_mtbdrplus_rifampin,
-                lab_lpa_mtbdrs_flouoroquinolones=lab_lpa_mtbdrs_flouoroquinolones,
-                lab_lpa_mtbdrs_kanamycin=lab_lpa_mtbdrs_kanamycin,
-                lab_lpa_mtbdrs_amikacin=lab_lpa_mtbdrs_amikacin,
-                lab_lpa_mtbdrs_capreomycin=lab_lpa_mtbdrs_capreomycin,
-                lab_lpa_mtbdrs_low_level_kanamycin=lab_lpa_mtbdrs_low_level_kanamycin,
-                lab_lpa_date=lab_lpa_date,
-                lab_lpa_done_by=lab_lpa_done_by,
-                lab_dst_isonazid=lab_dst_isonazid,
-                lab_dst_rifampin=lab_dst_rifampin,
-                lab_dst_ethambutol=lab_dst_ethambutol,
-                lab_dst_kanamycin=lab_dst_kanamycin,
-                lab_dst_ofloxacin=lab_dst_ofloxacin,
-                lab_dst_levofloxacinekanamycin=lab_dst_levofloxacinekanamycin,
-                lab_dst_moxifloxacinekanamycin=lab_dst_moxifloxacinekanamycin,
-                lab_dst_amikacinekanamycin=lab_dst_amikacinekanamycin,
-                lab_dst_date=lab_dst_date,
-                lab_dst_done_by=lab_dst_done_by
-            )
+            with self.Records._meta.database.atomic():
+                lab = self.Labs.create(
+                    lab_records_id=lab_records_id,
+                    lab_user_id=lab_user_id,
+                    lab_date_specimen_collection_received=lab_date_specimen_collection_received,
+                    lab_received_by=lab_received_by,
+                    lab_registration_number=lab_registration_number,
+                    lab_smear_microscopy_result_result_1=lab_smear_microscopy_result_result_1,
+                    lab_smear_microscopy_result_result_2=lab_smear_microscopy_result_result_2,
+                    lab_smear_microscopy_result_date=lab_smear_microscopy_result_date,
+                    lab_smear_microscopy_result_done_by=lab_smear_microscopy_result_done_by,
+                    lab_xpert_mtb_rif_assay_result=lab_xpert_mtb_rif_assay_result,
+                    lab_xpert_mtb_rif_assay_grades=lab_xpert_mtb_rif_assay_grades,
+                    lab_xpert_mtb_rif_assay_rif_result=lab_xpert_mtb_rif_assay_rif_result,
+                    lab_xpert_mtb_rif_assay_result_2=lab_xpert_mtb_rif_assay_result_2,
+                    lab_xpert_mtb_rif_assay_grades_2=lab_xpert_mtb_rif_assay_grades_2,
+                    lab_xpert_mtb_rif_assay_rif_result_2=lab_xpert_mtb_rif_assay_rif_result_2,
+                    lab_xpert_mtb_rif_assay_date=lab_xpert_mtb_rif_assay_date,
+                    lab_xpert_mtb_rif_assay_done_by=lab_xpert_mtb_rif_assay_done_by,
+                    lab_urine_lf_lam_result=lab_urine_lf_lam_result,
+                    lab_urine_lf_lam_date=lab_urine_lf_lam_date,
+                    lab_urine_lf_lam_done_by=lab_urine_lf_lam_done_by,
+                    lab_culture_mgit_culture=lab_culture_mgit_culture,
+                    lab_culture_lj_culture=lab_culture_lj_culture,
+                    lab_culture_date=lab_culture_date,
+                    lab_culture_done_by=lab_culture_done_by,
+                    lab_lpa_mtbdrplus_isoniazid=lab_lpa_mtbdrplus_isoniazid,
+                    lab_lpa_mtbdrplus_rifampin=lab_lpa_mtbdrplus_rifampin,
+                    lab_lpa_mtbdrs_flouoroquinolones=lab_lpa_mtbdrs_flouoroquinolones,
+                    lab_lpa_mtbdrs_kanamycin=lab_lpa_mtbdrs_kanamycin,
+                    lab_lpa_mtbdrs_amikacin=lab_lpa_mtbdrs_amikacin,
+                    lab_lpa_mtbdrs_capreomycin=lab_lpa_mtbdrs_capreomycin,
+                    lab_lpa_mtbdrs_low_level_kanamycin=lab_lpa_mtbdrs_low_level_kanamycin,
+                    lab_lpa_date=lab_lpa_date,
+                    lab_lpa_done_by=lab_lpa_done_by,
+                    lab_dst_isonazid=lab_dst_isonazid,
+                    lab_dst_rifampin=lab_dst_rifampin,
+                    lab_dst_ethambutol=lab_dst_ethambutol,
+                    lab_dst_kanamycin=lab_dst_kanamycin,
+                    lab_dst_ofloxacin=lab_dst_ofloxacin,
+                    lab_dst_levofloxacinekanamycin=lab_dst_levofloxacinekanamycin,
+                    lab_dst_moxifloxacinekanamycin=lab_dst_moxifloxacinekanamycin,
+                    lab_dst_amikacinekanamycin=lab_dst_amikacinekanamycin,
+                    lab_dst_date=lab_dst_date,
+                    lab_dst_done_by=lab_dst_done_by
+                )
+
+                self.__change__(entity="labs", row_id=lab.lab_id, record_id=lab_records_id)
 
             logger.info("- Lab record %s successfully created" % lab)
             return str(lab)
@@ -622,53 +1478,56 @@ class Record_Model:
         try:
             logger.debug("updating lab record %s ..." % lab_id)
             
-            lab = self.Labs.update(
-                lab_date_specimen_collection_received=lab_date_specimen_collection_received,
-                lab_received_by=lab_received_by,
-                lab_registration_number=lab_registration_number,
-                lab_smear_microscopy_result_result_1=lab_smear_microscopy_result_result_1,
-                lab_smear_microscopy_result_result_2=lab_smear_microscopy_result_result_2,
-                lab_smear_microscopy_result_date=lab_smear_microscopy_result_date,
-                lab_smear_microscopy_result_done_by=lab_smear_microscopy_result_done_by,
-                lab_xpert_mtb_rif_assay_result=lab_xpert_mtb_rif_assay_result,
-                lab_xpert_mtb_rif_assay_grades=lab_xpert_mtb_rif_assay_grades,
-                lab_xpert_mtb_rif_assay_rif_result=lab_xpert_mtb_rif_assay_rif_result,
-                lab_xpert_mtb_rif_assay_result_2=lab_xpert_mtb_rif_assay_result_2,
-                lab_xpert_mtb_rif_assay_grades_2=lab_xpert_mtb_rif_assay_grades_2,
-                lab_xpert_mtb_rif_assay_rif_result_2=lab_xpert_mtb_rif_assay_rif_result_2,
-                lab_xpert_mtb_rif_assay_date=lab_xpert_mtb_rif_assay_date,
-                lab_xpert_mtb_rif_assay_done_by=lab_xpert_mtb_rif_assay_done_by,
-                lab_urine_lf_lam_result=lab_urine_lf_lam_result,
-                lab_urine_lf_lam_date=lab_urine_lf_lam_date,
-                lab_urine_lf_lam_done_by=lab_urine_lf_lam_done_by,
-                lab_culture_mgit_culture=lab_culture_mgit_culture,
-                lab_culture_lj_culture=lab_culture_lj_culture,
-                lab_culture_date=lab_culture_date,
-                lab_culture_done_by=lab_culture_done_by,
-                lab_lpa_mtbdrplus_isoniazid=lab_lpa_mtbdrplus_isoniazid,
-                lab_lpa_mtbdrplus_rifampin=lab_lpa_mtbdrplus_rifampin,
-                lab_lpa_mtbdrs_flouoroquinolones=lab_lpa_mtbdrs_flouoroquinolones,
-                lab_lpa_mtbdrs_kanamycin=lab_lpa_mtbdrs_kanamycin,
-                lab_lpa_mtbdrs_amikacin=lab_lpa_mtbdrs_amikacin,
-                lab_lpa_mtbdrs_capreomycin=lab_lpa_mtbdrs_capreomycin,
-                lab_lpa_mtbdrs_low_level_kanamycin=lab_lpa_mtbdrs_low_level_kanamycin,
-                lab_lpa_date=lab_lpa_date,
-                lab_lpa_done_by=lab_lpa_done_by,
-                lab_dst_isonazid=lab_dst_isonazid,
-                lab_dst_rifampin=lab_dst_rifampin,
-                lab_dst_ethambutol=lab_dst_ethambutol,
-                lab_dst_kanamycin=lab_dst_kanamycin,
-                lab_dst_ofloxacin=lab_dst_ofloxacin,
-                lab_dst_levofloxacinekanamycin=lab_dst_levofloxacinekanamycin,
-                lab_dst_moxifloxacinekanamycin=lab_dst_moxifloxacinekanamycin,
-                lab_dst_amikacinekanamycin=lab_dst_amikacinekanamycin,
-                lab_dst_date=lab_dst_date,
-                lab_dst_done_by=lab_dst_done_by
-            ).where(
-                self.Labs.lab_id == lab_id
-            )
+            with self.Records._meta.database.atomic():
+                lab = self.Labs.update(
+                    lab_date_specimen_collection_received=lab_date_specimen_collection_received,
+                    lab_received_by=lab_received_by,
+                    lab_registration_number=lab_registration_number,
+                    lab_smear_microscopy_result_result_1=lab_smear_microscopy_result_result_1,
+                    lab_smear_microscopy_result_result_2=lab_smear_microscopy_result_result_2,
+                    lab_smear_microscopy_result_date=lab_smear_microscopy_result_date,
+                    lab_smear_microscopy_result_done_by=lab_smear_microscopy_result_done_by,
+                    lab_xpert_mtb_rif_assay_result=lab_xpert_mtb_rif_assay_result,
+                    lab_xpert_mtb_rif_assay_grades=lab_xpert_mtb_rif_assay_grades,
+                    lab_xpert_mtb_rif_assay_rif_result=lab_xpert_mtb_rif_assay_rif_result,
+                    lab_xpert_mtb_rif_assay_result_2=lab_xpert_mtb_rif_assay_result_2,
+                    lab_xpert_mtb_rif_assay_grades_2=lab_xpert_mtb_rif_assay_grades_2,
+                    lab_xpert_mtb_rif_assay_rif_result_2=lab_xpert_mtb_rif_assay_rif_result_2,
+                    lab_xpert_mtb_rif_assay_date=lab_xpert_mtb_rif_assay_date,
+                    lab_xpert_mtb_rif_assay_done_by=lab_xpert_mtb_rif_assay_done_by,
+                    lab_urine_lf_lam_result=lab_urine_lf_lam_result,
+                    lab_urine_lf_lam_date=lab_urine_lf_lam_date,
+                    lab_urine_lf_lam_done_by=lab_urine_lf_lam_done_by,
+                    lab_culture_mgit_culture=lab_culture_mgit_culture,
+                    lab_culture_lj_culture=lab_culture_lj_culture,
+                    lab_culture_date=lab_culture_date,
+                    lab_culture_done_by=lab_culture_done_by,
+                    lab_lpa_mtbdrplus_isoniazid=lab_lpa_mtbdrplus_isoniazid,
+                    lab_lpa_mtbdrplus_rifampin=lab_lpa_mtbdrplus_rifampin,
+                    lab_lpa_mtbdrs_flouoroquinolones=lab_lpa_mtbdrs_flouoroquinolones,
+                    lab_lpa_mtbdrs_kanamycin=lab_lpa_mtbdrs_kanamycin,
+                    lab_lpa_mtbdrs_amikacin=lab_lpa_mtbdrs_amikacin,
+                    lab_lpa_mtbdrs_capreomycin=lab_lpa_mtbdrs_capreomycin,
+                    lab_lpa_mtbdrs_low_level_kanamycin=lab_lpa_mtbdrs_low_level_kanamycin,
+                    lab_lpa_date=lab_lpa_date,
+                    lab_lpa_done_by=lab_lpa_done_by,
+                    lab_dst_isonazid=lab_dst_isonazid,
+                    lab_dst_rifampin=lab_dst_rifampin,
+                    lab_dst_ethambutol=lab_dst_ethambutol,
+                    lab_dst_kanamycin=lab_dst_kanamycin,
+                    lab_dst_ofloxacin=lab_dst_ofloxacin,
+                    lab_dst_levofloxacinekanamycin=lab_dst_levofloxacinekanamycin,
+                    lab_dst_moxifloxacinekanamycin=lab_dst_moxifloxacinekanamycin,
+                    lab_dst_amikacinekanamycin=lab_dst_amikacinekanamycin,
+                    lab_dst_date=lab_dst_date,
+                    lab_dst_done_by=lab_dst_done_by
+                ).where(
+                    self.Labs.lab_id == lab_id
+                )
 
-            lab.execute()
+                lab.execute()
+
+                self.__change__(entity="labs", row_id=lab_id)
 
             lab_obj = self.Labs.get(self.Labs.lab_id == lab_id)
 
@@ -719,15 +1578,18 @@ class Record_Model:
         try:
             logger.debug("creating follow_up record for %s ..." % follow_up_user_id)
 
-            follow_up = self.Follow_ups.create(
-                follow_up_records_id=follow_up_records_id,
-                follow_up_user_id=follow_up_user_id,
-                follow_up_xray=follow_up_xray,
-                follow_up_amoxicillin=follow_up_amoxicillin,
-                follow_up_other_antibiotic=follow_up_other_antibiotic,
-                follow_up_schedule_date=follow_up_schedule_date,
-                follow_up_comments=follow_up_comments
-            )
+            with self.Records._meta.database.atomic():
+                follow_up = self.Follow_ups.create(
+                    follow_up_records_id=follow_up_records_id,
+                    follow_up_user_id=follow_up_user_id,
+                    follow_up_xray=follow_up_xray,
+                    follow_up_amoxicillin=follow_up_amoxicillin,
+                    follow_up_other_antibiotic=follow_up_other_antibiotic,
+                    follow_up_schedule_date=follow_up_schedule_date,
+                    follow_up_comments=follow_up_comments
+                )
+
+                self.__change__(entity="follow_ups", row_id=follow_up.follow_up_id, record_id=follow_up_records_id)
 
             logger.info("Follow_up record %s successfully created" % follow_up)
             return str(follow_up)
@@ -750,17 +1612,20 @@ class Record_Model:
         try:
             logger.debug("updating follow_up record %s ..." % follow_up_id)
 
-            follow_up = self.Follow_ups.update(
-                follow_up_xray=follow_up_xray,
-                follow_up_amoxicillin=follow_up_amoxicillin,
-                follow_up_other_antibiotic=follow_up_other_antibiotic,
-                follow_up_schedule_date=follow_up_schedule_date,
-                follow_up_comments=follow_up_comments
-            ).where(
-                self.Follow_ups.follow_up_id == follow_up_id
-            )
+            with self.Records._meta.database.atomic():
+                follow_up = self.Follow_ups.update(
+                    follow_up_xray=follow_up_xray,
+                    follow_up_amoxicillin=follow_up_amoxicillin,
+                    follow_up_other_antibiotic=follow_up_other_antibiotic,
+                    follow_up_schedule_date=follow_up_schedule_date,
+                    follow_up_comments=follow_up_comments
+                ).where(
+                    self.Follow_ups.follow_up_id == follow_up_id
+                )
 
-            follow_up.execute()
+                follow_up.execute()
+
+                self.__change__(entity="follow_ups", row_id=follow_up_id)
 
             logger.info("Follow_up record %s successfully updated" % follow_up_id)
             return follow_up_id
@@ -809,14 +1674,17 @@ class Record_Model:
         try:
             logger.debug("creating outcome_recorded record for %s ..." % outcome_recorded_user_id)
 
-            outcome_recorded = self.Outcome_recorded.create(
-                outcome_recorded_records_id=outcome_recorded_records_id,
-                outcome_recorded_user_id=outcome_recorded_user_id,
-                outcome_recorded_started_tb_treatment_outcome=outcome_recorded_started_tb_treatment_outcome,
-                outcome_recorded_tb_rx_number=outcome_recorded_tb_rx_number,
-                outcome_recorded_other=outcome_recorded_other,
-                outcome_recorded_comments=outcome_recorded_comments
-            )
+            with self.Records._meta.database.atomic():
+                outcome_recorded = self.Outcome_recorded.create(
+                    outcome_recorded_records_id=outcome_recorded_records_id,
+                    outcome_recorded_user_id=outcome_recorded_user_id,
+                    outcome_recorded_started_tb_treatment_outcome=outcome_recorded_started_tb_treatment_outcome,
+                    outcome_recorded_tb_rx_number=outcome_recorded_tb_rx_number,
+                    outcome_recorded_other=outcome_recorded_other,
+                    outcome_recorded_comments=outcome_recorded_comments
+                )
+
+                self.__change__(entity="outcome_recorded", row_id=outcome_recorded.outcome_recorded_id, record_id=outcome_recorded_records_id)
 
             logger.info("Outcome_recorded record %s successfully created" % outcome_recorded)
             return str(outcome_recorded)
@@ -839,16 +1707,19 @@ class Record_Model:
         try:
             logger.debug("updating outcome_recorded record %s ..." % outcome_recorded_id)
 
-            outcome_recorded = self.Outcome_recorded.update(
-                outcome_recorded_started_tb_treatment_outcome=outcome_recorded_started_tb_treatment_outcome,
-                outcome_recorded_tb_rx_number=outcome_recorded_tb_rx_number,
-                outcome_recorded_other=outcome_recorded_other,
-                outcome_recorded_comments=outcome_recorded_comments
-            ).where(
-                self.Outcome_recorded.outcome_recorded_id == outcome_recorded_id
-            )
+            with self.Records._meta.database.atomic():
+                outcome_recorded = self.Outcome_recorded.update(
+                    outcome_recorded_started_tb_treatment_outcome=outcome_recorded_started_tb_treatment_outcome,
+                    outcome_recorded_tb_rx_number=outcome_recorded_tb_rx_number,
+                    outcome_recorded_other=outcome_recorded_other,
+                    outcome_recorded_comments=outcome_recorded_comments
+                ).where(
+                    self.Outcome_recorded.outcome_recorded_id == outcome_recorded_id
+                )
+
+                outcome_recorded.execute()
 
-            outcome_recorded.execute()
+                self.__change__(entity="outcome_recorded", row_id=outcome_recorded_id)
 
             logger.info("Outcome_recorded record %s successfully updated" % outcome_recorded_id)
             return outcome_recorded_id
@@ -897,13 +1768,16 @@ class Record_Model:
         try:
             logger.debug("creating tb_treatment_outcome record for %s ..." % tb_treatment_outcome_user_id)
 
-            tb_treatment_outcome = self.Tb_treatment_outcomes.create(
-                tb_treatment_outcome_records_id = tb_treatment_outcome_records_id,
-                tb_treatment_outcome_user_id = tb_treatment_outcome_user_id,
-                tb_treatment_outcome_result = tb_treatment_outcome_result,
-                tb_treatment_outcome_comments = tb_treatment_outcome_comments,
-                tb_treatment_outcome_close_patient_file = tb_treatment_outcome_close_patient_file
-            )
+            with self.Records._meta.database.atomic():
+                tb_treatment_outcome = self.Tb_treatment_outcomes.create(
+                    tb_treatment_outcome_records_id = tb_treatment_outcome_records_id,
+                    tb_treatment_outcome_user_id = tb_treatment_outcome_user_id,
+                    tb_treatment_outcome_result = tb_treatment_outcome_result,
+                    tb_treatment_outcome_comments = tb_treatment_outcome_comments,
+                    tb_treatment_outcome_close_patient_file = tb_treatment_outcome_close_patient_file
+                )
+
+                self.__change__(entity="tb_treatment_outcomes", row_id=tb_treatment_outcome.tb_treatment_outcome_id, record_id=tb_treatment_outcome_records_id)
 
             logger.info("Tb_treatment_outcome record %s successfully created" % tb_treatment_outcome)
             return str(tb_treatment_outcome)
@@ -926,15 +1800,18 @@ class Record_Model:
         try:
             logger.debug("updating tb_treatment_outcome record %s ..." % tb_treatment_outcome_id)
 
-            tb_treatment_outcome = self.Tb_treatment_outcomes.update(
-                tb_treatment_outcome_result = tb_treatment_outcome_result,
-                tb_treatment_outcome_comments = tb_treatment_outcome_comments,
-                tb_treatment_outcome_close_patient_file = tb_treatment_outcome_close_patient_file
-            ).where(
-                self.Tb_treatment_outcomes.tb_treatment_outcome_id == tb_treatment_outcome_id
-            )
+            with self.Records._meta.database.atomic():
+                tb_treatment_outcome = self.Tb_treatment_outcomes.update(
+                    tb_treatment_outcome_result = tb_treatment_outcome_result,
+                    tb_treatment_outcome_comments = tb_treatment_outcome_comments,
+                    tb_treatment_outcome_close_patient_file = tb_treatment_outcome_close_patient_file
+                ).where(
+                    self.Tb_treatment_outcomes.tb_treatment_outcome_id == tb_treatment_outcome_id
+                )
+
+                tb_treatment_outcome.execute()
 
-            tb_treatment_outcome.execute()
+                self.__change__(entity="tb_treatment_outcomes", row_id=tb_treatment_outcome_id)
 
             logger.info("Tb_treatment_outcome record %s successfully update" % tb_treatment_outcome_id)
             return tb_treatment_outcome_id
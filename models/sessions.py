@@ -6,9 +6,12 @@ config = baseConfig()
 api = config["API"]
 secure = api["SECURE_COOKIE"]
 hour = eval(api["COOKIE_MAXAGE"])
+write_interval = api.getint("SESSION_WRITE_INTERVAL", fallback=60)
 
 from peewee import DatabaseError
 
+from models.cache import TTL_Cache
+
 from schemas.users.sessions import Sessions
 
 from uuid import uuid4
@@ -18,6 +21,11 @@ from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import Conflict
 from werkzeug.exceptions import Unauthorized
 
+session_cache = TTL_Cache(
+    maxsize=api.getint("SESSION_CACHE_SIZE", fallback=10000),
+    ttl=api.getint("SESSION_CACHE_TTL", fallback=300)
+)
+
 class Session_Model:
     def __init__(self) -> None:
         """
@@ -57,6 +65,14 @@ class Session_Model:
                 data=str(data),
                 createdAt=datetime.now(),
             )
+            session_cache.set(str(session), {
+                "unique_identifier": str(unique_identifier),
+                "user_agent": user_agent,
+                "expires": expires,
+                "data": str(data),
+                "synced": datetime.now()
+            })
+
             logger.info(
                 "- SUCCESSFULLY CREATED SESSION %s FOR %s" % (str(session), unique_identifier) 
             )
@@ -66,41 +82,99 @@ class Session_Model:
             logger.error("FAILED TO CREATE SESSION FOR %s CHECK LOGS" % unique_identifier)
             raise InternalServerError(err) from None
 
-    def find(self, sid: str, unique_identifier: str, user_agent: str, cookie: dict) -> str:
+    def __fetch__(self, sid: str) -> dict:
         """
+        Load a session from the database into the cache.
+
+        Arguments:
+            sid: str
+
+        Returns:
+            dict
         """
-        try:
-            logger.debug("finding session %s for user %s ..." % (sid, unique_identifier))
+        logger.debug("fetching session %s from database ..." % sid)
 
-            result = []
+        result = []
 
-            sessions = (
-                self.Sessions.select()
-                .where(
-                    self.Sessions.sid == sid,
-                    self.Sessions.unique_identifier == unique_identifier,
-                    self.Sessions.user_agent == user_agent,
-                )
-                .dicts()
-            )
+        sessions = (
+            self.Sessions.select()
+            .where(self.Sessions.sid == sid)
+            .dicts()
+        )
+
+        for session in sessions:
+            result.append(session)
+
+        # check for duplicates
+        if len(result) > 1:
+            logger.error("Multiple sessions %s found" % sid)
+            raise Conflict()
+
+        # check for no user
+        if len(result) < 1:
+            logger.error("No session %s found" % sid)
+            raise Unauthorized()
+
+        expires = result[0]["expires"]
+
+        session = {
+            "unique_identifier": str(result[0]["unique_identifier"]),
+            "user_agent": result[0]["user_agent"],
+            "expires": expires,
+            "data": result[0]["data"],
+            # the stored expiry was written exactly one maxAge after the last write
+            "synced": expires - timedelta(milliseconds=hour) if expires else datetime.min
+        }
+
+        session_cache.set(sid, session)
+
+        return session
+
+    def __exists__(self, sid: str) -> bool:
+        """
+        Check a cached session still has its row. Logout and invalidation
+        delete the row, so this sees revocations made by any worker.
 
-            for session in sessions:
-                result.append(session)
+        Arguments:
+            sid: str
 
-            # check for duplicates
-            if len(result) > 1:
-                logger.error("Multiple sessions %s found" % sid)
-                raise Conflict()
+        Returns:
+            bool
+        """
+        return self.Sessions.select(self.Sessions.sid).where(self.Sessions.sid == sid).exists()
 
-            # check for no user
-            if len(result) < 1:
+    def find(self, sid: str, unique_identifier: str, user_agent: str, cookie: dict) -> str:
+        """
+        Validate a session, served from the session cache when possible.
+
+        Arguments:
+            sid: str,
+            unique_identifier: str,
+            user_agent: str,
+            cookie: dict
+
+        Returns:
+            str
+        """
+        try:
+            logger.debug("finding session %s for user %s ..." % (sid, unique_identifier))
+
+            session = session_cache.get(sid)
+
+            # an expired cache entry may be stale if another worker extended it
+            if not session or not session["expires"] or session["expires"] <= datetime.now():
+                session = self.__fetch__(sid=sid)
+            elif not self.__exists__(sid=sid):
+                # logged out or invalidated in another worker
+                session_cache.pop(sid)
                 logger.error("No session %s found" % sid)
                 raise Unauthorized()
 
-            expires = result[0]["expires"]
-            age = expires.timestamp() - datetime.now().timestamp()
+            if session["unique_identifier"] != str(unique_identifier) or session["user_agent"] != user_agent:
+                logger.error("No session %s found" % sid)
+                raise Unauthorized()
 
-            if age <= 0:
+            if not session["expires"] or session["expires"] <= datetime.now():
                 logger.error("Expired session %s" % sid)
                 raise Unauthorized()
 
@@ -108,31 +182,34 @@ class Session_Model:
             str_cookie = str_cookie.replace(": 'False'", ": False")
             str_cookie = str_cookie.replace(": 'True'", ": True")
 
-            if result[0]["data"] != str_cookie:
+            if session["data"] != str_cookie:
                 logger.error("Invalid cookie data")
-                logger.error('Original cokkie: %s' % result[0]["data"])
+                logger.error('Original cokkie: %s' % session["data"])
                 logger.error("Invalid cokkie: %s" % str_cookie)
                 raise Unauthorized()
 
             logger.info("SESSION %s FOUND" % sid)
-            return str(result[0]["unique_identifier"])
+            return session["unique_identifier"]
 
         except DatabaseError as err:
             logger.error("FAILED FINDING SESSION %s CHECK LOGS" % sid)
             raise InternalServerError(err) from None
 
     def update(self, sid: str, unique_identifier: str) -> dict:
-        try:
-            """
-            Update session in database.
+        """
+        Slide a session's expiry.
 
-            Arguments:
-                sid: str,
-                unique_identifier: str
+        The new expiry is kept in the session cache and written to the
+        database at most once every SESSION_WRITE_INTERVAL seconds.
 
-            Returns:
-                dict
-            """
+        Arguments:
+            sid: str,
+            unique_identifier: str
+
+        Returns:
+            dict
+        """
+        try:
             expires = datetime.now() + timedelta(milliseconds=hour)
 
             data = {
@@ -147,39 +224,83 @@ class Session_Model:
 
             logger.debug("finding session %s for user %s ..." % (sid, unique_identifier))
 
-            result = []
+            session = session_cache.get(sid)
 
-            sessions = (
-                self.Sessions.select()
-                .where(
-                    self.Sessions.sid == sid,
-                    self.Sessions.unique_identifier == unique_identifier
-                ).dicts()
-            )
+            if not session:
+                session = self.__fetch__(sid=sid)
 
-            for session in sessions:
-                result.append(session)
-
-            # check for duplicates
-            if len(result) > 1:
-                logger.error("Multiple sessions %s found" % sid)
-                raise Conflict()
-
-            # check for no user
-            if len(result) < 1:
+            if session["unique_identifier"] != str(unique_identifier):
                 logger.error("No session %s found" % sid)
                 raise Unauthorized()
 
-            logger.debug("updating session %s for user %s ..." % (sid, unique_identifier))
-            upd_session = self.Sessions.update(expires=expires, data=str(data)).where(
-                self.Sessions.sid == sid
-            )
-            upd_session.execute()
+            session["expires"] = expires
+
+            if session["data"] != str(data) or (datetime.now() - session["synced"]).total_seconds() >= write_interval:
+                logger.debug("updating session %s for user %s ..." % (sid, unique_identifier))
+                upd_session = self.Sessions.update(expires=expires, data=str(data)).where(
+                    self.Sessions.sid == sid
+                )
+                upd_session.execute()
+
+                session["data"] = str(data)
+                session["synced"] = datetime.now()
+
+                logger.info("- SUCCESSFULLY UPDATED SESSION %s" % sid)
+            else:
+                logger.debug("- Deferred session %s write" % sid)
 
-            logger.info("- SUCCESSFULLY UPDATED SESSION %s" % sid)
             return {"sid": sid, "uid": unique_identifier, "data": data}
 
         except DatabaseError as err:
             logger.error("FAILED UPDATING SESSION %s CHECK LOGS" % sid)
             raise InternalServerError(err) from None
 
+    def delete(self, sid: str) -> None:
+        """
+        Delete a session from the database and the session cache.
+
+        Arguments:
+            sid: str
+
+        Returns:
+            None
+        """
+        try:
+            logger.debug("deleting session %s ..." % sid)
+
+            session_cache.pop(sid)
+
+            del_session = self.Sessions.delete().where(self.Sessions.sid == sid)
+            del_session.execute()
+
+            logger.info("- SUCCESSFULLY DELETED SESSION %s" % sid)
+
+        except DatabaseError as err:
+            logger.error("FAILED DELETING SESSION %s CHECK LOGS" % sid)
+            raise InternalServerError(err) from None
+
+    def invalidate(self, unique_identifier: str) -> None:
+        """
+        Delete all sessions belonging to a user.
+
+        Arguments:
+            unique_identifier: str
+
+        Returns:
+            None
+        """
+        try:
+            logger.debug("invalidating sessions for user %s ..." % unique_identifier)
+
+            session_cache.pop_where(lambda session: session["unique_identifier"] == str(unique_identifier))
+
+            del_sessions = self.Sessions.delete().where(
+                self.Sessions.unique_identifier == str(unique_identifier)
+            )
+            count = del_sessions.execute()
+
+            logger.info("- SUCCESSFULLY INVALIDATED %d SESSION(S) FOR %s" % (count, unique_identifier))
+
+        except DatabaseError as err:
+            logger.error("FAILED INVALIDATING SESSIONS FOR %s CHECK LOGS" % unique_identifier)
+            raise InternalServerError(err) from None
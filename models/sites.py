@@ -3,6 +3,12 @@ logger = logging.getLogger(__name__)
 
 from Configs import baseConfig
 config = baseConfig()
+api = config["API"]
+
+import time
+import json
+import hashlib
+import threading
 
 from peewee import DatabaseError
 from peewee import IntegrityError
@@ -16,6 +22,183 @@ from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import Conflict
 from werkzeug.exceptions import Unauthorized
 
+class Site_Directory:
+    """
+    In-process copy of every site and region, loaded in one round trip.
+
+    Writes through Site_Model bump the version, which drops the copy in
+    this process. A load that overlaps a write is not kept. Other worker
+    processes reload once their copy is older than the TTL, or at once when
+    asked for a site or region their copy does not have.
+
+    Attributes:
+        ttl: float (seconds)
+
+    Methods:
+        get() -> (dict, dict),
+        site(site_id) -> dict,
+        region(region_id) -> dict,
+        names() -> (dict, dict),
+        etag() -> str,
+        invalidate() -> None,
+        stats() -> dict
+    """
+    def __init__(self, ttl: float) -> None:
+        """
+        Arguments:
+            ttl: float
+        """
+        self.ttl = ttl
+
+        self.__lock = threading.Lock()
+        self.__version = 0
+        self.__loaded = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__invalidations = 0
+
+    def get(self) -> tuple:
+        """
+        Sites and regions keyed by id.
+
+        Returns:
+            (dict, dict)
+        """
+        return self.__load__()[:2]
+
+    def site(self, site_id) -> dict:
+        """
+        A site by id, None when it does not exist.
+
+        Returns:
+            dict
+        """
+        return self.__find__(0, site_id)
+
+    def region(self, region_id) -> dict:
+        """
+        A region by id, None when it does not exist.
+
+        Returns:
+            dict
+        """
+        return self.__find__(1, region_id)
+
+    def names(self) -> tuple:
+        """
+        Site and region names keyed by id. An id missing from the copy is
+        looked up once more after a reload, then raises KeyError.
+
+        Returns:
+            (dict, dict)
+        """
+        sites, regions = self.get()
+
+        return Directory_Names(self.site, sites), Directory_Names(self.region, regions)
+
+    def __find__(self, index: int, key) -> dict:
+        """
+        Look an id up, reloading once on a miss: it may have been created
+        in another worker process since the copy was loaded.
+        """
+        key = directory_id(key)
+        entry = self.get()[index].get(key)
+
+        if entry is None and key is not None:
+            self.invalidate()
+            entry = self.get()[index].get(key)
+
+        return entry
+
+    def etag(self) -> str:
+        """
+        Digest of the directory's contents, the same in every process that
+        holds the same sites and regions.
+
+        Returns:
+            str
+        """
+        return self.__load__()[2]
+
+    def __load__(self) -> tuple:
+        """
+        Sites, regions and their digest, reloaded when stale.
+        """
+        with self.__lock:
+            if self.__loaded and time.monotonic() - self.__loaded[0] < self.ttl:
+                self.__hits += 1
+                return self.__loaded[1:]
+
+            self.__misses += 1
+            version = self.__version
+
+        logger.debug("loading site directory ...")
+
+        regions = {region["id"]: region for region in Regions.select().order_by(Regions.id).dicts()}
+        sites = {site["id"]: site for site in Sites.select().order_by(Sites.id).dicts()}
+
+        contents = json.dumps([list(sites.values()), list(regions.values())], default=str, sort_keys=True)
+        digest = hashlib.sha256(contents.encode("utf-8")).hexdigest()[:32]
+
+        with self.__lock:
+            if version == self.__version:
+                self.__loaded = (time.monotonic(), sites, regions, digest)
+
+        return sites, regions, digest
+
+    def invalidate(self) -> None:
+        """
+        Drop the copy after a site or region changes.
+        """
+        with self.__lock:
+            self.__version += 1
+            self.__loaded = None
+            self.__invalidations += 1
+
+    def stats(self) -> dict:
+        """
+        Directory usage counters.
+
+        Returns:
+            dict
+        """
+        with self.__lock:
+            return {
+                "version": self.__version,
+                "sites": len(self.__loaded[1]) if self.__loaded else 0,
+                "regions": len(self.__loaded[2]) if self.__loaded else 0,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "invalidations": self.__invalidations
+            }
+
+class Directory_Names(dict):
+    """
+    Names by id, falling back to a directory lookup for missing ids.
+    """
+    def __init__(self, find, entries: dict) -> None:
+        super().__init__((key, entry["name"]) for key, entry in entries.items())
+
+        self.__find = find
+
+    def __missing__(self, key) -> str:
+        entry = self.__find(key)
+
+        if entry is None:
+            raise KeyError(key)
+
+        self[key] = entry["name"]
+
+        return entry["name"]
+
+directory = Site_Directory(ttl=api.getint("SITE_CACHE_TTL", fallback=60))
+
+def directory_id(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
 class Site_Model:
     """
     """
@@ -44,6 +227,7 @@ class Site_Model:
                 logger.debug("creating region '%s' ..." % name)
 
                 region = self.Regions.create(name=name, region_code=region_code)
+                directory.invalidate()
 
                 logger.info("- Region '%s' successfully created" % name)
                 return str(region)
@@ -75,6 +259,7 @@ class Site_Model:
             )
 
             region.execute()
+            directory.invalidate()
 
             return region_id
         
@@ -94,31 +279,16 @@ class Site_Model:
         """
         try:
             logger.debug("finding region %s ..." % region_id)
-            
-            result = []
-            
-            regions = (
-                self.Regions.select()
-                .where(self.Regions.id == region_id)
-                .dicts()
-            )
 
-            for region in regions.iterator():
-                result.append(region)
-
-            # check for duplicates
-            if len(result) > 1:
-                logger.error("Multiple regions %s found" % region_id)
-                raise Conflict()
+            region = directory.region(region_id)
 
-            # check for no user
-            if len(result) < 1:
+            if not region:
                 logger.error("No region found")
                 raise Unauthorized()
 
             logger.info("- Region %s found" % region_id)
 
-            return result[0]
+            return dict(region)
 
         except DatabaseError as err:
             logger.error("failed to find region %s check logs" % region_id)
@@ -137,14 +307,8 @@ class Site_Model:
         try:
             logger.debug("fetching all region records ...")
 
-            result = []
-            
-            regions = (
-                self.Regions.select()
-                .dicts()
-            )
-            for region in regions.iterator():
-                result.append(region)
+            _, regions = directory.get()
+            result = [dict(region) for region in regions.values()]
 
             logger.info("- Successfully fetched all regions")
             
@@ -173,6 +337,7 @@ class Site_Model:
                 logger.debug("creating site '%s' ..." % name)
 
                 site = self.Sites.create(name=name, region_id=region_id, site_code=site_code)
+                directory.invalidate()
 
                 logger.info("- Site '%s' successfully created" % name)
 
@@ -226,6 +391,7 @@ class Site_Model:
             )
 
             site.execute()
+            directory.invalidate()
 
             return site_id
 
@@ -245,31 +411,16 @@ class Site_Model:
         """
         try:
             logger.debug("finding site %s ..." % site_id)
-            
-            result = []
-
-            sites = (
-                self.Sites.select()
-                .where(self.Sites.id == site_id)
-                .dicts()
-            )
 
-            for site in sites.iterator():
-                result.append(site)
+            site = directory.site(site_id)
 
-            # check for duplicates
-            if len(result) > 1:
-                logger.error("Multiple sites %s found" % site_id)
-                raise Conflict()
-
-            # check for no user
-            if len(result) < 1:
+            if not site:
                 logger.error("No site found")
                 raise Unauthorized()
 
             logger.info("- Site %s found" % site_id)
 
-            return result[0]
+            return dict(site)
 
         except DatabaseError as err:
             logger.error("failed to find site %s check logs" % site_id)
@@ -288,15 +439,8 @@ class Site_Model:
         try:
             logger.debug("fetching all site records ...")
 
-            result = []
-            
-            sites = (
-                self.Sites.select().where(self.Sites.region_id == region_id)
-                .dicts()
-            )
-
-            for site in sites.iterator():
-                result.append(site)
+            sites, _ = directory.get()
+            result = [dict(site) for site in sites.values() if site["region_id"] == directory_id(region_id)]
 
             logger.info("- Successfully fetched all sites")
 
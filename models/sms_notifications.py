@@ -1,20 +1,26 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
-
 from security.data import Data
 
 # configurations
 from Configs import baseConfig
 config = baseConfig()
 smswithoutborders = config["SMSWITHOUTBORDERS"]
+workers = smswithoutborders.getint("WORKERS", fallback=2)
+
+from concurrent.futures import ThreadPoolExecutor
 
 from schemas.records.records import Records
 from schemas.records.lab import Labs
 
+from models.sms_outbox import SMS_Outbox_Model
+
 from werkzeug.exceptions import InternalServerError
 
+# composes notifications after the response, the outbox sends them
+executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sms-compose")
+
 class SMS_Model:
     """
     """
@@ -33,6 +39,30 @@ class SMS_Model:
         self.Labs = Labs
         self.Data = Data
 
+    def background(self, task, **kwargs) -> None:
+        """
+        Run task, which composes and queues messages, in a background
+        thread so the lookups it makes stay off the response path.
+
+        Arguments:
+            task: callable,
+            kwargs: task's arguments
+        """
+        executor.submit(self.__background__, task, kwargs)
+
+    def __background__(self, task, kwargs: dict) -> None:
+        try:
+            task(**kwargs)
+
+        except Exception as error:
+            logger.exception(error)
+
+        finally:
+            database = self.Records._meta.database
+
+            if not database.is_closed():
+                database.close()
+
     def send_lab(self, record_id: int, lab_id: int, contacts: list) -> None:
         """
         """
@@ -363,48 +393,11 @@ class SMS_Model:
 
     def __send_sms_message__(self, text: str, contacts: list) -> None:
         """
+        Queue a message for every contact in the SMS outbox.
         """
-        sms_url = f"{self.openapi_url}/v1/sms"
-        operator_url = f"{self.openapi_url}/v1/sms/operators"
-        auth_id = self.auth_id
-
-        payload = []
-
-        for contact in contacts:
-            payload.append({
-                "operator_name":"",
-                "text":text.strip()[:149],
-                "number":contact
-            })
-
         try:
-            operator_res = requests.post(url=operator_url, json=payload)
-
-            if operator_res.status_code == 200:
-                logger.info("- Successfully fetched operator names.")
-
-                operator_data = operator_res.json()
-
-                sms_data = {
-                    "auth_id":auth_id,
-                    "data": operator_data,
-                    "callback_url": ""
-                    }
-                
-                sms_res = requests.post(url=sms_url, json=sms_data)
-
-                if sms_res.status_code == 200:
-                    logger.info("- Successfully sent.")
-                    return None
-                else:
-                    logger.error("- Cannot send SMS")
-                    raise InternalServerError(sms_res.text)    
-
-            else:
-                logger.error("- Cannot get operator_name")
-                raise InternalServerError(operator_res.text)
+            Outbox = SMS_Outbox_Model()
+            Outbox.enqueue(text=text, contacts=contacts)
 
         except Exception as error:
             raise InternalServerError(error)
-
-
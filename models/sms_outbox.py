@@ -0,0 +1,397 @@
+import logging
+logger = logging.getLogger(__name__)
+
+# configurations
+from Configs import baseConfig
+config = baseConfig()
+smswithoutborders = config["SMSWITHOUTBORDERS"]
+workers = smswithoutborders.getint("WORKERS", fallback=2)
+batch_size = smswithoutborders.getint("BATCH_SIZE", fallback=50)
+max_attempts = smswithoutborders.getint("MAX_ATTEMPTS", fallback=6)
+retry_delay = smswithoutborders.getint("RETRY_DELAY", fallback=30)
+poll_interval = smswithoutborders.getint("POLL_INTERVAL", fallback=10)
+request_timeout = smswithoutborders.getint("TIMEOUT", fallback=30)
+operator_ttl = smswithoutborders.getint("OPERATOR_CACHE_TTL", fallback=2592000)
+salt = config["API"]["SALT"]
+
+import hmac
+import uuid
+import hashlib
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from peewee import DatabaseError
+
+from security.data import Data
+
+from schemas.records.sms_outbox import Sms_outbox
+from schemas.records.sms_operators import Sms_operators
+
+from models.cache import TTL_Cache
+
+from datetime import datetime
+from datetime import timedelta
+
+from werkzeug.exceptions import InternalServerError
+
+# a worker that stops answering leaves its claimed messages in "sending"
+claim_timeout = request_timeout * 4
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+
+operator_key = hmac.new(salt.encode("utf-8"), b"sms operators", hashlib.sha256).digest()
+
+# in front of the Sms_operators table, which outlives restarts
+operator_cache = TTL_Cache(
+    maxsize=smswithoutborders.getint("OPERATOR_CACHE_SIZE", fallback=10000),
+    ttl=min(operator_ttl, 3600)
+)
+
+operator_counters = {"hits": 0, "misses": 0, "lookups": 0}
+operator_lock = threading.Lock()
+
+wakeup = threading.Event()
+threads = []
+threads_lock = threading.Lock()
+
+def operator_stats() -> dict:
+    """
+    Operator cache counters for this process.
+
+    Returns:
+        dict
+    """
+    with operator_lock:
+        result = dict(operator_counters)
+
+    total = result["hits"] + result["misses"]
+    result["hit_rate"] = result["hits"] / total if total else None
+    result["memory"] = operator_cache.stats()
+
+    return result
+
+class SMS_Outbox_Model:
+    """
+    Durable outbound SMS queue.
+
+    Messages are stored in the records database before anything is sent,
+    so a restart resumes them. A fixed number of worker threads per
+    process claim due messages in batches and send each batch with one
+    operator lookup and one send request over a pooled HTTP session.
+    Failed batches are retried with exponential backoff. Operators of
+    numbers seen within OPERATOR_CACHE_TTL are not looked up again.
+
+    Methods:
+        enqueue(text: str, contacts: list) -> int,
+        start() -> None,
+        dispatch() -> int
+    """
+    def __init__(self) -> None:
+        if not smswithoutborders["OPENAPI_URL"]:
+            raise ValueError("Set OPENAPI_URL in configs file")
+        elif not smswithoutborders["AUTH_ID"]:
+            raise ValueError("Set AUTH_ID in configs file")
+
+        self.openapi_url = smswithoutborders["OPENAPI_URL"]
+        self.auth_id = smswithoutborders["AUTH_ID"]
+        self.Sms_outbox = Sms_outbox
+        self.Sms_operators = Sms_operators
+        self.Data = Data
+
+    def enqueue(self, text: str, contacts: list) -> int:
+        """
+        Store a message for each contact and wake a worker.
+
+        Arguments:
+            text: str,
+            contacts: list
+
+        Returns:
+            int
+        """
+        try:
+            rows = []
+
+            for contact in contacts:
+                data = self.Data()
+
+                rows.append({
+                    "number": data.encrypt(contact)["e_data"],
+                    "text": data.encrypt(text.strip()[:149])["e_data"],
+                    "iv": data.iv
+                })
+
+            if rows:
+                self.Sms_outbox.insert_many(rows).execute()
+
+            logger.info("- Queued %d SMS message(s)" % len(rows))
+
+            self.start()
+            wakeup.set()
+
+            return len(rows)
+
+        except DatabaseError as err:
+            logger.error("queueing SMS messages failed check logs")
+            raise InternalServerError(err)
+
+    def start(self) -> None:
+        """
+        Start this process's workers if they are not running.
+        """
+        with threads_lock:
+            if threads:
+                return
+
+            for index in range(workers):
+                thread = threading.Thread(target=self.__work__, name="sms-%d" % index, daemon=True)
+                thread.start()
+                threads.append(thread)
+
+            logger.info("- Started %d SMS worker(s)" % workers)
+
+    def dispatch(self) -> int:
+        """
+        Claim and send one batch of due messages.
+
+        Returns:
+            int (messages claimed)
+        """
+        claimed = self.__claim__()
+
+        if not claimed:
+            return 0
+
+        messages = self.__decrypt__(messages=claimed)
+        ids = [message["id"] for message in messages]
+
+        if not messages:
+            return len(claimed)
+
+        try:
+            operators = self.__operators__(numbers=[message["number"] for message in messages])
+
+            # a number the operator lookup did not answer for goes without one
+            sms_data = {
+                "auth_id": self.auth_id,
+                "data": [{"operator_name": operators.get(message["number"], ""), "text": message["text"], "number": message["number"]} for message in messages],
+                "callback_url": ""
+            }
+
+            sms_res = session.post(url=f"{self.openapi_url}/v1/sms", json=sms_data, timeout=request_timeout)
+
+            if sms_res.status_code != 200:
+                raise InternalServerError("cannot send SMS: %s" % sms_res.text)
+
+        except Exception as error:
+            logger.error("- Sending %d SMS message(s) failed: %s" % (len(ids), error))
+            self.__retry__(messages=messages, error=str(error))
+
+        else:
+            self.Sms_outbox.update(
+                status="sent",
+                claim=None,
+                error=None,
+                updatedAt=datetime.now()
+            ).where(self.Sms_outbox.id.in_(ids)).execute()
+
+            logger.info("- Sent %d SMS message(s)" % len(ids))
+
+        return len(claimed)
+
+    def __operators__(self, numbers: list) -> dict:
+        """
+        Map numbers to their operator names, asking the SMS API only about
+        numbers not seen within the TTL. Numbers the API does not answer for
+        are left out.
+        """
+        keys = {number: hmac.new(operator_key, number.encode("utf-8"), hashlib.sha256).hexdigest() for number in set(numbers)}
+        result = {}
+
+        for number, key in keys.items():
+            operator_name = operator_cache.get(key)
+
+            if operator_name is not None:
+                result[number] = operator_name
+
+        missing = [key for number, key in keys.items() if not number in result]
+
+        if missing:
+            stored = (
+                self.Sms_operators.select()
+                .where(
+                    self.Sms_operators.number.in_(missing),
+                    self.Sms_operators.updatedAt > datetime.now() - timedelta(seconds=operator_ttl)
+                )
+                .dicts()
+            )
+
+            found = {row["number"]: row["operator_name"] for row in stored}
+
+            for number, key in keys.items():
+                if key in found:
+                    result[number] = found[key]
+                    operator_cache.set(key, found[key])
+
+        unknown = [number for number in keys if not number in result]
+
+        with operator_lock:
+            operator_counters["hits"] += len(keys) - len(unknown)
+            operator_counters["misses"] += len(unknown)
+
+        if not unknown:
+            return result
+
+        payload = [{"operator_name": "", "text": "", "number": number} for number in unknown]
+
+        operator_res = session.post(url=f"{self.openapi_url}/v1/sms/operators", json=payload, timeout=request_timeout)
+
+        with operator_lock:
+            operator_counters["lookups"] += 1
+
+        if operator_res.status_code != 200:
+            raise InternalServerError("cannot get operator_name: %s" % operator_res.text)
+
+        now = datetime.now()
+        rows = []
+
+        # answers come in request order, the API may reformat the numbers
+        for number, entry in zip(unknown, operator_res.json()):
+            operator_name = entry.get("operator_name") if isinstance(entry, dict) else None
+
+            if not operator_name:
+                continue
+
+            result[number] = operator_name
+
+            operator_cache.set(keys[number], operator_name)
+            rows.append({"number": keys[number], "operator_name": operator_name, "updatedAt": now})
+
+        if rows:
+            self.Sms_operators.insert_many(rows).on_conflict_replace().execute()
+
+        logger.info("- Looked up operators of %d number(s)" % len(unknown))
+
+        return result
+
+    def __claim__(self) -> list:
+        """
+        Move a batch of due messages to "sending" under a claim only this
+        worker holds, and return them still encrypted.
+        """
+        now = datetime.now()
+        claim = uuid.uuid4().hex
+
+        self.Sms_outbox.update(status="pending", claim=None).where(
+            self.Sms_outbox.status == "sending",
+            self.Sms_outbox.updatedAt < now - timedelta(seconds=claim_timeout)
+        ).execute()
+
+        due = [
+            message["id"] for message in
+            self.Sms_outbox.select(self.Sms_outbox.id)
+            .where(self.Sms_outbox.status == "pending", self.Sms_outbox.next_attempt <= now)
+            .order_by(self.Sms_outbox.id)
+            .limit(batch_size)
+            .dicts()
+        ]
+
+        if not due:
+            return []
+
+        # another worker may win some of these rows, only ours come back
+        self.Sms_outbox.update(status="sending", claim=claim, updatedAt=now).where(
+            self.Sms_outbox.id.in_(due),
+            self.Sms_outbox.status == "pending"
+        ).execute()
+
+        messages = list(
+            self.Sms_outbox.select(
+                self.Sms_outbox.id,
+                self.Sms_outbox.number,
+                self.Sms_outbox.text,
+                self.Sms_outbox.iv,
+                self.Sms_outbox.attempts
+            )
+            .where(self.Sms_outbox.claim == claim)
+            .dicts()
+        )
+
+        return messages
+
+    def __decrypt__(self, messages: list) -> list:
+        """
+        Decrypt claimed messages. One that cannot be decrypted never will
+        be, so it fails on its own and the rest of the batch is sent.
+        """
+        data = self.Data()
+
+        try:
+            return data.decrypt_rows(rows=messages, fields=["number", "text"])
+
+        except Exception:
+            result = []
+
+            for message in messages:
+                try:
+                    result += data.decrypt_rows(rows=[message], fields=["number", "text"])
+
+                except Exception as error:
+                    logger.error("- Decrypting SMS message %d failed: %s" % (message["id"], error))
+                    self.__retry__(messages=[message], error="cannot decrypt", give_up=True)
+
+            return result
+
+    def __retry__(self, messages: list, error: str, give_up: bool = False) -> None:
+        """
+        Put failed messages back with a backoff, or give up on them.
+        """
+        now = datetime.now()
+
+        for message in messages:
+            attempts = message["attempts"] + 1
+
+            if give_up or attempts >= max_attempts:
+                logger.error("SMS message %d failed after %d attempts" % (message["id"], attempts))
+
+                fields = {"status": "failed"}
+            else:
+                fields = {
+                    "status": "pending",
+                    "next_attempt": now + timedelta(seconds=retry_delay * 2 ** (attempts - 1))
+                }
+
+            self.Sms_outbox.update(
+                attempts=attempts,
+                claim=None,
+                error=error[:1000],
+                updatedAt=now,
+                **fields
+            ).where(self.Sms_outbox.id == message["id"]).execute()
+
+    def __work__(self) -> None:
+        """
+        Worker loop.
+        """
+        database = self.Sms_outbox._meta.database
+
+        while True:
+            try:
+                claimed = self.dispatch()
+
+            except Exception as error:
+                logger.exception(error)
+                claimed = 0
+
+            finally:
+                if not database.is_closed():
+                    database.close()
+
+            # a full batch means more may be due right away
+            if claimed < batch_size:
+                wakeup.wait(timeout=poll_interval)
+                wakeup.clear()
@@ -10,6 +10,9 @@ from schemas.users.users import Users
 from schemas.users.users_sites import Users_sites
 
 from models.sites import Site_Model
+from models.sites import directory
+from models.sessions import Session_Model
+from models.contacts import invalidate_roster
 
 from datetime import datetime
 
@@ -28,6 +31,7 @@ class User_Model:
         self.Users_sites = Users_sites
         self.Data = Data
         self.Sites = Site_Model
+        self.Sessions = Session_Model
 
     def create(self, email: str, password: str, phone_number: str, name: str, occupation: str, site_id: int, sms_notifications_type: str) -> str:
         """
@@ -120,6 +124,87 @@ class User_Model:
             logger.error("verifying user %s failed check logs" % email)
             raise InternalServerError(err)
 
+    def __users__(self, users, no_sites: bool = False) -> list:
+        """
+        Shape user rows for responses.
+
+        Names, phone numbers and occupations are decrypted in one batch.
+        Site links of every user come from one query and are resolved
+        against the site directory.
+
+        Arguments:
+            users: peewee.ModelSelect (dicts),
+            no_sites: bool
+
+        Returns:
+            list
+        """
+        data = self.Data()
+        users = data.decrypt_rows(rows=list(users), fields=["name", "phone_number", "occupation"])
+
+        users_sites = {}
+
+        if not no_sites and users:
+            logger.debug("Fetching all sites for %d user(s) ..." % len(users))
+
+            links = (
+                self.Users_sites.select(self.Users_sites.user_id, self.Users_sites.site_id)
+                .where(self.Users_sites.user_id.in_([user["id"] for user in users]))
+                .order_by(self.Users_sites.id)
+                .dicts()
+            )
+
+            for link in links.iterator():
+                site = directory.site(link["site_id"])
+
+                if not site:
+                    logger.error("No site found")
+                    raise Unauthorized()
+
+                region = directory.region(site["region_id"])
+
+                if not region:
+                    logger.error("No region found")
+                    raise Unauthorized()
+
+                users_sites.setdefault(link["user_id"], []).append({
+                    "id": site["id"],
+                    "name": site["name"],
+                    "site_code": site["site_code"],
+                    "region": {
+                        "id": region["id"],
+                        "name": region["name"]
+                    }
+                })
+
+        result = []
+
+        for user in users:
+            user_dict = {
+                "id": user["id"],
+                "email": user["email"],
+                "name": user["name"],
+                "phone_number": user["phone_number"],
+                "occupation": user["occupation"],
+                "account_status": user["account_status"],
+                "account_type": user["account_type"],
+                "account_request_date": user["account_request_date"],
+                "account_approved_date": user["account_approved_date"],
+                "permitted_export_types": user["permitted_export_types"],
+                "permitted_export_range": user["permitted_export_range"],
+                "permitted_decrypted_data": user["permitted_decrypted_data"],
+                "permitted_approve_accounts": user["permitted_approve_accounts"],
+                "sms_notifications": user["sms_notifications"],
+                "sms_notifications_type": user["sms_notifications_type"]
+            }
+
+            if not no_sites:
+                user_dict["users_sites"] = users_sites.get(user["id"], [])
+
+            result.append(user_dict)
+
+        return result
+
     def fetch_user(self, user_id: int = None, account_status: str = None, no_sites: bool = False, email: str = None) -> dict:
         """
         Find a single user.
@@ -134,10 +219,6 @@ class User_Model:
         """
         try:
             logger.debug("finding user %s ..." % user_id)
-            
-            result = []
-            
-            data = self.Data()
 
             if email:
                 if not account_status:
@@ -166,71 +247,7 @@ class User_Model:
                         .dicts()
                     )
 
-            for user in users:
-                iv = user["iv"]
-
-                if no_sites:
-                    result.append({
-                        "id": user["id"],
-                        "email": user["email"],
-                        "name": data.decrypt(user["name"], iv),
-                        "phone_number": data.decrypt(user["phone_number"], iv),
-                        "occupation": data.decrypt(user["occupation"], iv),
-                        "account_status": user["account_status"],
-                        "account_type": user["account_type"],
-                        "account_request_date": user["account_request_date"],
-                        "account_approved_date": user["account_approved_date"],
-                        "permitted_export_types": user["permitted_export_types"],
-                        "permitted_export_range": user["permitted_export_range"],
-                        "permitted_decrypted_data": user["permitted_decrypted_data"],
-                        "permitted_approve_accounts": user["permitted_approve_accounts"],
-                        "sms_notifications": user["sms_notifications"],
-                        "sms_notifications_type": user["sms_notifications_type"]
-                    })
-                else:
-                    logger.debug("Fetching all sites for user '%s' ..." % user["id"])
-
-                    site_arr = []
-
-                    user_sites = self.Users_sites.select(
-                        self.Users_sites.site_id
-                        ).where(
-                            self.Users_sites.user_id == user["id"]
-                            ).dicts()
-                    
-                    Sites = self.Sites()
-
-                    for user_site in user_sites.iterator():
-                        site = Sites.fetch_site(site_id=user_site["site_id"])
-                        region = Sites.fetch_region(region_id=site["region_id"])
-                        site_arr.append({
-                            "id": site["id"],
-                            "name": site["name"],
-                            "site_code": site["site_code"],
-                            "region": {
-                                "id": region["id"],
-                                "name": region["name"]
-                            }
-                        })
-
-                    result.append({
-                        "id": user["id"],
-                        "email": user["email"],
-                        "name": data.decrypt(user["name"], iv),
-                        "phone_number": data.decrypt(user["phone_number"], iv),
-                        "occupation": data.decrypt(user["occupation"], iv),
-                        "account_status": user["account_status"],
-                        "account_type": user["account_type"],
-                        "account_request_date": user["account_request_date"],
-                        "account_approved_date": user["account_approved_date"],
-                        "permitted_export_types": user["permitted_export_types"],
-                        "permitted_export_range": user["permitted_export_range"],
-                        "permitted_decrypted_data": user["permitted_decrypted_data"],
-                        "permitted_approve_accounts": user["permitted_approve_accounts"],
-                        "sms_notifications": user["sms_notifications"],
-                        "sms_notifications_type": user["sms_notifications_type"],
-                        "users_sites": site_arr
-                    })
+            result = self.__users__(users=users, no_sites=no_sites)
 
             # check for duplicates
             if len(result) > 1:
@@ -263,11 +280,7 @@ class User_Model:
         """
         try:
             logger.debug("fetching all user records ...")
-            
-            result = []
 
-            data = self.Data()
-            
             if account_status:
                 if not account_status in ["pending"]:
                     logger.error("invalid account_status '%s'" % account_status)
@@ -279,74 +292,9 @@ class User_Model:
             else:
                 users = self.Users.select().dicts()
 
-            for user in users.iterator():
-                iv = user["iv"]
-
-                if no_sites:
-                    result.append({
-                        "id": user["id"],
-                        "email": user["email"],
-                        "name": data.decrypt(user["name"], iv),
-                        "phone_number": data.decrypt(user["phone_number"], iv),
-                        "occupation": data.decrypt(user["occupation"], iv),
-                        "account_status": user["account_status"],
-                        "account_type": user["account_type"],
-                        "account_request_date": user["account_request_date"],
-                        "account_approved_date": user["account_approved_date"],
-                        "permitted_export_types": user["permitted_export_types"],
-                        "permitted_export_range": user["permitted_export_range"],
-                        "permitted_decrypted_data": user["permitted_decrypted_data"],
-                        "permitted_approve_accounts": user["permitted_approve_accounts"],
-                        "sms_notifications": user["sms_notifications"],
-                        "sms_notifications_type": user["sms_notifications_type"]
-                    })
-                else:
-                    logger.debug("Fetching all sites for user '%s' ..." % user["id"])
-                    
-                    site_arr = []
-
-                    user_sites = self.Users_sites.select(
-                        self.Users_sites.site_id
-                        ).where(
-                            self.Users_sites.user_id == user["id"]
-                            ).dicts()
-
-                    Sites = self.Sites()
-
-                    # populate user_sites from Users_sites table
-                    for user_site in user_sites.iterator():
-                        site = Sites.fetch_site(site_id=user_site["site_id"])
-                        region = Sites.fetch_region(region_id=site["region_id"])
-                        site_arr.append({
-                            "id": site["id"],
-                            "name": site["name"],
-                            "site_code": site["site_code"],
-                            "region": {
-                                "id": region["id"],
-                                "name": region["name"]
-                            }
-                        })
-
-                    result.append({
-                        "id": user["id"],
-                        "email": user["email"],
-                        "name": data.decrypt(user["name"], iv),
-                        "phone_number": data.decrypt(user["phone_number"], iv),
-                        "occupation": data.decrypt(user["occupation"], iv),
-                        "account_status": user["account_status"],
-                        "account_type": user["account_type"],
-                        "account_request_date": user["account_request_date"],
-                        "account_approved_date": user["account_approved_date"],
-                        "permitted_export_types": user["permitted_export_types"],
-                        "permitted_export_range": user["permitted_export_range"],
-                        "permitted_decrypted_data": user["permitted_decrypted_data"],
-                        "permitted_approve_accounts": user["permitted_approve_accounts"],
-                        "sms_notifications": user["sms_notifications"],
-                        "sms_notifications_type": user["sms_notifications_type"],
-                        "users_sites": site_arr
-                    })
-
-                logger.info("- Successfully fetched all users")
+            result = self.__users__(users=users, no_sites=no_sites)
+
+            logger.info("- Successfully fetched all users")
 
             return result
 
@@ -381,6 +329,11 @@ class User_Model:
 
             user.execute()
 
+            invalidate_roster()
+
+            if account_status == "suspended":
+                self.Sessions().invalidate(unique_identifier=id)
+
             logger.info("- Successfully updated user %s" % id)
             return id
 
@@ -418,6 +371,11 @@ class User_Model:
             
             upd_account_status.execute()
 
+            invalidate_roster()
+
+            if account_status == "suspended":
+                self.Sessions().invalidate(unique_identifier=user_id)
+
             logger.info("- Successfully updated_account_status for user %s" % user_id)
             return True
         except DatabaseError as err:
@@ -477,6 +435,8 @@ class User_Model:
                 except IntegrityError as error:
                     logger.error(error)
 
+            invalidate_roster()
+
         except DatabaseError as err:
             logger.error("creating users_sites failed check logs")
             raise InternalServerError(err)
@@ -501,6 +461,8 @@ class User_Model:
                     user_site.delete_instance()
                     logger.info("- Sucessfully removed site_id=%s from user_id=%s" % (site_id, user_id))
 
+            invalidate_roster()
+
         except DatabaseError as err:
             logger.error("removing users_sites failed check logs")
             raise InternalServerError(err)
@@ -536,6 +498,8 @@ class User_Model:
 
             user.execute()
 
+            invalidate_roster()
+
             logger.info("- Successfully updated user %s" % id)
             return id
 
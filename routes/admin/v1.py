@@ -7,25 +7,42 @@ config = baseConfig()
 api = config["API"]
 cookie_name = "%s_%s" % (api['COOKIE_NAME'], "Admin")
 
+import os
 import json
 
 from flask import Blueprint
 from flask import Response
 from flask import request
+from flask import current_app
+from flask import g
 from flask import jsonify
 
 v1 = Blueprint("admin_v1", __name__)
 
 from security.cookie import Cookie
+from security.auth import public
+from security.auth import requires_auth
+from security.auth import authenticate
+from security.auth import refresh_session
+from security.auth import end_session
+from security.auth import current_user
+from security.auth import check_permission
 from datetime import timedelta
 
+from controllers.responses import json_response
+
 from schemas.users.baseModel import users_db
 from schemas.sites.baseModel import sites_db
 from schemas.records.baseModel import records_db
 
 from models.users import User_Model
 from models.sites import Site_Model
+from models.sites import directory
+from models.contacts import roster
 from models.sessions import Session_Model
+from models.sessions import session_cache
+from models.sms_outbox import operator_stats
+from models.exports import cache_stats
 
 from werkzeug.exceptions import BadRequest
 from werkzeug.exceptions import InternalServerError
@@ -33,13 +50,47 @@ from werkzeug.exceptions import Unauthorized
 from werkzeug.exceptions import Conflict
 from werkzeug.exceptions import Forbidden
 
+@v1.before_request
+def before_request():
+    if not requires_auth(current_app.view_functions):
+        return None
+
+    try:
+        authenticate(cookie_name=cookie_name)
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
 @v1.after_request
 def after_request(response):
-    users_db.close()
-    sites_db.close()
-    records_db.close()
+    try:
+        response = refresh_session(response=response)
+
+    except Unauthorized as err:
+        response = Response(str(err), status=401)
+
+    except Exception as err:
+        logger.exception(err)
+        response = Response("internal server error", status=500)
+
+    for db in (users_db, sites_db, records_db):
+        if not db.is_closed():
+            db.close()
+
     return response
 
+@public
 @v1.route("/login", methods=["POST"])
 def login() -> dict:
     """
@@ -132,51 +183,16 @@ def getAllUsers() -> list:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
         User = User_Model()
 
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
     
         account_status = request.args.get("account_status")
 
         users_list = User.fetch_users(account_status=account_status)
 
-        res = jsonify(users_list)
-
-        session = Session.update(sid=sid, unique_identifier=user_id)
+        res = json_response(users_list)
 
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -204,30 +220,11 @@ def updateProfile() -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+        user_id = g.user_id
 
         User = User_Model()
 
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         if request.method == "PUT":
             if not "phone_number" in request.json or not request.json["phone_number"]:
@@ -280,20 +277,6 @@ def updateProfile() -> None:
        
         res = Response()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -336,27 +319,6 @@ def updateUser(user_id: int) -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-        
-        Session = Session_Model()
-
-        admin_user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-
         User = User_Model()
 
         # Fetch account
@@ -367,7 +329,7 @@ def updateUser(user_id: int) -> None:
            
         # update account
         elif request.method == "PUT":
-            account_type = User.check_permission(user_id=admin_user_id, scope=["admin", "super_admin"])
+            account_type = check_permission(scope=["admin", "super_admin"])
             
             user = User.fetch_user(user_id=user_id, no_sites=True)
 
@@ -398,7 +360,7 @@ def updateUser(user_id: int) -> None:
                 logger.error("no account_status")
                 raise BadRequest()
 
-            User.check_permission(user_id=admin_user_id, scope=["admin", "super_admin"], permitted_approve_accounts=True)
+            check_permission(scope=["admin", "super_admin"], permitted_approve_accounts=True)
 
             account_status = request.json["account_status"]
 
@@ -406,20 +368,6 @@ def updateUser(user_id: int) -> None:
 
             res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=admin_user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -462,33 +410,13 @@ def addUserSites(user_id: int) -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-        elif not isinstance(request.json, list):
+        if not isinstance(request.json, list):
             logger.error("no request body must be an array")
             raise BadRequest()
-    
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        admin_user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
         User = User_Model()
 
-        User.check_permission(user_id=admin_user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         user_sites = request.json
 
@@ -499,20 +427,6 @@ def addUserSites(user_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=admin_user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -550,36 +464,14 @@ def createRegion() -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-        elif not "name" in request.json or not request.json["name"]:
+        if not "name" in request.json or not request.json["name"]:
             logger.error("no name")
             raise BadRequest()
         elif not "region_code" in request.json or not request.json["region_code"]:
             logger.error("no region_code")
             raise BadRequest()
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
-        User = User_Model()
-
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         name = request.json["name"]
         region_code = request.json["region_code"]
@@ -590,20 +482,6 @@ def createRegion() -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -643,33 +521,11 @@ def updateRegion(region_id) -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-        elif not "name" in request.json or not request.json["name"]:
+        if not "name" in request.json or not request.json["name"]:
             logger.error("no name")
             raise BadRequest()
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
-        User = User_Model()
-
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         name = request.json["name"]
         region_code = request.json["region_code"]
@@ -680,20 +536,6 @@ def updateRegion(region_id) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -734,37 +576,14 @@ def createSite(region_id: int) -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-        elif not "name" in request.json or not request.json["name"]:
+        if not "name" in request.json or not request.json["name"]:
             logger.error("no name")
             raise BadRequest()
         elif not "site_code" in request.json or not request.json["site_code"]:
             logger.error("no site_code")
             raise BadRequest()
 
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
-        User = User_Model()
-
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         name = request.json["name"]
         site_code = request.json["site_code"]
@@ -775,20 +594,6 @@ def createSite(region_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -829,37 +634,14 @@ def updateSite(site_id: int) -> None:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-        elif not "name" in request.json or not request.json["name"]:
+        if not "name" in request.json or not request.json["name"]:
             logger.error("no name")
             raise BadRequest()
         elif not "site_code" in request.json or not request.json["site_code"]:
             logger.error("no site_code")
             raise BadRequest()
 
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-        
-        User = User_Model()
-
-        User.check_permission(user_id=user_id, scope=["admin", "super_admin"])
+        check_permission(scope=["admin", "super_admin"])
 
         name = request.json["name"]
         site_code = request.json["site_code"]
@@ -870,20 +652,6 @@ def updateSite(site_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -906,51 +674,66 @@ def updateSite(site_id: int) -> None:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/profile", methods=["GET"])
-def findAUser() -> dict:
+@v1.route("/metrics", methods=["GET"])
+def getMetrics() -> dict:
     """
+    Fetch this worker process's connection pool and cache counters.
+
+    Body:
+       None
+
+    Response:
+        200: dict
+        401: str
+        403: str
+        500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
+        check_permission(scope=["super_admin"])
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
+        pools = {}
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
+        for db in (users_db, sites_db, records_db):
+            if hasattr(db, "stats"):
+                pools[db.database] = db.stats()
 
-        Session = Session_Model()
+        res = jsonify({
+            "pid": os.getpid(),
+            "pools": pools,
+            "session_cache": session_cache.stats(),
+            "site_directory": directory.stats(),
+            "contact_roster": roster.stats(),
+            "sms_operators": operator_stats(),
+            "export_cache": cache_stats()
+        })
 
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+        return res, 200
 
-        User = User_Model()
+    except BadRequest as err:
+        return str(err), 400
 
-        user = User.fetch_user(user_id=user_id, account_status="approved")
-       
-        res = jsonify(user)
+    except Unauthorized as err:
+        return str(err), 401
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
+    except Forbidden as err:
+        return str(err), 403
 
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/profile", methods=["GET"])
+def findAUser() -> dict:
+    """
+    """
+    try:
+        user = current_user()
+       
+        res = jsonify(user)
 
         return res, 200
 
@@ -973,26 +756,7 @@ def logout() -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+        end_session()
 
         res = Response()
 
@@ -1,8 +1,8 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import os
 import json 
-from threading import Thread
 
 # configurations
 from Configs import baseConfig
@@ -11,15 +11,31 @@ api = config["API"]
 cookie_name = api['COOKIE_NAME']
 
 from flask import Blueprint, after_this_request
+from flask import stream_with_context
 from flask import Response
 from flask import request
+from flask import current_app
+from flask import g
 from flask import jsonify
 
 v1 = Blueprint("v1", __name__)
 
 from security.cookie import Cookie
+from security.auth import public
+from security.auth import requires_auth
+from security.auth import authenticate
+from security.auth import refresh_session
+from security.auth import end_session
+from security.auth import current_user
+from security.auth import check_account_status
 from security.data import Data
 
+from controllers.conditional import make_etag
+from controllers.conditional import conditional
+from controllers.responses import json_response
+from controllers.downloads import send_artifact
+
+from datetime import datetime
 from datetime import timedelta
 from datetime import date
 from dateutil.parser import parse
@@ -33,9 +49,16 @@ from schemas.records.baseModel import records_db
 # models
 from models.users import User_Model
 from models.sites import Site_Model
+from models.sites import directory
 from models.records import Record_Model
+from models.records import page_size
+from models.records import max_page_size
+from models.records import ingest_max_records
+from models.records import changes_page_size
+from models.records import max_changes_page_size
 from models.sessions import Session_Model
 from models.exports import Export_Model
+from models.export_jobs import Export_Job_Model
 from models.contacts import Contact_Model
 from models.sms_notifications import SMS_Model
 from models.otp import OTP_Model
@@ -46,14 +69,49 @@ from werkzeug.exceptions import InternalServerError
 from werkzeug.exceptions import Unauthorized
 from werkzeug.exceptions import Conflict
 from werkzeug.exceptions import Forbidden
+from werkzeug.exceptions import NotFound
+
+@v1.before_request
+def before_request():
+    if not requires_auth(current_app.view_functions):
+        return None
+
+    try:
+        authenticate(cookie_name=cookie_name)
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
 
 @v1.after_request
 def after_request(response):
-    users_db.close()
-    sites_db.close()
-    records_db.close()
+    try:
+        response = refresh_session(response=response)
+
+    except Unauthorized as err:
+        response = Response(str(err), status=401)
+
+    except Exception as err:
+        logger.exception(err)
+        response = Response("internal server error", status=500)
+
+    for db in (users_db, sites_db, records_db):
+        if not db.is_closed():
+            db.close()
+
     return response
 
+@public
 @v1.route("/signup", methods=["POST"])
 def signup() -> None:
     """
@@ -136,6 +194,7 @@ def signup() -> None:
         logger.exception(err)
         return "internal server error", 500
 
+@public
 @v1.route("/login", methods=["POST"])
 def login() -> dict:
     """
@@ -214,30 +273,9 @@ def createRecord(region_id: int, site_id: int) -> None:
     Create a new record.
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
+        user_id = g.user_id
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             site_id,
@@ -287,20 +325,6 @@ def createRecord(region_id: int, site_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -317,35 +341,112 @@ def createRecord(region_id: int, site_id: int) -> None:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/regions/<int:region_id>/sites/<int:site_id>/records/<int:record_id>", methods=["PUT"])
-def updateRecord(region_id: int, site_id: int, record_id: int) -> None:
+@v1.route("/regions/<int:region_id>/sites/<int:site_id>/records/bulk", methods=["POST"])
+def createRecords(region_id: int, site_id: int) -> list:
     """
+    Create many records, with their child forms, in one request.
+
+    Parameters:
+        region_id: int,
+        site_id: int
+
+    Body:
+        records: list
+
+    Response:
+        200: list,
+        400: str,
+        401: str,
+        409: str,
+        500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
+        user_id = g.user_id
+
+        check_account_status()
+
+        items = (request.get_json(silent=True) or {}).get("records")
+
+        if not isinstance(items, list):
+            logger.error("no records list")
+            raise BadRequest()
+        elif len(items) > ingest_max_records:
+            logger.error("more than %d records" % ingest_max_records)
             raise BadRequest()
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
+        Record = Record_Model()
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
+        result = Record.ingest_records(site_id=site_id, region_id=region_id, records_user_id=user_id, items=items)
 
-        Session = Session_Model()
+        # labs replayed from the field notify like labs created one at a time
+        labs = []
 
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
+        for item in result:
+            if item.get("status") == "created" and item.get("labs"):
+                for lab_id, form in zip(item["labs"], items[item["index"]]["labs"]):
+                    lab_result_type = str(form.get("lab_result_type") or "").lower()
 
-        User = User_Model()
+                    if lab_result_type in ["positive", "negative"]:
+                        labs.append((item["record_id"], lab_id, lab_result_type, str(form["lab_xpert_mtb_rif_assay_result"] or "").lower()))
+
+        if labs:
+            @after_this_request
+            def send_sms(response):
+                try:
+                    Contact = Contact_Model()
+                    Sms = SMS_Model()
+                except Exception as error:
+                    logger.exception(error)
+                    return response
+
+                def trigger_sms(record_id: int, lab_id: int, xpert_1: str, contacts: dict) -> None:
+                    """
+                    """
+                    if xpert_1 in ["detected", "not_detected", "error_invalid"]:
+                        Sms.send_client(contacts=contacts['client'])
+
+                    Sms.send_lab(record_id=record_id, lab_id=lab_id, contacts=contacts['lab'])
+                    Sms.send_requester(record_id=record_id, lab_id=lab_id, contacts=contacts['requester'])
 
-        User.check_account_status(user_id=user_id)
+                    return None
+
+                for record_id, lab_id, lab_result_type, xpert_1 in labs:
+                    try:
+                        contacts = Contact.all(record_id=record_id, sms_notification_type="positive,all" if lab_result_type == "positive" else "all")
+
+                        Sms.background(trigger_sms, record_id=record_id, lab_id=lab_id, xpert_1=xpert_1, contacts=contacts)
+                    except Exception as error:
+                        logger.exception(error)
+
+                return response
+
+        res = jsonify(result)
+
+        return res, 200
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except Conflict as err:
+        return str(err), 409
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/regions/<int:region_id>/sites/<int:site_id>/records/<int:record_id>", methods=["PUT"])
+def updateRecord(region_id: int, site_id: int, record_id: int) -> None:
+    """
+    """
+    try:
+        check_account_status()
 
         payload = (
             site_id,
@@ -395,20 +496,6 @@ def updateRecord(region_id: int, site_id: int, record_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -443,39 +530,19 @@ def findRecord() -> list:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-        
-        User = User_Model()
-
-        user = User.fetch_user(user_id=user_id, account_status="approved")
+        user = current_user()
 
         records_name = request.args.get("name") or None
         records_id = request.args.get("id") or None
         records_telephone = request.args.get("telephone") or None
         records_site_id = request.args.get("site_id") or None
         records_region_id = request.args.get("region_id") or None
+        cursor = request.args.get("cursor") or None
+        limit = request.args.get("limit", default=page_size, type=int)
 
-
-        result = []
+        if not 0 < limit <= max_page_size:
+            logger.error("limit must be between 1 and %d" % max_page_size)
+            raise BadRequest()
 
         Record = Record_Model()
 
@@ -487,53 +554,39 @@ def findRecord() -> list:
                 logger.error("no region_id")
                 raise BadRequest()
 
-            payload = (
-                records_site_id,
-                records_region_id,
-                user["id"],
-                user["permitted_decrypted_data"],
-                records_name,
-                records_id,
-                records_telephone
-            )
-
-            for record in Record.fetch_records(*payload):
-                result.append(record)
+            sites = [(records_site_id, records_region_id)]
         else:
-            for site in user["users_sites"]:
-                payload = (
-                    site["id"],
-                    site["region"]["id"],
-                    user["id"],
-                    user["permitted_decrypted_data"],
-                    records_name,
-                    records_id,
-                    records_telephone
-                )
+            sites = [(site["id"], site["region"]["id"]) for site in user["users_sites"]]
+
+            # browsing without a search lists the user's first site only
+            if not records_name and not records_telephone:
+                sites = sites[:1]
+
+        version = Record.sites_version(sites=sites)
+        etag = make_etag("records", version, sites, user["permitted_decrypted_data"], sorted(request.args.items())) if version is not None else None
+
+        def build() -> Response:
+            result, next_cursor = Record.fetch_records(
+                sites=sites,
+                records_user_id=user["id"],
+                permitted_decrypted_data=user["permitted_decrypted_data"],
+                records_name=records_name,
+                record_id=records_id,
+                records_telephone=records_telephone,
+                limit=limit,
+                cursor=cursor
+            )
 
-                for record in Record.fetch_records(*payload):
-                    result.append(record)
+            res = json_response(result)
 
-                if len(request.args) == 0:
-                    break
+            if next_cursor:
+                res.headers["X-Next-Cursor"] = next_cursor
 
-        res = jsonify(result)
+            return res
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
+        res = conditional(etag, build)
 
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
-        return res, 200
+        return res, res.status_code
 
     except BadRequest as err:
         return str(err), 400
@@ -549,81 +602,48 @@ def findRecord() -> list:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/records/<int:record_id>", methods=["GET"])
-def findSingleRecord(record_id: int) -> list:
+@v1.route("/records/changes", methods=["GET"])
+def findRecordChanges() -> dict:
     """
-    Find single record that belong to user's site.
+    Find records and child forms of the user's sites changed after a watermark.
 
     Parameters:
-        record_id: int
+        since: int (optional),
+        limit: int (optional)
 
     Body:
        None
-    
+
     Response:
-        200: list,
+        200: dict,
         400: str,
         401: str,
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-        
-        User = User_Model()
-
-        user = User.fetch_user(user_id=user_id, account_status="approved")
+        user = current_user()
 
-        result = []
+        since = request.args.get("since", default=0, type=int)
+        limit = request.args.get("limit", default=changes_page_size, type=int)
 
-        for site in user["users_sites"]:
-            payload = (
-                record_id,
-                site["id"],
-                site["region"]["id"],
-                user["id"],
-                user["permitted_decrypted_data"]
-            )
-
-            Record = Record_Model()
+        if since < 0:
+            logger.error("since must be a watermark")
+            raise BadRequest()
+        elif not 0 < limit <= max_changes_page_size:
+            logger.error("limit must be between 1 and %d" % max_changes_page_size)
+            raise BadRequest()
 
-            for record in Record.fetch_record(*payload):
-                result.append(record)
+        Record = Record_Model()
 
-        res = jsonify(result)
+        result = Record.fetch_changes(
+            sites=[(site["id"], site["region"]["id"]) for site in user["users_sites"]],
+            since=since,
+            permitted_decrypted_data=user["permitted_decrypted_data"],
+            limit=limit
+        )
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
+        res = json_response(result)
 
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-        
         return res, 200
 
     except BadRequest as err:
@@ -635,64 +655,165 @@ def findSingleRecord(record_id: int) -> list:
     except InternalServerError as err:
         logger.exception(err)
         return "internal server error", 500
-        
+
     except Exception as err:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/records/<int:record_id>/specimen_collections", methods=["POST"])
-def createSpecimenCollectionRecord(record_id: int) -> None:
+@v1.route("/records/<int:record_id>", methods=["GET"])
+def findSingleRecord(record_id: int) -> list:
     """
-    Create a new specimen_collections record.
+    Find single record that belong to user's site.
 
     Parameters:
         record_id: int
 
     Body:
-        specimen_collection_1_date: str,
-        specimen_collection_1_specimen_collection_type: str,
-        specimen_collection_1_other: str,
-        specimen_collection_1_period: str,
-        specimen_collection_1_aspect: str,
-        specimen_collection_1_received_by: str,
-        specimen_collection_2_date: str,
-        specimen_collection_2_specimen_collection_type: str,
-        specimen_collection_2_other: str,
-        specimen_collection_2_period: str,
-        specimen_collection_2_aspect: str,
-        specimen_collection_2_received_by: str
-            
+       None
+    
     Response:
-        200: None,
+        200: list,
         400: str,
         401: str,
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
+        user = current_user()
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
+        Record = Record_Model()
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
+        found, version = Record.record_version(record_id=record_id, sites=[(site["id"], site["region"]["id"]) for site in user["users_sites"]])
+        etag = make_etag("record", record_id, version, user["permitted_decrypted_data"]) if found and version is not None else None
 
-        Session = Session_Model()
+        def build() -> Response:
+            result = []
+
+            for site in user["users_sites"]:
+                payload = (
+                    record_id,
+                    site["id"],
+                    site["region"]["id"],
+                    user["id"],
+                    user["permitted_decrypted_data"]
+                )
 
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
+                for record in Record.fetch_record(*payload):
+                    result.append(record)
 
-        User = User_Model()
+            return jsonify(result)
+
+        res = conditional(etag, build)
+
+        return res, res.status_code
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+        
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/records/<int:record_id>/bundle", methods=["GET"])
+def findRecordBundle(record_id: int) -> dict:
+    """
+    Find a record of the user's sites with all its child forms.
+
+    Parameters:
+        record_id: int
+
+    Body:
+       None
+
+    Response:
+        200: dict,
+        304: None,
+        401: str,
+        404: str,
+        500: str
+    """
+    try:
+        user = current_user()
+
+        sites = [(site["id"], site["region"]["id"]) for site in user["users_sites"]]
+
+        Record = Record_Model()
+
+        found, version = Record.record_version(record_id=record_id, sites=sites)
+
+        if not found:
+            logger.error("record %s not in user's sites" % record_id)
+            raise NotFound()
 
-        User.check_account_status(user_id=user_id)
+        etag = make_etag("bundle", record_id, version, user["permitted_decrypted_data"]) if version is not None else None
+
+        def build() -> Response:
+            result = Record.fetch_bundle(record_id=record_id, sites=sites, permitted_decrypted_data=user["permitted_decrypted_data"])
+
+            if not result:
+                raise NotFound()
+
+            return json_response(result)
+
+        res = conditional(etag, build)
+
+        return res, res.status_code
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except NotFound as err:
+        return str(err), 404
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/records/<int:record_id>/specimen_collections", methods=["POST"])
+def createSpecimenCollectionRecord(record_id: int) -> None:
+    """
+    Create a new specimen_collections record.
+
+    Parameters:
+        record_id: int
+
+    Body:
+        specimen_collection_1_date: str,
+        specimen_collection_1_specimen_collection_type: str,
+        specimen_collection_1_other: str,
+        specimen_collection_1_period: str,
+        specimen_collection_1_aspect: str,
+        specimen_collection_1_received_by: str,
+        specimen_collection_2_date: str,
+        specimen_collection_2_specimen_collection_type: str,
+        specimen_collection_2_other: str,
+        specimen_collection_2_period: str,
+        specimen_collection_2_aspect: str,
+        specimen_collection_2_received_by: str
+            
+    Response:
+        200: None,
+        400: str,
+        401: str,
+        500: str
+    """
+    try:
+        user_id = g.user_id
+
+        check_account_status()
 
         payload = (
             record_id,
@@ -717,20 +838,6 @@ def createSpecimenCollectionRecord(record_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -752,30 +859,7 @@ def updateSpecimenCollectionRecord(specimen_collection_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             specimen_collection_id,
@@ -799,20 +883,6 @@ def updateSpecimenCollectionRecord(specimen_collection_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -847,30 +917,7 @@ def findSpecimenCollectionRecord(record_id: int) -> list:
         500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
                
         Record = Record_Model()
 
@@ -878,20 +925,6 @@ def findSpecimenCollectionRecord(record_id: int) -> list:
 
         res = jsonify(result)
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -913,30 +946,9 @@ def createLabRecord(record_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
+        user_id = g.user_id
 
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             record_id,            
@@ -1011,8 +1023,11 @@ def createLabRecord(record_id: int) -> None:
 
             @after_this_request
             def send_sms(response):
-                thread = Thread(target=trigger_sms, kwargs={'record_id': record_id, 'lab_id': int(lab_id), 'contacts': contacts})
-                thread.start()
+                try:
+                    Sms.background(trigger_sms, record_id=record_id, lab_id=int(lab_id), contacts=contacts)
+                except Exception as error:
+                    logger.exception(error)
+
                 return response
 
         elif request.json["lab_result_type"].lower() == "negative":
@@ -1020,28 +1035,17 @@ def createLabRecord(record_id: int) -> None:
 
             @after_this_request
             def send_sms(response):
-                thread = Thread(target=trigger_sms, kwargs={'record_id': record_id, 'lab_id': int(lab_id), 'contacts': contacts})
-                thread.start()
+                try:
+                    Sms.background(trigger_sms, record_id=record_id, lab_id=int(lab_id), contacts=contacts)
+                except Exception as error:
+                    logger.exception(error)
+
                 return response
         else:
             pass
 
         res = Response()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1063,30 +1067,7 @@ def updateLabRecord(lab_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             lab_id,
@@ -1162,8 +1143,11 @@ def updateLabRecord(lab_id: int) -> None:
 
             @after_this_request
             def send_sms(response):
-                thread = Thread(target=trigger_sms, kwargs={'record_id': record_id, 'lab_id': lab_id, 'contacts': contacts})
-                thread.start()
+                try:
+                    Sms.background(trigger_sms, record_id=record_id, lab_id=lab_id, contacts=contacts)
+                except Exception as error:
+                    logger.exception(error)
+
                 return response
 
         elif request.json["lab_result_type"].lower() == "negative":
@@ -1171,29 +1155,18 @@ def updateLabRecord(lab_id: int) -> None:
 
             @after_this_request
             def send_sms(response):
-                thread = Thread(target=trigger_sms, kwargs={'record_id': record_id, 'lab_id': lab_id, 'contacts': contacts})
-                thread.start()
+                try:
+                    Sms.background(trigger_sms, record_id=record_id, lab_id=lab_id, contacts=contacts)
+                except Exception as error:
+                    logger.exception(error)
+
                 return response
         else:
             pass
 
         res = Response()
         
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
-        return res, 200
+        return res, 200
 
     except BadRequest as err:
         return str(err), 400
@@ -1214,56 +1187,23 @@ def findLabRecord(record_id: int) -> list:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
+        user = current_user()
 
-        User.check_account_status(user_id=user_id)
-       
         Record = Record_Model()
 
-        result = Record.fetch_lab(lab_records_id=record_id)
+        found, version = Record.record_version(record_id=record_id, sites=[(site["id"], site["region"]["id"]) for site in user["users_sites"]])
+        etag = make_etag("labs", record_id, version) if found and version is not None else None
 
-        res = jsonify(result)
+        res = conditional(etag, lambda: jsonify(Record.fetch_lab(lab_records_id=record_id)))
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
-        return res, 200
+        return res, res.status_code
 
     except BadRequest as err:
         return str(err), 400
 
+    except Unauthorized as err:
+        return str(err), 401
+
     except InternalServerError as err:
         logger.exception(err)
         return "internal server error", 500
@@ -1277,30 +1217,9 @@ def createFollowUpRecord(record_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
+        user_id = g.user_id
 
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             record_id,
@@ -1318,20 +1237,6 @@ def createFollowUpRecord(record_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1350,30 +1255,7 @@ def updateFollowUpRecord(follow_up_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             follow_up_id,
@@ -1390,20 +1272,6 @@ def updateFollowUpRecord(follow_up_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1422,30 +1290,7 @@ def findFollowUpRecord(record_id: int) -> list:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-        
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
     
         Record = Record_Model()
 
@@ -1453,20 +1298,6 @@ def findFollowUpRecord(record_id: int) -> list:
 
         res = jsonify(result)
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1485,30 +1316,9 @@ def createOutcomeRecoredRecord(record_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
+        user_id = g.user_id
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             record_id,
@@ -1525,20 +1335,6 @@ def createOutcomeRecoredRecord(record_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1557,30 +1353,7 @@ def updateOutcomeRecoredRecord(outcome_recorded_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         payload = (
             outcome_recorded_id,
@@ -1596,20 +1369,6 @@ def updateOutcomeRecoredRecord(outcome_recorded_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1628,30 +1387,7 @@ def findOutcomeRecoredRecord(record_id: int) -> list:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         Record = Record_Model()
 
@@ -1659,20 +1395,6 @@ def findOutcomeRecoredRecord(record_id: int) -> list:
 
         res = jsonify(result)
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1691,30 +1413,9 @@ def createTbTreatmentOutcomeRecord(record_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
+        user_id = g.user_id
 
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
         
         payload = (
             record_id,
@@ -1730,20 +1431,6 @@ def createTbTreatmentOutcomeRecord(record_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1762,30 +1449,7 @@ def updateTbTreatmentOutcomeRecord(tb_treatment_outcomes_id: int) -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
+        check_account_status()
         
         payload = (
             tb_treatment_outcomes_id,
@@ -1800,20 +1464,6 @@ def updateTbTreatmentOutcomeRecord(tb_treatment_outcomes_id: int) -> None:
 
         res = jsonify()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1831,51 +1481,14 @@ def updateTbTreatmentOutcomeRecord(tb_treatment_outcomes_id: int) -> None:
 def findTbTreatmentOutcomeRecord(record_id: int) -> list:
     """
     """
-    try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)       
-
-        User = User_Model()
-
-        User.check_account_status(user_id=user_id)
-
-        Record = Record_Model()
-
-        result = Record.fetch_tb_treatment_outcome(tb_treatment_outcome_records_id=record_id)
-
-        res = jsonify(result)
-
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
+    try:
+        check_account_status()
+
+        Record = Record_Model()
+
+        result = Record.fetch_tb_treatment_outcome(tb_treatment_outcome_records_id=record_id)
+
+        res = jsonify(result)
 
         return res, 200
 
@@ -1895,47 +1508,10 @@ def findAUser() -> dict:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        Session = Session_Model()
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
-
-        User = User_Model()
-
-        user = User.fetch_user(user_id=user_id, account_status="approved")
+        user = current_user()
        
         res = jsonify(user)
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -1957,29 +1533,11 @@ def updateProfile() -> None:
     """
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
-
-        cookie = Cookie()
-        Session = Session_Model()
         User = User_Model()
 
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
-
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
-
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+        user_id = g.user_id
 
-        User.check_account_status(user_id=user_id)
+        check_account_status()
 
         if request.method == "PUT":
             if not "phone_number" in request.json or not request.json["phone_number"]:
@@ -2032,19 +1590,6 @@ def updateProfile() -> None:
        
         res = Response()
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
-
         return res, 200
 
     except BadRequest as err:
@@ -2064,6 +1609,7 @@ def updateProfile() -> None:
         logger.exception(err)
         return "internal server error", 500
 
+@public
 @v1.route("/recovery", methods=["PUT", "POST"])
 def accountRecovery() -> None:
     """
@@ -2175,6 +1721,7 @@ def accountRecovery() -> None:
         logger.exception(err)
         return "internal server error", 500
 
+@public
 @v1.route("/otp", methods=["PUT", "POST"])
 def OTP() -> None:
     """
@@ -2231,8 +1778,11 @@ def OTP() -> None:
 
             @after_this_request
             def send_sms(response):
-                thread = Thread(target=trigger_sms, kwargs={'text': otp["text"], 'contacts': otp["contacts"]})
-                thread.start()
+                try:
+                    trigger_sms(text=otp["text"], contacts=otp["contacts"])
+                except Exception as error:
+                    logger.exception(error)
+
                 return response
 
             res = Response()
@@ -2319,6 +1869,7 @@ def OTP() -> None:
         logger.exception(err)
         return "internal server error", 500
 
+@public
 @v1.route("/regions", methods=["GET"])
 def getRegions() -> list:
     """
@@ -2336,9 +1887,13 @@ def getRegions() -> list:
     try:       
         Site = Site_Model()
 
-        result = Site.fetch_regions()
+        res = conditional(
+            make_etag("regions", directory.etag()),
+            lambda: jsonify(Site.fetch_regions()),
+            cache_control="public, max-age=%d" % directory.ttl
+        )
 
-        return jsonify(result), 200
+        return res, res.status_code
 
     except BadRequest as err:
         return str(err), 400
@@ -2357,6 +1912,7 @@ def getRegions() -> list:
         logger.exception(err)
         return "internal server error", 500
 
+@public
 @v1.route("/regions/<int:region_id>/sites", methods=["GET"])
 def getSites(region_id) -> list:
     """
@@ -2377,9 +1933,13 @@ def getSites(region_id) -> list:
     try:        
         Site = Site_Model()
 
-        result = Site.fetch_sites(region_id= region_id)
+        res = conditional(
+            make_etag("sites", region_id, directory.etag()),
+            lambda: jsonify(Site.fetch_sites(region_id=region_id)),
+            cache_control="public, max-age=%d" % directory.ttl
+        )
 
-        return jsonify(result), 200
+        return res, res.status_code
 
     except BadRequest as err:
         return str(err), 400
@@ -2398,87 +1958,120 @@ def getSites(region_id) -> list:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/regions/<string:region_id>/sites/<string:site_id>/exports/<string:format>", methods=["GET"])
-def dataExport(region_id: str, site_id: str, format: str) -> str:
+def check_export_range(user: dict, start_date: datetime) -> bool:
     """
+    Check an export starting at start_date is within the user's permitted_export_range.
+
+    Arguments:
+        user: dict,
+        start_date: datetime
+
+    Returns:
+        bool
     """
-    try:        
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
-            raise BadRequest()
+    month_range = date.today().month - start_date.month
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
+    logger.debug("checking permitted_export_range ...")
+    if (month_range+1) > user['permitted_export_range']:
+        logger.error("Not allowed to export. Permitted_export_range exceeded")
+        raise Forbidden()
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
+    return True
 
-        Session = Session_Model()
+def export_range(user: dict, format: str) -> tuple:
+    """
+    Check a user may export a format and parse the requested date range.
 
-        user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+    Arguments:
+        user: dict,
+        format: str
 
-        User = User_Model()
-        
-        user = User.fetch_user(user_id=user_id, no_sites=True, account_status="approved")
-
-        if user['permitted_export_range'] < 1:
-            logger.error("Not allowed to export. permitted_export_range < 1")
-            raise Forbidden()
-        elif len(user['permitted_export_types']) < 1:
-            logger.error("Not allowed to export. No permitted_export_types")
-            raise Forbidden()
-        elif not format in user['permitted_export_types']:
-            logger.error("Not allowed to export %s" % format)
-            raise Forbidden()
+    Returns:
+        (datetime, datetime)
+    """
+    if user['permitted_export_range'] < 1:
+        logger.error("Not allowed to export. permitted_export_range < 1")
+        raise Forbidden()
+    elif len(user['permitted_export_types']) < 1:
+        logger.error("Not allowed to export. No permitted_export_types")
+        raise Forbidden()
+    elif not format in user['permitted_export_types']:
+        logger.error("Not allowed to export %s" % format)
+        raise Forbidden()
 
-        permitted_decrypted_data= user["permitted_decrypted_data"]
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+
+    if not start_date or not end_date:
+        logger.error("no start_date or end_date")
+        raise BadRequest()
+
+    start_date = parse(start_date)
+
+    check_export_range(user=user, start_date=start_date)
+
+    end_date = parse(end_date) + relativedelta(hours=23, minutes=59, seconds=59)
+    req_range = end_date.month - start_date.month
+            
+    logger.info("requesting %d month(s) data" % (req_range+1))
+
+    return start_date, end_date
+
+@v1.route("/regions/<string:region_id>/sites/<string:site_id>/exports/<string:format>", methods=["GET"])
+def dataExport(region_id: str, site_id: str, format: str) -> str:
+    """
+    Export records permitted to access.
+
+    Parameters:
+        region_id: str,
+        site_id: str,
+        format: str
+
+    Query:
+        start_date: str,
+        end_date: str,
+        stream: bool (csv only)
 
-        start_date = request.args.get("start_date")
-        end_date = request.args.get("end_date")
-        month_range = date.today().month - parse(start_date).month
+    Response:
+        200: str | text/csv,
+        400: str,
+        401: str,
+        403: str,
+        500: str
+    """
+    try:        
+        user = current_user(no_sites=True)
 
-        logger.debug("checking permitted_export_range ...")
-        if (month_range+1) > user['permitted_export_range']:
-            logger.error("Not allowed to export. Permitted_export_range exceeded")
-            raise Forbidden()
+        start_date, end_date = export_range(user=user, format=format)
 
-        start_date = parse(start_date)
-        end_date = parse(end_date) + relativedelta(hours=23, minutes=59, seconds=59)
-        req_range = end_date.month - start_date.month
-                
-        logger.info("requesting %d month(s) data" % (req_range+1))
+        permitted_decrypted_data= user["permitted_decrypted_data"]
 
         Export = Export_Model()
         
-        if format == "csv":
-            download_path = Export.csv(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data)
+        if format == "csv" and request.args.get("stream") in ["true", "1"]:
+            compress = "gzip" in request.accept_encodings
+
+            stream = Export.csv_stream(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data, compress=compress)
+
+            res = Response(stream_with_context(stream), mimetype="text/csv")
+            res.headers["Content-Disposition"] = 'attachment; filename="%s"' % Export.csv_filename()
+            res.headers["Vary"] = "Accept-Encoding"
+
+            if compress:
+                res.headers["Content-Encoding"] = "gzip"
+
+        elif format == "csv":
+            download_path = Export.csv(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data, owner_id=user["id"])
 
             res = Response(download_path)
         elif format == "pdf":
-            pdf_download_path = Export.pdf(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data)
+            pdf_download_path = Export.pdf(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data, owner_id=user["id"])
 
             res = Response(pdf_download_path)
+        elif format == "parquet":
+            download_path = Export.parquet(start_date=start_date, end_date=end_date, region_id=region_id, site_id=site_id, permitted_decrypted_data=permitted_decrypted_data, owner_id=user["id"])
 
-        session = Session.update(sid=sid, unique_identifier=user_id)
-
-        cookie = Cookie()
-        cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
-        e_cookie = cookie.encrypt(cookie_data)
-        res.set_cookie(
-            cookie_name,
-            e_cookie,
-            max_age=timedelta(milliseconds=session["data"]["maxAge"]),
-            secure=session["data"]["secure"],
-            httponly=session["data"]["httpOnly"],
-            samesite=session["data"]["sameSite"],
-        )
+            res = Response(download_path)
 
         return res, 200
 
@@ -2502,31 +2095,193 @@ def dataExport(region_id: str, site_id: str, format: str) -> str:
         logger.exception(err)
         return "internal server error", 500
 
-@v1.route("/logout", methods=["POST"])
-def logout() -> None:
+@v1.route("/regions/<string:region_id>/sites/<string:site_id>/exports/<string:format>/jobs", methods=["POST"])
+def createExportJob(region_id: str, site_id: str, format: str) -> dict:
     """
+    Queue an export to run in the background.
+
+    Parameters:
+        region_id: str,
+        site_id: str,
+        format: str
+
+    Query:
+        start_date: str,
+        end_date: str
+
+    Response:
+        202: dict,
+        400: str,
+        401: str,
+        403: str,
+        500: str
     """
     try:
-        if not request.cookies.get(cookie_name):
-            logger.error("no cookie")
-            raise Unauthorized()
-        elif not request.headers.get("User-Agent"):
-            logger.error("no user agent")
+        if not format in ["csv", "pdf", "parquet"]:
+            logger.error("invalid export format '%s'" % format)
             raise BadRequest()
 
-        cookie = Cookie()
-        e_cookie = request.cookies.get(cookie_name)
-        d_cookie = cookie.decrypt(e_cookie)
-        json_cookie = json.loads(d_cookie)
+        user = current_user(no_sites=True)
 
-        sid = json_cookie["sid"]
-        uid = json_cookie["uid"]
-        user_cookie = json_cookie["cookie"]
-        user_agent = request.headers.get("User-Agent")
+        start_date, end_date = export_range(user=user, format=format)
 
-        Session = Session_Model()
+        Job = Export_Job_Model()
 
-        Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie) 
+        job = Job.submit(
+            user_id=user["id"],
+            format=format,
+            start_date=start_date,
+            end_date=end_date,
+            region_id=region_id,
+            site_id=site_id,
+            permitted_decrypted_data=user["permitted_decrypted_data"]
+        )
+
+        return jsonify(job), 202
+
+    except BadRequest as err:
+        return str(err), 400
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except Forbidden as err:
+        return str(err), 403
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+def export_job(job_id: str) -> dict:
+    """
+    Find an export job the current user may read.
+
+    A job is shared by everyone who requested the same export, so access
+    follows the user's export permissions rather than who queued it.
+
+    Arguments:
+        job_id: str
+
+    Returns:
+        dict
+    """
+    user = current_user(no_sites=True)
+
+    Job = Export_Job_Model()
+
+    job = Job.fetch(job_id=job_id)
+
+    if not job["format"] in user["permitted_export_types"]:
+        logger.error("Not allowed to export %s" % job["format"])
+        raise Forbidden()
+    elif job["permitted_decrypted_data"] and not user["permitted_decrypted_data"]:
+        logger.error("Not allowed to export decrypted data")
+        raise Forbidden()
+
+    check_export_range(user=user, start_date=job["start_date"])
+
+    return job
+
+@v1.route("/exports/jobs/<string:job_id>", methods=["GET"])
+def findExportJob(job_id: str) -> dict:
+    """
+    Fetch an export job's status and progress.
+
+    Parameters:
+        job_id: str
+
+    Response:
+        200: dict,
+        401: str,
+        403: str,
+        404: str,
+        500: str
+    """
+    try:
+        job = export_job(job_id=job_id)
+
+        return jsonify(job), 200
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except Forbidden as err:
+        return str(err), 403
+
+    except NotFound as err:
+        return str(err), 404
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/exports/jobs/<string:job_id>/download", methods=["GET"])
+def downloadExportJob(job_id: str) -> str:
+    """
+    Fetch a finished export job's artifact.
+
+    Parameters:
+        job_id: str
+
+    Response:
+        200: text/csv | application/pdf | application/vnd.apache.parquet | str,
+        401: str,
+        403: str,
+        404: str,
+        409: str,
+        500: str
+    """
+    try:
+        job = export_job(job_id=job_id)
+
+        if job["status"] != "done":
+            logger.error("export job %s is %s" % (job_id, job["status"]))
+            raise Conflict()
+
+        # PDF jobs rendered by the PDF service return its reply instead of a file
+        if job["format"] in ["csv", "parquet"] or job["result"].startswith("/downloads/"):
+            export_file = os.path.basename(job["result"])
+
+            res = send_artifact(name=export_file, as_attachment=True)
+        else:
+            res = Response(job["result"])
+
+        return res
+
+    except Unauthorized as err:
+        return str(err), 401
+
+    except Forbidden as err:
+        return str(err), 403
+
+    except NotFound as err:
+        return str(err), 404
+
+    except Conflict as err:
+        return str(err), 409
+
+    except InternalServerError as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+    except Exception as err:
+        logger.exception(err)
+        return "internal server error", 500
+
+@v1.route("/logout", methods=["POST"])
+def logout() -> None:
+    """
+    """
+    try:
+        end_session()
 
         res = Response()
 
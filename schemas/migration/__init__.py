@@ -8,7 +8,13 @@ from peewee import OperationalError
 
 from schemas.records.baseModel import records_db
 from schemas.records.records import Records
+from schemas.records.specimen_collection import Specimen_collections
 from schemas.records.lab import Labs
+from schemas.records.follow_up import Follow_ups
+from schemas.records.outcome_recorded import Outcome_recorded
+from schemas.records.tb_treatment_outcome import Tb_treatment_outcomes
+from schemas.records.records_search import Records_search
+from schemas.records.records_changes import Records_changes
 
 from schemas.sites.baseModel import sites_db
 from schemas.sites.regions import Regions
@@ -32,6 +38,69 @@ def migrate_records() -> None:
     except OperationalError as error:
         logger.error(error)
 
+def missing_indexes(database, models: list) -> list:
+    """
+    Find the indexes models declare that their tables lack.
+
+    An index counts as present when an existing index of the table starts
+    with the same columns.
+
+    Arguments:
+        database: peewee.Database,
+        models: list
+
+    Returns:
+        list [(table, name, columns, unique)]
+    """
+    result = []
+
+    for model in models:
+        table = model._meta.table_name
+
+        if not database.table_exists(table):
+            continue
+
+        existing = [index.columns for index in database.get_indexes(table)]
+
+        for index in model._meta.fields_to_index():
+            columns = [expression.column_name for expression in index._expressions]
+
+            if not any(found[:len(columns)] == columns for found in existing):
+                result.append((table, index._name, columns, index._unique))
+
+    return result
+
+def migrate_indexes() -> None:
+    """
+    Build the records indexes missing from an existing install.
+
+    Tables stay readable and writable while each index is built. MySQL
+    refuses rather than locking when it cannot build one online.
+    """
+    try:
+        logger.debug("Starting records index migration ...")
+
+        models = [Records, Specimen_collections, Labs, Follow_ups, Outcome_recorded, Tb_treatment_outcomes, Records_search, Records_changes]
+
+        for table, name, columns, unique in missing_indexes(records_db, models):
+            logger.debug("building index %s on %s ..." % (name, table))
+
+            records_db.execute_sql(
+                "ALTER TABLE `%s` ADD %sINDEX `%s` (%s), ALGORITHM=INPLACE, LOCK=NONE" % (
+                    table,
+                    "UNIQUE " if unique else "",
+                    name,
+                    ", ".join("`%s`" % column for column in columns)
+                )
+            )
+
+            logger.info("- Built index %s on %s" % (name, table))
+
+        logger.info("- Successfully migrated records indexes")
+
+    except OperationalError as error:
+        logger.error(error)
+
 # def migrate_labs() -> None:
 #     """
 #     """
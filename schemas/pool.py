@@ -0,0 +1,109 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+database = config["DATABASE"]
+
+import time
+import threading
+
+from playhouse.pool import PooledMySQLDatabase
+
+pool_options = {
+    "max_connections": database.getint("MAX_CONNECTIONS", fallback=20),
+    "stale_timeout": database.getint("STALE_TIMEOUT", fallback=300),
+    "timeout": database.getint("POOL_TIMEOUT", fallback=10),
+}
+
+class Pooled_Database(PooledMySQLDatabase):
+    """
+    MySQL connection pool with checkout instrumentation.
+
+    Connections are bound to the calling thread while checked out and
+    go back to the pool on close() instead of being torn down.
+
+    Attributes:
+        slow_checkout: float (seconds)
+
+    Methods:
+        stats() -> dict
+    """
+    slow_checkout = 1.0
+
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Arguments:
+            database: str,
+            max_connections: int (optional),
+            stale_timeout: int (optional),
+            timeout: int (optional)
+        """
+        self.__lock = threading.Lock()
+        self.__counters = {
+            "checkouts": 0,
+            "reused": 0,
+            "created": 0,
+            "returned": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0
+        }
+
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open: bool = False) -> bool:
+        """
+        Check out a connection for the calling thread.
+        """
+        start = time.perf_counter()
+        result = super().connect(reuse_if_open)
+        wait = time.perf_counter() - start
+
+        with self.__lock:
+            self.__counters["wait_total"] += wait
+            self.__counters["wait_max"] = max(self.__counters["wait_max"], wait)
+
+        if wait > self.slow_checkout:
+            logger.warning("Slow %s connection checkout: %.3fs (in use: %d)" % (self.database, wait, len(self._in_use)))
+
+        return result
+
+    def _connect(self):
+        idle = set(self.conn_key(conn) for _, conn in self._connections)
+
+        conn = super()._connect()
+
+        with self.__lock:
+            self.__counters["checkouts"] += 1
+            if self.conn_key(conn) in idle:
+                self.__counters["reused"] += 1
+            else:
+                self.__counters["created"] += 1
+
+        return conn
+
+    def _close(self, conn, close_conn: bool = False) -> None:
+        if not close_conn and self.conn_key(conn) in self._in_use:
+            with self.__lock:
+                self.__counters["returned"] += 1
+
+        super()._close(conn, close_conn)
+
+    def stats(self) -> dict:
+        """
+        Pool usage counters.
+
+        Arguments:
+            None
+
+        Returns:
+            dict
+        """
+        with self.__lock:
+            result = dict(self.__counters)
+
+        result["in_use"] = len(self._in_use)
+        result["idle"] = len(self._connections)
+        result["max_connections"] = self._max_connections
+
+        return result
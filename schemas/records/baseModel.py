@@ -5,20 +5,23 @@ from Configs import baseConfig
 config = baseConfig()
 database = config["DATABASE"]
 
-from peewee import MySQLDatabase
 from peewee import Model
 from peewee import DatabaseError
 
 from werkzeug.exceptions import InternalServerError
 
+from schemas.pool import Pooled_Database
+from schemas.pool import pool_options
+
 try:
     logger.debug("connecting to %s database ..." % database["MYSQL_RECORDS_DATABASE"])
 
-    records_db = MySQLDatabase(
+    records_db = Pooled_Database(
         database["MYSQL_RECORDS_DATABASE"],
         user=database["MYSQL_USER"],
         password=database["MYSQL_PASSWORD"],
         host=database["MYSQL_HOST"],
+        **pool_options
     )
 
     logger.info("- Successfully connected to %s database" % database["MYSQL_RECORDS_DATABASE"])
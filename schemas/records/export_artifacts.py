@@ -0,0 +1,17 @@
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+from peewee import BigIntegerField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+class Export_artifacts(BaseModel):
+    # file name in the datasets directory
+    name = CharField(primary_key=True)
+    owner_id = IntegerField(null=True)
+    format = CharField()
+    size = BigIntegerField()
+    checksum = CharField(max_length=64) # sha256
+    createdAt = DateTimeField(default=datetime.now)
+    expiresAt = DateTimeField(index=True)
@@ -0,0 +1,33 @@
+from uuid import uuid4
+
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+from peewee import BooleanField
+from peewee import TextField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+def job_id():
+    return uuid4().hex
+
+class Export_jobs(BaseModel):
+    id = CharField(primary_key=True, default=job_id)
+    key = CharField(index=True)
+    # set to key while pending or running, NULL once finished
+    active_key = CharField(null=True, unique=True)
+    user_id = IntegerField()
+    format = CharField()
+    start_date = DateTimeField()
+    end_date = DateTimeField()
+    region_id = CharField()
+    site_id = CharField()
+    permitted_decrypted_data = BooleanField()
+    status = CharField(default="pending") # ["pending", "running", "done", "failed"]
+    rows_done = IntegerField(default=0)
+    rows_total = IntegerField(null=True)
+    result = TextField(null=True)
+    error = CharField(null=True)
+    createdAt = DateTimeField(default=datetime.now)
+    updatedAt = DateTimeField(default=datetime.now)
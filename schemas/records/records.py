@@ -51,4 +51,12 @@ class Records(BaseModel):
     records_sms_notifications = BooleanField(default=False)
     records_requester_name = CharField(null=True)
     records_requester_telephone = CharField(null=True)
-    iv = CharField()
\ No newline at end of file
+    iv = CharField()
+
+    class Meta:
+        # records list pages (keyset), exports by region/site and by date alone
+        indexes = (
+            (('site_id', 'region_id', 'records_date', 'record_id'), False),
+            (('region_id', 'site_id', 'records_date_of_test_request'), False),
+            (('records_date_of_test_request',), False),
+        )
@@ -0,0 +1,21 @@
+from peewee import BigAutoField
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+class Records_changes(BaseModel):
+    # change feed of records and their child forms, in seq order
+    seq = BigAutoField()
+    site_id = IntegerField()
+    region_id = IntegerField()
+    record_id = IntegerField()
+    entity = CharField(max_length=32) # ["records", "specimen_collections", "labs", "follow_ups", "outcome_recorded", "tb_treatment_outcomes"]
+    row_id = IntegerField()
+    op = CharField(max_length=8) # ["upsert", "delete"]
+    createdAt = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = ((('site_id', 'region_id', 'seq'), False), (('record_id', 'seq'), False), (('createdAt',), False),)
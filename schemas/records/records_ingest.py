@@ -0,0 +1,16 @@
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+class Records_ingest(BaseModel):
+    # idempotency keys of records created through bulk ingestion
+    user_id = IntegerField()
+    idempotency_key = CharField(max_length=64)
+    record_id = IntegerField()
+    createdAt = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = ((('user_id', 'idempotency_key'), True),)
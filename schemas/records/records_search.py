@@ -0,0 +1,15 @@
+from peewee import CharField
+from peewee import IntegerField
+
+from schemas.records.baseModel import BaseModel
+
+class Records_search(BaseModel):
+    # keyed hashes of normalised records_name and records_telephone tokens
+    record_id = IntegerField(index=True)
+    site_id = IntegerField()
+    region_id = IntegerField()
+    field = CharField(max_length=16) # ["name", "telephone"]
+    token = CharField(max_length=32)
+
+    class Meta:
+        indexes = ((('site_id', 'region_id', 'field', 'token', 'record_id'), False),)
@@ -0,0 +1,11 @@
+from peewee import CharField
+from peewee import DateTimeField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+class Sms_operators(BaseModel):
+    # keyed hash of the phone number
+    number = CharField(primary_key=True, max_length=64)
+    operator_name = CharField()
+    updatedAt = DateTimeField(default=datetime.now)
@@ -0,0 +1,23 @@
+from peewee import CharField
+from peewee import DateTimeField
+from peewee import IntegerField
+from peewee import TextField
+
+from schemas.records.baseModel import BaseModel
+from datetime import datetime
+
+class Sms_outbox(BaseModel):
+    # number and text are encrypted with iv
+    number = CharField()
+    text = TextField()
+    iv = CharField()
+    status = CharField(default="pending") # ["pending", "sending", "sent", "failed"]
+    claim = CharField(null=True)
+    attempts = IntegerField(default=0)
+    next_attempt = DateTimeField(default=datetime.now)
+    error = TextField(null=True)
+    createdAt = DateTimeField(default=datetime.now)
+    updatedAt = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = ((('status', 'next_attempt'), False), (('claim',), False),)
@@ -6,19 +6,22 @@ config = baseConfig()
 database = config["DATABASE"]
 
 from peewee import Model
-from peewee import MySQLDatabase
 from peewee import DatabaseError
 
 from werkzeug.exceptions import InternalServerError
 
+from schemas.pool import Pooled_Database
+from schemas.pool import pool_options
+
 try:
     logger.debug("connecting to %s database ..." % database["MYSQL_USERS_DATABASE"])
 
-    users_db = MySQLDatabase(
+    users_db = Pooled_Database(
         database["MYSQL_USERS_DATABASE"],
         user=database["MYSQL_USER"],
         password=database["MYSQL_PASSWORD"],
         host=database["MYSQL_HOST"],
+        **pool_options
     )
 
     logger.info("- Successfully connected to %s database" % database["MYSQL_USERS_DATABASE"])
@@ -0,0 +1,195 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import json
+import time
+
+from flask import g
+from flask import request
+
+from security.cookie import Cookie
+
+from models.users import User_Model
+from models.sessions import Session_Model
+
+from datetime import timedelta
+
+from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import Unauthorized
+
+def public(view):
+    """
+    Mark a view as not requiring an authenticated session.
+    """
+    view.public = True
+    return view
+
+def requires_auth(view_functions: dict) -> bool:
+    """
+    Check if the current request must go through authenticate().
+
+    Arguments:
+        view_functions: dict
+
+    Returns:
+        bool
+    """
+    if request.method == "OPTIONS" or not request.endpoint:
+        return False
+
+    view = view_functions.get(request.endpoint)
+
+    return view is not None and not getattr(view, "public", False)
+
+def authenticate(cookie_name: str) -> str:
+    """
+    Resolve the request's session cookie into flask.g.
+
+    Sets g.sid, g.user_id and g.cookie_name.
+
+    Arguments:
+        cookie_name: str
+
+    Returns:
+        str
+    """
+    start = time.perf_counter()
+
+    if not request.cookies.get(cookie_name):
+        logger.error("no cookie")
+        raise Unauthorized()
+    elif not request.headers.get("User-Agent"):
+        logger.error("no user agent")
+        raise BadRequest()
+
+    cookie = Cookie()
+    e_cookie = request.cookies.get(cookie_name)
+    d_cookie = cookie.decrypt(e_cookie)
+    json_cookie = json.loads(d_cookie)
+
+    sid = json_cookie["sid"]
+    uid = json_cookie["uid"]
+    user_cookie = json_cookie["cookie"]
+    user_agent = request.headers.get("User-Agent")
+
+    Session = Session_Model()
+
+    user_id = Session.find(sid=sid, unique_identifier=uid, user_agent=user_agent, cookie=user_cookie)
+
+    g.sid = sid
+    g.user_id = user_id
+    g.cookie_name = cookie_name
+    g.auth_time = time.perf_counter() - start
+
+    return user_id
+
+def current_user(no_sites: bool = False) -> dict:
+    """
+    Fetch the authenticated approved user once per request.
+
+    A user fetched with sites also satisfies later no_sites lookups.
+
+    Arguments:
+        no_sites: bool
+
+    Returns:
+        dict
+    """
+    start = time.perf_counter()
+
+    user = g.get("user")
+
+    if user is None or (not no_sites and not "users_sites" in user):
+        User = User_Model()
+        user = User.fetch_user(user_id=g.user_id, account_status="approved", no_sites=no_sites)
+
+        g.user = user
+        g.account_approved = True
+
+    g.auth_time = g.get("auth_time", 0) + time.perf_counter() - start
+
+    return user
+
+def check_account_status() -> bool:
+    """
+    Check the authenticated user's account is approved, once per request.
+
+    Returns:
+        bool
+    """
+    if not g.get("account_approved"):
+        start = time.perf_counter()
+
+        User = User_Model()
+        User.check_account_status(user_id=g.user_id)
+
+        g.account_approved = True
+        g.auth_time = g.get("auth_time", 0) + time.perf_counter() - start
+
+    return True
+
+def check_permission(scope: list, permitted_approve_accounts: bool = False) -> str:
+    """
+    Check the authenticated user's scope.
+
+    Arguments:
+        scope: list,
+        permitted_approve_accounts: bool
+
+    Returns:
+        str
+    """
+    start = time.perf_counter()
+
+    User = User_Model()
+    account_type = User.check_permission(user_id=g.user_id, scope=scope, permitted_approve_accounts=permitted_approve_accounts)
+
+    g.account_approved = True
+    g.auth_time = g.get("auth_time", 0) + time.perf_counter() - start
+
+    return account_type
+
+def end_session() -> None:
+    """
+    Delete the authenticated session so it is not refreshed.
+
+    Returns:
+        None
+    """
+    Session = Session_Model()
+    Session.delete(sid=g.pop("sid"))
+
+def refresh_session(response):
+    """
+    Slide the authenticated session and re-issue its cookie on successful responses.
+
+    Arguments:
+        response: flask.Response
+
+    Returns:
+        flask.Response
+    """
+    if not "sid" in g or response.status_code >= 400:
+        return response
+
+    start = time.perf_counter()
+
+    Session = Session_Model()
+    session = Session.update(sid=g.sid, unique_identifier=g.user_id)
+
+    cookie = Cookie()
+    cookie_data = json.dumps({"sid": session["sid"], "uid": session["uid"], "cookie": session["data"]})
+    e_cookie = cookie.encrypt(cookie_data)
+    response.set_cookie(
+        g.cookie_name,
+        e_cookie,
+        max_age=timedelta(milliseconds=session["data"]["maxAge"]),
+        secure=session["data"]["secure"],
+        httponly=session["data"]["httpOnly"],
+        samesite=session["data"]["sameSite"],
+    )
+
+    auth_time = g.get("auth_time", 0) + time.perf_counter() - start
+    logger.debug("auth stage for %s took %.2fms" % (request.endpoint, auth_time * 1000))
+
+    return response
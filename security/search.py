@@ -0,0 +1,127 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from Configs import baseConfig
+config = baseConfig()
+api = config["API"]
+salt = api["SALT"]
+
+import hmac
+import hashlib
+import unicodedata
+
+# shortest query matched by n-grams, shorter ones by their own tokens
+ngram_size = 3
+
+key = hmac.new(salt.encode("utf-8"), b"blind index", hashlib.sha256).digest()
+
+def normalise(field: str, data: str) -> str:
+    """
+    Reduce a searchable value to the form its tokens are built from.
+
+    Names are lowercased, stripped of accents and have their whitespace
+    collapsed. Telephone numbers keep their digits only.
+
+    Arguments:
+        field: str ("name" | "telephone"),
+        data: str
+
+    Returns:
+        str
+    """
+    if not data:
+        return ""
+
+    if field == "telephone":
+        return "".join(char for char in data if char.isdigit())
+
+    data = unicodedata.normalize("NFKD", data)
+    data = "".join(char for char in data if not unicodedata.combining(char))
+
+    return " ".join(data.lower().split())
+
+def token(field: str, kind: str, data: str) -> str:
+    """
+    Keyed hash of one search token.
+
+    Arguments:
+        field: str,
+        kind: str ("e" exact | "g" n-gram | "s" shorter substring),
+        data: str
+
+    Returns:
+        str
+    """
+    message = "%s:%s:%s" % (field, kind, data)
+
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+def index_tokens(field: str, data: str) -> set:
+    """
+    Tokens stored for a value: its exact form, every n-gram and every
+    substring shorter than an n-gram, so short queries match anywhere.
+
+    Arguments:
+        field: str,
+        data: str
+
+    Returns:
+        set
+    """
+    data = normalise(field, data)
+
+    if not data:
+        return set()
+
+    tokens = {token(field, "e", data)}
+
+    for start in range(len(data) - ngram_size + 1):
+        tokens.add(token(field, "g", data[start:start + ngram_size]))
+
+    for size in range(1, ngram_size):
+        for start in range(len(data) - size + 1):
+            tokens.add(token(field, "s", data[start:start + size]))
+
+    return tokens
+
+def query_tokens(field: str, data: str) -> set:
+    """
+    Tokens a record must have all of to match a search.
+
+    A record matches when its value contains the query. Queries of at
+    least ngram_size characters need all their n-grams, shorter ones have
+    a token of their own.
+
+    Arguments:
+        field: str,
+        data: str
+
+    Returns:
+        set
+    """
+    data = normalise(field, data)
+
+    if not data:
+        return set()
+
+    if len(data) < ngram_size:
+        return {token(field, "s", data)}
+
+    return {token(field, "g", data[start:start + ngram_size]) for start in range(len(data) - ngram_size + 1)}
+
+def matches(field: str, query: str, data: str) -> bool:
+    """
+    Check a decrypted value against a search, as the tokens would.
+
+    Arguments:
+        field: str,
+        query: str,
+        data: str
+
+    Returns:
+        bool
+    """
+    query = normalise(field, query)
+    data = normalise(field, data)
+
+    return query in data
@@ -1,23 +1,27 @@
 import ssl
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--logs", help="Set log level")
-args = parser.parse_args()
 from logger import baseLogger
-baseLogger(args.logs or "info")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logs", help="Set log level")
+    args = parser.parse_args()
+    baseLogger(args.logs or "info")
+else:
+    baseLogger("info")
 
 from Configs import baseConfig
 
 config = baseConfig()
 api = config["API"]
 SSL = config["SSL_API"]
-export = config["EXPORT"]
 
 from flask import Flask
-from flask import send_from_directory
 from flask_cors import CORS
 
+from werkzeug.exceptions import NotFound
+
 from routes.data_collector.v1 import v1 as data_collector_api_v1
 from routes.admin.v1 import v1 as admin_v1
 
@@ -25,8 +29,18 @@ from controllers.sync_database import create_database
 from controllers.sync_database import create_tables
 from controllers.sync_database import create_super_admin
 from controllers.SSL import isSSL
+from controllers.responses import compress_response
+from controllers.downloads import send_artifact
+
+from models.sms_outbox import SMS_Outbox_Model
+from models.artifacts import Artifact_Model
+
+from schemas.users.baseModel import users_db
+from schemas.sites.baseModel import sites_db
+from schemas.records.baseModel import records_db
 
 # from schemas.migration import migrate_records
+# from schemas.migration import migrate_indexes
 
 app = Flask(__name__)
 
@@ -34,26 +48,66 @@ CORS(
     app,
     origins=api["ORIGINS"],
     supports_credentials=True,
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-create_database()
-create_tables()
+def start() -> None:
+    """
+    Prepare the databases and start this process's background workers.
+    Export pool processes import this module as __mp_main__ and skip it.
+
+    Returns:
+        None
+    """
+    create_database()
+    create_tables()
+
+    # migrate_records()
+    # migrate_indexes()
 
-# migrate_records()
+    create_super_admin()
 
-create_super_admin()
+    # resume messages queued before a restart
+    try:
+        SMS_Outbox_Model().start()
+    except ValueError as error:
+        app.logger.warning("SMS outbox not started: %s" % error)
+
+    # removes expired export artifacts off the request path
+    Artifact_Model().start()
 
 app.register_blueprint(data_collector_api_v1, url_prefix="/v1")
 app.register_blueprint(admin_v1, url_prefix="/v1/admin")
 
+# after the blueprints' own after_request, so it sees the final body
+app.after_request(compress_response)
+
+# returns the connections of routes outside the blueprints to the pools
+@app.teardown_request
+def close_databases(error=None):
+    for db in (users_db, sites_db, records_db):
+        if not db.is_closed():
+            db.close()
+
 @app.route("/downloads/<path:path>")
 def downloads(path):
     app.logger.debug("Requesting %s download ..." % path)
-    return send_from_directory(directory="%s/datasets" % export["PATH"], path=path)
 
-checkSSL = isSSL(path_crt_file=SSL["CERTIFICATE"], path_key_file=SSL["KEY"], path_pem_file=SSL["PEM"])
+    try:
+        return send_artifact(name=path)
+
+    except NotFound as err:
+        return str(err), 404
+
+    except Exception as err:
+        app.logger.exception(err)
+        return "internal server error", 500
 
 if __name__ == "__main__":
+    start()
+
+    checkSSL = isSSL(path_crt_file=SSL["CERTIFICATE"], path_key_file=SSL["KEY"], path_pem_file=SSL["PEM"])
+
     if checkSSL:
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         context.load_cert_chain(SSL["CERTIFICATE"], SSL["KEY"])
@@ -62,4 +116,7 @@ if __name__ == "__main__":
         app.run(host=api["HOST"], port=SSL["PORT"], ssl_context=context)
     else:
         app.logger.info("Running on un-secure port: %s" % api['PORT'])
-        app.run(host=api["HOST"], port=api["PORT"])
\ No newline at end of file
+        app.run(host=api["HOST"], port=api["PORT"])
+elif __name__ != "__mp_main__":
+    # imported by apache.wsgi
+    start()
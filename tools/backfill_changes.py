@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models.records import Record_Model
+
+def backfill(batch: int, after: int = 0) -> int:
+    Record = Record_Model()
+    database = Record.Records._meta.database
+
+    while True:
+        last = Record.backfill_changes(after_record_id=after, limit=batch)
+
+        if not last:
+            break
+
+        after = last
+
+    if not database.is_closed():
+        database.close()
+
+    return after
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="INFO")
+
+    parser = argparse.ArgumentParser(description="Add existing records and their child forms to the change feed")
+    parser.add_argument("--batch", help="Records fed per transaction", type=int, default=1000)
+    parser.add_argument("--after", help="Resume after this record_id", type=int, default=0)
+    args = parser.parse_args()
+
+    last = backfill(batch=args.batch, after=args.after)
+    logging.info("- Change feed filled up to record %d" % last)
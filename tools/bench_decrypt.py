@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from security.data import Data
+
+fields = [
+    "records_name",
+    "records_address",
+    "records_telephone",
+    "records_telephone_2",
+    "records_art_unique_code",
+    "records_ward_bed_number",
+    "records_requester_name",
+    "records_requester_telephone"
+]
+
+def make_rows(count: int) -> list:
+    rows = []
+
+    for index in range(count):
+        # a record's fields share the iv of the Data instance that wrote them
+        data = Data()
+        row = {"record_id": index, "iv": data.iv}
+
+        for field in fields:
+            row[field] = data.encrypt("%s %d" % (field, index))["e_data"]
+
+        rows.append(row)
+
+    return rows
+
+def per_row(rows: list) -> dict:
+    data = Data()
+    timings = {}
+
+    start = time.perf_counter()
+    expected = [{field: data.decrypt(row[field], row["iv"]) for field in fields} for row in rows]
+    timings["decrypt"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = data.decrypt_rows(rows=rows, fields=fields)
+    timings["decrypt_rows"] = time.perf_counter() - start
+
+    assert [{field: row[field] for field in fields} for row in result] == expected
+
+    return timings
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="WARNING")
+
+    parser = argparse.ArgumentParser(description="Compare per-field and batch record decryption")
+    parser.add_argument("--rows", help="Row counts to time", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    for count in args.rows:
+        rows = make_rows(count)
+
+        for name, seconds in per_row(rows).items():
+            print("%7d rows  %-28s %8.3fs  %6.2fus/row" % (count, name, seconds, seconds / count * 1e6))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import hashlib
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+
+import models.exports as exports
+
+from models.exports import Export_Model
+
+def timed_export(Export, filepath: str, repeat: int, **params) -> tuple:
+    best = None
+
+    # the first run also starts the pool's processes
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Export.__csv_file__(filepath, **params)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    with open(filepath, "rb") as fh:
+        checksum = hashlib.sha256(fh.read()).hexdigest()
+
+    os.remove(filepath)
+
+    return best, checksum
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="WARNING")
+
+    parser = argparse.ArgumentParser(description="Time a CSV export from the configured records database across process counts")
+    parser.add_argument("--start", help="First test request date", required=True)
+    parser.add_argument("--end", help="Last test request date", required=True)
+    parser.add_argument("--region", help="Region id or all", default="all")
+    parser.add_argument("--site", help="Site id or all", default="all")
+    parser.add_argument("--decrypt", help="Export decrypted fields", action="store_true")
+    parser.add_argument("--processes", help="Process counts to time", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", help="Runs per process count, the best is kept", type=int, default=2)
+    args = parser.parse_args()
+
+    Export = Export_Model()
+
+    params = {
+        "start_date": parse(args.start),
+        "end_date": parse(args.end) + relativedelta(hours=23, minutes=59, seconds=59),
+        "permitted_decrypted_data": args.decrypt,
+        "region_id": args.region,
+        "site_id": args.site
+    }
+
+    rows = Export.count(params["start_date"], params["end_date"], args.region, args.site)
+    print("%d records, %d core(s)" % (rows, os.cpu_count()))
+
+    filepath = os.path.join(tempfile.mkdtemp(), "export.csv")
+    baseline = None
+    expected = None
+
+    for count in args.processes:
+        exports.processes = count
+        exports.reset_pool()
+
+        seconds, checksum = timed_export(Export, filepath, args.repeat, **params)
+
+        baseline = baseline or seconds
+        expected = expected or checksum
+
+        print("%2d process(es)  %8.2fs  %8.0f rows/s  x%.2f  %s" % (
+            count,
+            seconds,
+            rows / seconds if seconds else 0,
+            baseline / seconds if seconds else 0,
+            "same output" if checksum == expected else "OUTPUT DIFFERS"
+        ))
+
+    exports.reset_pool()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from flask import Flask
+from flask import jsonify
+
+import controllers.responses as responses
+
+def make_rows(count: int) -> list:
+    rnd = random.Random(1)
+    rows = []
+
+    # shaped like a records listing with every column, dates included
+    for index in range(count):
+        rows.append({
+            "record_id": index,
+            "site_id": rnd.randint(1, 40),
+            "region_id": rnd.randint(1, 10),
+            "records_user_id": rnd.randint(1, 200),
+            "records_date": datetime(2022, 1, 1) + timedelta(minutes=index),
+            "records_date_of_test_request": date(2022, 1, 1) + timedelta(days=index % 365),
+            "records_name": "Patient %d" % index,
+            "records_age": rnd.randint(1, 90),
+            "records_sex": rnd.choice(["male", "female"]),
+            "records_address": "Quartier %d" % rnd.randint(1, 500),
+            "records_telephone": "+2376%08d" % rnd.randint(0, 99999999),
+            "records_status": rnd.choice(["inpatient", "outpatient"]),
+            "records_symptoms_current_cough": rnd.random() < .5,
+            "records_symptoms_fever": rnd.random() < .5,
+            "records_reason_for_test": rnd.choice(["presumptive_tb", "follow_up"]),
+            "records_tb_treatment_history": rnd.choice(["new", "relapse", "after_loss_to_follow_up"]),
+            "records_sms_notifications": rnd.random() < .5,
+            "records_requester_name": None
+        })
+
+    return rows
+
+def timed(function, repeat: int) -> tuple:
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    return best, result
+
+def compare(rows: list, repeat: int) -> None:
+    app = Flask(__name__)
+
+    with app.test_request_context():
+        seconds, body = timed(lambda: jsonify(rows).get_data(), repeat)
+        print("%7d rows  %-24s %8.2fms  %9d bytes" % (len(rows), "jsonify", seconds * 1e3, len(body)))
+
+        for name in ["json", "orjson"]:
+            if name == "orjson" and not responses.orjson:
+                continue
+
+            responses.json_encoder = name
+            seconds, data = timed(lambda: b"".join(responses.json_response(rows).response), repeat)
+            assert data == body, "%s output differs from jsonify" % name
+            print("%7d rows  %-24s %8.2fms  %9d bytes" % (len(rows), "json_response (%s)" % name, seconds * 1e3, len(data)))
+
+        for encoding in responses.encodings:
+            seconds, data = timed(lambda: responses.compress(body, encoding), repeat)
+            print("%7d rows  %-24s %8.2fms  %9d bytes  %5.1f%%" % (len(rows), encoding, seconds * 1e3, len(data), len(data) / len(body) * 100))
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="WARNING")
+
+    parser = argparse.ArgumentParser(description="Compare JSON encoders and response compression on a records listing")
+    parser.add_argument("--rows", help="Row counts to time", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--repeat", help="Runs per measurement, the best is kept", type=int, default=5)
+    args = parser.parse_args()
+
+    for count in args.rows:
+        compare(make_rows(count), repeat=args.repeat)
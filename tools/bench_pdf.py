@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import resource
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from datetime import datetime
+from datetime import timedelta
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the PDF service: reads the posted rows and replies with a path.
+    """
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        remaining = length
+
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+
+        data = b"/downloads/record_export.pdf"
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format % args)
+
+def value(field, index: int, rnd: random.Random):
+    if field.field_type in ["DATETIME", "DATE"]:
+        return datetime(2022, 1, 1) + timedelta(minutes=index)
+    elif field.field_type in ["INT", "BIGINT", "AUTO", "BIGAUTO"]:
+        return index
+    elif field.field_type == "BOOL":
+        return rnd.random() < .5
+    elif rnd.random() < .3:
+        return None
+
+    return "%s %d" % (field.name, index)
+
+def make_rows(Export, count: int):
+    rnd = random.Random(1)
+
+    for index in range(1, count + 1):
+        row = {name: value(field, index, rnd) for name, field in Export.Records._meta.fields.items()}
+        row.update({"record_id": index, "site_id": 1, "region_id": 1})
+
+        children = {}
+
+        for child, _ in Export.children:
+            children[child] = {name: value(field, index, rnd) for name, field in child._meta.fields.items()}
+
+        yield row, children
+
+def run(renderer: str, count: int, pdf_url: str) -> dict:
+    """
+    Export synthetic records with one renderer, in this process.
+    """
+    import models.exports as exports
+
+    from models.exports import Export_Model
+
+    directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(directory, "datasets"))
+
+    exports.pdf_renderer = renderer
+    exports.export["PATH"] = directory
+    exports.export["PDF_URL"] = pdf_url
+
+    Export = Export_Model()
+    Export.__rows__ = lambda *args, **kwargs: make_rows(Export, count)
+    Export.__names__ = lambda: ({1: "Site"}, {1: "Region"})
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    result = Export.pdf(start_date=datetime(2022, 1, 1), end_date=datetime(2022, 12, 31), permitted_decrypted_data=True, region_id="all", site_id="all")
+    seconds = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    files = os.listdir(os.path.join(directory, "datasets"))
+    size = sum(os.path.getsize(os.path.join(directory, "datasets", name)) for name in files)
+
+    return {"result": result, "seconds": seconds, "baseline_kb": baseline, "peak_kb": peak, "bytes": size}
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="WARNING")
+
+    parser = argparse.ArgumentParser(description="Compare peak memory and time of the native and service PDF export renderers")
+    parser.add_argument("--rows", help="Record counts to export", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--renderer", help=argparse.SUPPRESS, choices=["native", "service"])
+    parser.add_argument("--pdf-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # each measurement runs in its own process, peak RSS never goes down
+    if args.renderer:
+        print(json.dumps(run(renderer=args.renderer, count=args.rows[0], pdf_url=args.pdf_url)))
+        sys.exit(0)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pdf_url = "http://127.0.0.1:%d" % server.server_port
+
+    for count in args.rows:
+        for renderer in ["service", "native"]:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--renderer", renderer, "--rows", str(count), "--pdf-url", pdf_url],
+                check=True, capture_output=True, text=True
+            ).stdout
+
+            result = json.loads(output.strip().splitlines()[-1])
+
+            print("%7d rows  %-8s %8.2fs  peak %7.1f MB (+%.1f MB)  %9d bytes written" % (
+                count,
+                renderer,
+                result["seconds"],
+                result["peak_kb"] / 1024,
+                (result["peak_kb"] - result["baseline_kb"]) / 1024,
+                result["bytes"]
+            ))
+
+    server.shutdown()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models.records import Record_Model
+
+def reindex(batch: int, after: int = 0) -> int:
+    Record = Record_Model()
+    database = Record.Records._meta.database
+
+    while True:
+        last = Record.reindex_records(after_record_id=after, limit=batch)
+
+        if not last:
+            break
+
+        after = last
+
+    if not database.is_closed():
+        database.close()
+
+    return after
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="INFO")
+
+    parser = argparse.ArgumentParser(description="Build the name and telephone search index of existing records")
+    parser.add_argument("--batch", help="Records decrypted and indexed per transaction", type=int, default=1000)
+    parser.add_argument("--after", help="Resume after this record_id", type=int, default=0)
+    args = parser.parse_args()
+
+    last = reindex(batch=args.batch, after=args.after)
+    logging.info("- Search index built up to record %d" % last)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+# number prefixes (after the country code) of each operator
+operators = {
+    "MTN": ["67", "650", "651", "652", "653", "654", "680", "681", "682", "683"],
+    "ORANGE": ["69", "655", "656", "657", "658", "659", "640"]
+}
+
+counters = {"operator_requests": 0, "operator_numbers": 0, "sms_requests": 0, "sms_messages": 0}
+counters_lock = threading.Lock()
+
+def operator_name(number: str) -> str:
+    digits = "".join(char for char in number if char.isdigit())
+
+    if digits.startswith("237"):
+        digits = digits[3:]
+
+    for name, prefixes in operators.items():
+        if any(digits.startswith(prefix) for prefix in prefixes):
+            return name
+
+    return ""
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the SMSWithoutBorders OpenAPI.
+
+    POST /v1/sms/operators fills in operator_name for every entry,
+    POST /v1/sms accepts a send and GET /stats returns request counters.
+    """
+    def do_GET(self) -> None:
+        if self.path != "/stats":
+            return self.reply(404, {"error": "not found"})
+
+        with counters_lock:
+            self.reply(200, counters)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"null")
+
+        if self.path == "/v1/sms/operators":
+            with counters_lock:
+                counters["operator_requests"] += 1
+                counters["operator_numbers"] += len(body)
+
+            for entry in body:
+                entry["operator_name"] = operator_name(entry["number"])
+
+            return self.reply(200, body)
+
+        if self.path == "/v1/sms":
+            with counters_lock:
+                counters["sms_requests"] += 1
+                counters["sms_messages"] += len(body["data"])
+
+            for entry in body["data"]:
+                logging.info("SMS to %s (%s): %s" % (entry["number"], entry["operator_name"], entry["text"]))
+
+            return self.reply(200, {"message": "sent"})
+
+        self.reply(404, {"error": "not found"})
+
+    def reply(self, status: int, body) -> None:
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format % args)
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level="INFO")
+
+    parser = argparse.ArgumentParser(description="Local SMSWithoutBorders OpenAPI stub, set OPENAPI_URL to its address")
+    parser.add_argument("--host", help="Interface to listen on", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=9000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    logging.info("- SMS stub listening on http://%s:%d" % (args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()